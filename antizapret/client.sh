@@ -6,6 +6,9 @@
 #
 # Срок действия в днях - только для OpenVPN
 #
+# SKIP_WG_SYNC=1 - не применять изменения WireGuard (wg syncconf) после добавления/удаления клиента
+# SKIP_CRL=1 - не пересоздавать CRL после удаления клиента OpenVPN
+#
 set -e
 
 handle_error() {
@@ -147,9 +150,12 @@ deleteOpenVPN(){
 	cd /etc/openvpn/easyrsa3
 
 	/usr/share/easy-rsa/easyrsa --batch revoke $CLIENT_NAME
-	EASYRSA_CRL_DAYS=3650 /usr/share/easy-rsa/easyrsa gen-crl
-	cp ./pki/crl.pem /etc/openvpn/server/keys/crl.pem
-	chmod 644 /etc/openvpn/server/keys/crl.pem
+	# SKIP_CRL=1: массовое удаление пересоздаёт CRL один раз в конце
+	if [[ -z "$SKIP_CRL" ]]; then
+		EASYRSA_CRL_DAYS=3650 /usr/share/easy-rsa/easyrsa gen-crl
+		cp ./pki/crl.pem /etc/openvpn/server/keys/crl.pem
+		chmod 644 /etc/openvpn/server/keys/crl.pem
+	fi
 
 	rm -f //root/antizapret/client/openvpn/vpn/$FILEVPN_NAME - ${FILE_NAME}.ovpn
 	rm -f /root/antizapret/client/openvpn/antizapret-udp/antizapret-$FILE_NAME-udp.ovpn
@@ -240,7 +246,7 @@ PresharedKey = ${CLIENT_PRESHARED_KEY}
 AllowedIPs = ${CLIENT_IP}/32
 " >> "/etc/wireguard/antizapret.conf"
 
-	if systemctl is-active --quiet wg-quick@antizapret; then
+	if [[ -z "$SKIP_WG_SYNC" ]] && systemctl is-active --quiet wg-quick@antizapret; then
 		wg syncconf antizapret <(wg-quick strip antizapret 2>/dev/null)
 	fi
 
@@ -270,7 +276,7 @@ PresharedKey = ${CLIENT_PRESHARED_KEY}
 AllowedIPs = ${CLIENT_IP}/32
 " >> "/etc/wireguard/vpn.conf"
 
-	if systemctl is-active --quiet wg-quick@vpn; then
+	if [[ -z "$SKIP_WG_SYNC" ]] && systemctl is-active --quiet wg-quick@vpn; then
 		wg syncconf vpn <(wg-quick strip vpn 2>/dev/null)
 	fi
 
@@ -297,11 +303,11 @@ deleteWireGuard(){
 	rm -f /root/antizapret/client/{wireguard,amneziawg}/antizapret/antizapret-$FILE_NAME-*.conf
 	rm -f /root/antizapret/client/{wireguard,amneziawg}/vpn/vpn-$FILE_NAME-*.conf
 
-	if systemctl is-active --quiet wg-quick@antizapret; then
+	if [[ -z "$SKIP_WG_SYNC" ]] && systemctl is-active --quiet wg-quick@antizapret; then
 		wg syncconf antizapret <(wg-quick strip antizapret 2>/dev/null)
 	fi
 
-	if systemctl is-active --quiet wg-quick@vpn; then
+	if [[ -z "$SKIP_WG_SYNC" ]] && systemctl is-active --quiet wg-quick@vpn; then
 		wg syncconf vpn <(wg-quick strip vpn 2>/dev/null)
 	fi
 
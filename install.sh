@@ -269,6 +269,16 @@ if [ -d "$SRC_ROOT" ]; then
   done
 fi
 
+# 9.1) Пароль management-интерфейса OpenVPN: после chmod 777, файл должен быть доступен только root
+MGMT_PW="/etc/openvpn/server/management-pw"
+mkdir -p /etc/openvpn/server
+if [ ! -s "$MGMT_PW" ]; then
+  (umask 077 && openssl rand -hex 24 > "$MGMT_PW")
+  echo "  Сгенерирован пароль management-интерфейса: $MGMT_PW"
+fi
+chmod 600 "$MGMT_PW"
+echo "  Права 600 выставлены на $MGMT_PW"
+
 echo
 
 ### 10) Создание systemd-юнита vpnbot.service
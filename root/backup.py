@@ -0,0 +1,238 @@
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import socket
+import tarfile
+import tempfile
+import time
+from datetime import datetime
+
+from db import snapshot_db
+from profiles import get_server_ip
+
+BACKUP_DIR = "/root/antizapret/backups"
+# Те же пути внутри архива, что и у client.sh 8, плюс vpn.db
+BACKUP_SOURCES = [
+    ("/etc/openvpn/easyrsa3", "easyrsa3"),
+    ("/etc/wireguard/antizapret.conf", "wireguard/antizapret.conf"),
+    ("/etc/wireguard/vpn.conf", "wireguard/vpn.conf"),
+    ("/etc/wireguard/key", "wireguard/key"),
+    ("/root/antizapret/config", "config"),
+]
+DB_ARCNAME = "vpn.db"
+INFO_ARCNAME = "backup.json"
+STATE_FILE = "state.json"
+# auto — zstd, если установлен пакет zstandard, иначе gzip
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "auto")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "10"))
+BACKUP_FULL_EVERY = int(os.getenv("BACKUP_FULL_EVERY", "7"))
+HASH_CHUNK = 1024 * 1024
+
+_ARCHIVE_RE = re.compile(r"^backup-.+-(?P<stamp>\d{8}-\d{6})-(?P<kind>full|incr)\.tar\.(gz|zst)$")
+_LABEL_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+
+def _safe_label(label):
+    # Метка идёт в имя файла: только [A-Za-z0-9._-], без "/" и пробелов
+    return _LABEL_UNSAFE.sub("_", label or "").strip("._") or "server"
+
+class _HashingReader:
+    # Считает sha256 того, что tarfile читает из файла: полный архив обходится одним проходом
+    def __init__(self, f, h):
+        self.f = f
+        self.h = h
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.h.update(data)
+        return data
+
+def _hash_file(f):
+    h = hashlib.sha256()
+    for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+        h.update(chunk)
+    return h.hexdigest()
+
+def _compression():
+    # Возвращает (расширение, функция, оборачивающая файл в сжимающий поток)
+    if BACKUP_COMPRESSION in ("auto", "zstd"):
+        try:
+            import zstandard
+        except ImportError:
+            if BACKUP_COMPRESSION == "zstd":
+                print("[backup] Пакет zstandard не установлен, используется gzip")
+        else:
+            return "zst", lambda f: zstandard.ZstdCompressor(level=10).stream_writer(f)
+    return "gz", lambda f: gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6)
+
+def _walk(sources):
+    # (путь, имя в архиве) для всех файлов, каталогов и ссылок источников, в стабильном порядке
+    for source, arcname in sources:
+        if not os.path.lexists(source):
+            continue
+        yield source, arcname
+        if not os.path.isdir(source) or os.path.islink(source):
+            continue
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            rel = os.path.relpath(root, source)
+            prefix = arcname if rel == "." else f"{arcname}/{rel}"
+            for name in dirs + sorted(files):
+                yield os.path.join(root, name), f"{prefix}/{name}"
+
+class BackupEngine:
+    # Бэкап без промежуточной копии: tar пишется потоком прямо из исходных путей в сжатый файл.
+    #  - инкрементальный архив содержит только файлы, чей sha256 изменился с прошлого бэкапа,
+    #    и список удалённых в backup.json; каждый BACKUP_FULL_EVERY-й бэкап — полный;
+    #  - хэш не пересчитывается, если у файла не изменились mtime и размер;
+    #  - vpn.db снимается онлайн через SQLite backup API;
+    #  - хранятся последние BACKUP_KEEP архивов, но не меньше, чем нужно для восстановления цепочки.
+
+    def __init__(self, backup_dir=BACKUP_DIR, sources=BACKUP_SOURCES):
+        self.backup_dir = backup_dir
+        self.sources = list(sources)
+        self._lock = asyncio.Lock()
+
+    def busy(self):
+        return self._lock.locked()
+
+    async def run(self, label=None, full=False):
+        # По умолчанию метка — локальный IPv4 сервера (как у client.sh 8), иначе имя хоста
+        label = _safe_label(label or await get_server_ip() or socket.gethostname())
+        async with self._lock:
+            os.makedirs(self.backup_dir, mode=0o700, exist_ok=True)
+            fd, db_copy = tempfile.mkstemp(dir=self.backup_dir, prefix=".db-")
+            os.close(fd)
+            try:
+                await snapshot_db(db_copy)
+                return await asyncio.to_thread(self._build, label, db_copy, full)
+            finally:
+                try:
+                    os.unlink(db_copy)
+                except FileNotFoundError:
+                    pass
+
+    def _state_path(self):
+        return os.path.join(self.backup_dir, STATE_FILE)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path(), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Без архива, к которому относится манифест, инкремент не восстановить
+        if not os.path.exists(os.path.join(self.backup_dir, state.get("archive", ""))):
+            return None
+        return state
+
+    def _build(self, label, db_copy, full):
+        state = self._load_state()
+        previous = state["files"] if state else {}
+        incremental = bool(state) and not full and state.get("since_full", 0) + 1 < BACKUP_FULL_EVERY
+        kind = "incr" if incremental else "full"
+        ext, compressor = _compression()
+        name = f"backup-{label}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{kind}.tar.{ext}"
+        path = os.path.join(self.backup_dir, name)
+
+        manifest = {}
+        written = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.backup_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                stream = compressor(raw)
+                with tarfile.open(fileobj=stream, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                    for source, arcname in _walk(self.sources + [(db_copy, DB_ARCNAME)]):
+                        info = tar.gettarinfo(source, arcname)
+                        if not info.isreg():
+                            # Каталоги и ссылки ничего не весят — кладём в каждый архив ради прав доступа
+                            tar.addfile(info)
+                            continue
+                        # Файл читается кусками прямо в tar, размер и mtime — с открытого дескриптора
+                        with open(source, "rb") as f:
+                            info = tar.gettarinfo(arcname=arcname, fileobj=f)
+                            st = os.fstat(f.fileno())
+                            cached = previous.get(arcname)
+                            if incremental:
+                                if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                                    digest = cached[2]
+                                else:
+                                    digest = _hash_file(f)
+                                    f.seek(0)
+                                if cached and cached[2] == digest:
+                                    manifest[arcname] = [st.st_mtime_ns, st.st_size, digest]
+                                    continue
+                                tar.addfile(info, f)
+                            else:
+                                h = hashlib.sha256()
+                                tar.addfile(info, _HashingReader(f, h))
+                                digest = h.hexdigest()
+                        manifest[arcname] = [st.st_mtime_ns, st.st_size, digest]
+                        written += 1
+                    deleted = sorted(set(previous) - set(manifest)) if incremental else []
+                    meta = json.dumps({
+                        "kind": kind,
+                        "base": state["archive"] if incremental else None,
+                        "created": int(time.time()),
+                        "files": written,
+                        "deleted": deleted,
+                    }, ensure_ascii=False, indent=2).encode("utf-8")
+                    info = tarfile.TarInfo(INFO_ARCNAME)
+                    info.size = len(meta)
+                    info.mtime = int(time.time())
+                    tar.addfile(info, io.BytesIO(meta))
+                stream.close()
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        self._save_state({
+            "archive": name,
+            "since_full": state.get("since_full", 0) + 1 if incremental else 0,
+            "files": manifest,
+        })
+        return {
+            "path": path,
+            "kind": kind,
+            "base": state["archive"] if incremental else None,
+            "files": written,
+            "deleted": len(deleted),
+            "size": os.path.getsize(path),
+            "removed": self._apply_retention(),
+        }
+
+    def _save_state(self, state):
+        fd, tmp_path = tempfile.mkstemp(dir=self.backup_dir, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path())
+
+    def _apply_retention(self):
+        archives = []
+        for name in os.listdir(self.backup_dir):
+            match = _ARCHIVE_RE.match(name)
+            if match:
+                archives.append((match.group("stamp"), match.group("kind"), name))
+        archives.sort()
+        if len(archives) <= BACKUP_KEEP:
+            return []
+        # Самый старый оставляемый инкремент тянет за собой свой полный архив
+        start = len(archives) - BACKUP_KEEP
+        while start > 0 and archives[start][1] != "full":
+            start -= 1
+        removed = []
+        for _, _, name in archives[:start]:
+            try:
+                os.remove(os.path.join(self.backup_dir, name))
+                removed.append(name)
+            except FileNotFoundError:
+                pass
+        return removed
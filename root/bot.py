@@ -3,42 +3,60 @@ logging.basicConfig(
     level=logging.DEBUG,
     format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 )
-import requests
 import os
 import re
-import sys
 import asyncio
 import hashlib
+import html
 import json
-import glob
-import time
-import uuid
 from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile, BotCommand, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile, BufferedInputFile, BotCommand, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.client.default import DefaultBotProperties
-import subprocess
-from datetime import datetime, timedelta, timezone
-import psutil
-import platform
-import socket
-import sqlite3
+from aiogram.exceptions import TelegramRetryAfter
+from datetime import datetime
 from dotenv import load_dotenv
-from yookassa import Configuration, Payment
-from db import init_db, get_profile_name, save_profile_name
 
-# --- Настройка ЮKassa ---
+# Модули ниже читают настройки из окружения при импорте, поэтому .env загружаем до них
 load_dotenv()
+
+from db import (
+    init_db, close_db, import_legacy_files, get_profile_name, save_profile_name, get_user_id_by_name,
+    get_user_ids_by_names, get_profile_names,
+    get_balance, get_balances_page, get_transactions, get_last_transactions, get_meta, set_meta,
+)
+from runner import DEFAULT_TIMEOUT, run_client_script
+from registry import client_registry
+from state import StateStore
+from certs import days_left, expiry_index, get_cert_expiry_map, pki_lock
+from wireguard import get_online_peers
+from openvpn_status import status_aggregator
+from management import management_pool
+from broadcast import BroadcastEngine
+from file_cache import file_id_cache
+from middleware import CallbackGuard, client_locks
+from metrics import server_metrics
+from payments import PaymentService, configure_yookassa
+from expiry import ExpiryScheduler
+from profiles import load_context, profile_catalog, render_openvpn_client
+from bulk import BulkError, BulkProvisioner, collect_clients, export_clients, parse_bulk_document
+from recreate import RecreateJob
+from bundles import build_bundle, remove_bundles
+from backup import BackupEngine
+from wg_peers import wg_peers
+from webhook import BOT_MODE, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL, create_app, serve
+
+# --- Настройка ЮKassa ---
 YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
 YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
 
 if not YOOKASSA_SHOP_ID or not YOOKASSA_SECRET_KEY:
     raise RuntimeError("YOOKASSA_SHOP_ID или YOOKASSA_SECRET_KEY не заданы в .env")
 
-Configuration.configure(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY)
+configure_yookassa(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY)
 
 # --- Состояния ---
 class Payment(StatesGroup):
@@ -57,6 +75,9 @@ class SetEmojiState(StatesGroup):
 class AdminAnnounce(StatesGroup):
     waiting_for_text = State()
 
+class AdminBulk(StatesGroup):
+    waiting_for_document = State()
+
 class VPNSetup(StatesGroup):
     entering_user_id = State()
     entering_client_name_manual = State()
@@ -70,53 +91,6 @@ class VPNSetup(StatesGroup):
     choosing_wg_type = State()
     confirming_rename = State()
 
-# --- Инициализация базы данных ---
-DB_PATH = "vpn.db"
-def init_db_with_balances(db_path="vpn.db"):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            profile_name TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS balances (
-            user_id INTEGER PRIMARY KEY,
-            balance REAL DEFAULT 0.0
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-# --- Функции для работы с балансом ---
-def get_balance(user_id, db_path="vpn.db"):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("SELECT balance FROM balances WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else 0.0
-
-def update_balance(user_id, amount, db_path="vpn.db"):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO balances (user_id, balance) VALUES (?, ?)", 
-                (user_id, amount))
-    conn.commit()
-    conn.close()
-
-def get_all_balances(db_path="vpn.db"):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, balance FROM balances")
-    balances = cur.fetchall()
-    conn.close()
-    return balances
-
-init_db_with_balances(DB_PATH)
-
 # --- Настройки бота ---
 cancel_markup = ReplyKeyboardMarkup(
     keyboard=[[KeyboardButton(text="❌ Отмена")]],
@@ -132,6 +106,8 @@ EMOJI_FILE = "user_emojis.json"
 MAX_BOT_MENUS = 1
 MAX_MENUS_PER_USER = 3
 ITEMS_PER_PAGE = 5
+BALANCES_PER_PAGE = 10
+HISTORY_PER_PAGE = 10
 AUTHORIZED_USERS = [int(os.getenv("ADMIN_ID"))]
 
 FILEVPN_NAME = os.getenv("FILEVPN_NAME")
@@ -141,8 +117,17 @@ ADMIN_ID = int(os.getenv("ADMIN_ID"))
 if not FILEVPN_NAME or not BOT_TOKEN or not ADMIN_ID:
     raise RuntimeError("FILEVPN_NAME, BOT_TOKEN или ADMIN_ID не заданы в .env")
 
+if BOT_MODE not in ("polling", "webhook"):
+    raise RuntimeError(f"Неизвестный BOT_MODE={BOT_MODE!r}: ожидается polling или webhook")
+
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise RuntimeError("WEBHOOK_URL не задан в .env для BOT_MODE=webhook")
+
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
+dp.callback_query.outer_middleware(CallbackGuard())
+broadcast_engine = BroadcastEngine(bot)
+payment_service = PaymentService(bot)
 
 BOT_DESCRIPTION = """
 👴🕶️ БичиVPN — bi4i.ru
@@ -160,129 +145,43 @@ BOT_SHORT_DESCRIPTION = "👴🕶️ БичиVPN — приватный VPN за
 BOT_ABOUT = "Бот для пользования услугами VPN от БичиVPN."
 
 # --- Функции для работы с файлами и пользователями ---
+state_store = StateStore()
+
 def save_user_id(user_id):
-    try:
-        user_id = str(user_id)
-        if not os.path.exists(USERS_FILE):
-            with open(USERS_FILE, "w") as f:
-                f.write(f"{user_id}\n")
-        else:
-            with open(USERS_FILE, "r+") as f:
-                users = set(line.strip() for line in f)
-                if user_id not in users:
-                    f.write(f"{user_id}\n")
-    except Exception as e:
-        print(f"[save_user_id] Ошибка при сохранении user_id: {e}")
+    state_store.add_user(user_id)
 
 def remove_user_id(user_id):
-    if not os.path.exists(USERS_FILE):
-        return
-    try:
-        with open(USERS_FILE, "r") as f:
-            lines = [line.strip() for line in f if line.strip().isdigit()]
-        updated = [line for line in lines if line != str(user_id)]
-        with open(USERS_FILE, "w") as f:
-            for uid in updated:
-                f.write(f"{uid}\n")
-    except Exception as e:
-        print(f"[remove_user_id] Не удалось обновить {USERS_FILE}: {e}")
+    state_store.remove_user(user_id)
 
 def remove_approved_user(user_id):
-    if not os.path.exists(APPROVED_FILE):
-        return
-    try:
-        with open(APPROVED_FILE, "r") as f:
-            lines = [line.strip() for line in f]
-        updated = [line for line in lines if line != str(user_id)]
-        with open(APPROVED_FILE, "w") as f:
-            for uid in updated:
-                f.write(f"{uid}\n")
-    except Exception as e:
-        print(f"[remove_approved_user] Не удалось обновить {APPROVED_FILE}: {e}")
+    state_store.unapprove(user_id)
 
 def add_pending(user_id, username, fullname):
-    pending = {}
-    if os.path.exists(PENDING_FILE):
-        with open(PENDING_FILE, "r") as f:
-            pending = json.load(f)
-    pending[str(user_id)] = {"username": username, "fullname": fullname}
-    with open(PENDING_FILE, "w") as f:
-        json.dump(pending, f)
+    state_store.add_pending(user_id, username, fullname)
 
 def remove_pending(user_id):
-    if not os.path.exists(PENDING_FILE):
-        return
-    with open(PENDING_FILE, "r") as f:
-        pending = json.load(f)
-    pending.pop(str(user_id), None)
-    with open(PENDING_FILE, "w") as f:
-        json.dump(pending, f)
+    state_store.remove_pending(user_id)
 
 def is_pending(user_id):
-    if not os.path.exists(PENDING_FILE):
-        return False
-    try:
-        with open(PENDING_FILE, "r") as f:
-            pending = json.load(f)
-    except Exception:
-        pending = {}
-    return str(user_id) in pending
+    return state_store.is_pending(user_id)
 
 def is_approved_user(user_id):
-    user_id = str(user_id)
-    if not os.path.exists(APPROVED_FILE):
-        return False
-    with open(APPROVED_FILE, "r") as f:
-        approved = [line.strip() for line in f]
-    return user_id in approved
+    return state_store.is_approved(user_id)
 
 def approve_user(user_id):
-    user_id = str(user_id)
-    if not is_approved_user(user_id):
-        with open(APPROVED_FILE, "a") as f:
-            f.write(user_id + "\n")
+    state_store.approve(user_id)
 
 def set_user_emoji(user_id, emoji):
-    data = {}
-    if os.path.exists(EMOJI_FILE):
-        with open(EMOJI_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    data[str(user_id)] = emoji
-    with open(EMOJI_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False)
+    state_store.set_emoji(user_id, emoji)
 
 def get_user_emoji(user_id):
-    if not os.path.exists(EMOJI_FILE):
-        return ""
-    with open(EMOJI_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data.get(str(user_id), "")
+    return state_store.get_emoji(user_id)
 
-def get_server_info():
-    ip = get_external_ip()
-    uptime_seconds = int(psutil.boot_time())
-    uptime = datetime.now() - datetime.fromtimestamp(uptime_seconds)
-    cpu = psutil.cpu_percent()
-    mem = psutil.virtual_memory().percent
-    hostname = socket.gethostname()
-    os_version = platform.platform()
-    return f"""<b>💻 Сервер:</b> <code>{hostname}</code>
-<b>🌐 IP:</b> <code>{ip}</code>
-<b>🕒 Аптайм:</b> <code>{str(uptime).split('.')[0]}</code>
-<b>🧠 RAM:</b> <code>{mem}%</code>
-<b>⚡ CPU:</b> <code>{cpu}%</code>
-<b>🛠 ОС:</b> <code>{os_version}</code>
-"""
+def get_user_emojis(user_ids):
+    return state_store.get_emojis(user_ids)
 
-def get_external_ip():
-    try:
-        response = requests.get("https://api.ipify.org", timeout=10)
-        if response.status_code == 200:
-            return response.text
-        return "IP не найден"
-    except requests.RequestException as e:
-        return f"Ошибка при запросе: {e}"
-SERVER_IP = get_external_ip()
+def get_server_info():
+    return server_metrics.render()
 
 # --- Меню ---
 def create_main_menu():
@@ -294,20 +193,24 @@ def create_main_menu():
         [InlineKeyboardButton(text="Заявки на получение доступа", callback_data="admin_pending_list")],
         [InlineKeyboardButton(text="Управление сервером VPN", callback_data="server_manage_menu")],
         [InlineKeyboardButton(text="Сделать объявление", callback_data="announce_menu")],
+        [InlineKeyboardButton(text="Импорт/экспорт клиентов", callback_data="bulk_menu")],
         [InlineKeyboardButton(text="В сети", callback_data="who_online")],
         [InlineKeyboardButton(text="Просмотреть балансы", callback_data="view_balances")],
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def create_user_menu(client_name, back_callback="main_menu", is_admin=False, user_id=None):
-    balance = get_balance(user_id) if user_id else 0.0
+async def create_user_menu(client_name, back_callback="main_menu", is_admin=False, user_id=None):
+    balance = await get_balance(user_id) if user_id else 0.0
     keyboard = [
         [InlineKeyboardButton(text="🔐 OpenVPN", callback_data=f"select_openvpn_{client_name}")],
         [InlineKeyboardButton(text="🔗 WireGuard", callback_data=f"get_wg_{client_name}")],
         [InlineKeyboardButton(text="🌀 Amnezia", callback_data=f"get_amnezia_{client_name}")],
+        [InlineKeyboardButton(text="📦 Все конфиги одним архивом", callback_data=f"get_bundle_{client_name}")],
         [InlineKeyboardButton(text=f"💸 Пополнить баланс (Текущий: {balance:.2f} руб.)", 
                              callback_data=f"top_up_balance_{client_name}")]
     ]
+    if user_id:
+        keyboard.append([InlineKeyboardButton(text="📜 История операций", callback_data=f"balance_history_{user_id}_0")])
     if is_admin:
         keyboard.append([InlineKeyboardButton(text="🗑 Удалить клиента", callback_data=f"delete_openvpn_{client_name}")])
         keyboard.append([InlineKeyboardButton(text="😀 Установить смайл", callback_data=f"set_emoji_{client_name}")])
@@ -375,6 +278,12 @@ def make_users_tab_keyboard(active_tab: str):
 async def safe_send_message(chat_id, text, **kwargs):
     try:
         await bot.send_message(chat_id, text, **kwargs)
+    except TelegramRetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        try:
+            await bot.send_message(chat_id, text, **kwargs)
+        except Exception as e:
+            print(f"[Ошибка отправки сообщения] chat_id={chat_id}: {e}")
     except Exception as e:
         print(f"[Ошибка отправки сообщения] chat_id={chat_id}: {e}")
 
@@ -391,129 +300,156 @@ async def show_menu(chat_id, text, reply_markup):
     return msg
 
 async def delete_last_menus(user_id):
-    if not os.path.exists(LAST_MENUS_FILE):
+    ids = state_store.get_last_menus(user_id)
+    if not ids:
         return
-    with open(LAST_MENUS_FILE, "r") as f:
-        data = json.load(f)
-    ids = data.get(str(user_id), [])
     for mid in ids:
         try:
             await bot.delete_message(user_id, mid)
         except Exception:
             pass
-    data[str(user_id)] = []
-    with open(LAST_MENUS_FILE, "w") as f:
-        json.dump(data, f)
+    state_store.set_last_menus(user_id, [])
 
 def set_last_menu_id(user_id, msg_id):
-    data = {}
-    if os.path.exists(LAST_MENUS_FILE):
-        with open(LAST_MENUS_FILE, "r") as f:
-            data = json.load(f)
-    user_id = str(user_id)
-    data[user_id] = [msg_id]
-    with open(LAST_MENUS_FILE, "w") as f:
-        json.dump(data, f)
+    state_store.set_last_menus(user_id, [msg_id])
+
+BOT_COMMANDS = [
+    BotCommand(command="start", description="Запустить бота"),
+    BotCommand(command="announce", description="Сделать объявление (для админа)")
+]
 
 async def set_bot_commands():
-    async with Bot(token=BOT_TOKEN) as bot:
-        commands = [
-            BotCommand(command="start", description="Запустить бота"),
-            BotCommand(command="announce", description="Сделать объявление (для админа)")
-        ]
-        await bot.set_my_commands(commands)
+    await bot.set_my_commands(BOT_COMMANDS)
 
 async def update_bot_description():
-    async with Bot(token=BOT_TOKEN) as bot:
-        await bot.set_my_description(BOT_DESCRIPTION, language_code="ru")
+    await bot.set_my_description(BOT_DESCRIPTION, language_code="ru")
 
 async def update_bot_about():
-    async with Bot(token=BOT_TOKEN) as bot:
-        await bot.set_my_short_description(BOT_ABOUT, language_code="ru")
+    await bot.set_my_short_description(BOT_ABOUT, language_code="ru")
+
+async def sync_bot_metadata():
+    # Команды и описания меняются редко — отправляем их только если изменилось содержимое
+    payload = json.dumps(
+        [[(c.command, c.description) for c in BOT_COMMANDS], BOT_DESCRIPTION, BOT_ABOUT],
+        ensure_ascii=False,
+    )
+    digest = hashlib.sha256(payload.encode()).hexdigest()
+    if await get_meta("bot_metadata_hash") == digest:
+        return
+    results = await asyncio.gather(
+        set_bot_commands(), update_bot_description(), update_bot_about(), return_exceptions=True
+    )
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        print(f"[sync_bot_metadata] Не удалось обновить описание бота: {errors}")
+        return
+    await set_meta("bot_metadata_hash", digest)
+
+async def sync_webhook():
+    # Пока у бота установлен вебхук, getUpdates не работает, поэтому при смене режима его нужно снять
+    if BOT_MODE == "webhook":
+        url = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
+        digest = hashlib.sha256(f"{url}\n{WEBHOOK_SECRET}".encode()).hexdigest()
+        if await get_meta("webhook_hash") == digest:
+            return
+        await bot.set_webhook(
+            url, secret_token=WEBHOOK_SECRET or None, allowed_updates=dp.resolve_used_update_types()
+        )
+        await set_meta("webhook_hash", digest)
+    elif await get_meta("webhook_hash"):
+        await bot.delete_webhook()
+        await set_meta("webhook_hash", "")
 
 # --- VPN-функции ---
-async def client_exists(vpn_type: str, client_name: str) -> bool:
-    clients = await get_clients(vpn_type)
-    return client_name in clients
+CLIENT_MUTATING_OPTIONS = {"1", "2", "4", "5", "7"}
+PKI_OPTIONS = {"1", "2"}
 
-async def get_clients(vpn_type: str):
-    option = "3" if vpn_type == "openvpn" else "6"
-    result = await execute_script(option)
-    if result["returncode"] == 0:
-        clients = [
-            c.strip()
-            for c in result["stdout"].split("\n")
-            if c.strip()
-            and not c.startswith("OpenVPN client names:")
-            and not c.startswith("WireGuard/AmneziaWG client names:")
-            and not c.startswith("OpenVPN - List clients")
-            and not c.startswith("WireGuard/AmneziaWG - List clients")
-        ]
-        return clients
-    return []
+def client_exists(vpn_type: str, client_name: str) -> bool:
+    return client_registry.contains(_registry_type(vpn_type), client_name)
+
+def get_clients(vpn_type: str):
+    return client_registry.clients(_registry_type(vpn_type))
 
-async def execute_script(option, client_name=None, days=None):
-    cmd = ["/root/antizapret/client.sh", option]
+def _registry_type(vpn_type: str) -> str:
+    return "openvpn" if vpn_type == "openvpn" else "wireguard"
+
+async def execute_script(option, client_name=None, days=None, timeout=DEFAULT_TIMEOUT, on_line=None, env=None):
+    args = []
     if client_name:
-        cmd.append(client_name)
+        args.append(client_name)
     if days:
-        cmd.append(days)
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        return {"returncode": result.returncode, "stdout": result.stdout, "stderr": result.stderr}
-    except Exception as e:
-        return {"returncode": 1, "stdout": "", "stderr": str(e)}
+        args.append(days)
+    if env:
+        env = {**os.environ, **env}
+    if option in CLIENT_MUTATING_OPTIONS and client_name:
+        # Операции над одним клиентом не должны пересекаться: client.sh пишет одни и те же файлы
+        async with client_locks.hold(client_name):
+            if option in PKI_OPTIONS:
+                async with pki_lock:
+                    result = await run_client_script(option, *args, timeout=timeout, on_line=on_line, env=env)
+            else:
+                result = await run_client_script(option, *args, timeout=timeout, on_line=on_line, env=env)
+    else:
+        result = await run_client_script(option, *args, timeout=timeout, on_line=on_line, env=env)
+    if option in CLIENT_MUTATING_OPTIONS:
+        client_registry.invalidate()
+        await file_id_cache.invalidate(None if option == "7" else client_name)
+        if client_name:
+            profile_catalog.refresh([client_name])
+        else:
+            await asyncio.to_thread(profile_catalog.load, all_client_names())
+    return result
+
+def all_client_names():
+    return set(client_registry.clients("openvpn")) | set(client_registry.clients("wireguard"))
+
+async def ensure_wg_config(client_name, file_path):
+    # Повторная проверка под блокировкой клиента: параллельные нажатия не создают клиента дважды
+    if os.path.exists(file_path):
+        return True
+    async with client_locks.hold(client_name):
+        if not os.path.exists(file_path):
+            if wg_peers.ready():
+                summary = await wg_peers.add([client_name])
+                for name, error in summary["failed"]:
+                    print(f"[WireGuard] {name}: {error}")
+            else:
+                # Серверных ключей WireGuard ещё нет — их создаст client.sh
+                await execute_script("4", client_name)
+    return os.path.exists(file_path)
+
+async def send_config_file(chat_id: int, file_path: str):
+    return await file_id_cache.send(bot, chat_id, file_path, caption=f"🔐 {os.path.basename(file_path)}")
 
 async def send_config(chat_id: int, client_name: str, option: str) -> bool:
     try:
-        files_found = []
         if option == "4":
-            base_dir = "/root/antizapret/client/amneziawg/"
-            ext = ".conf"
-            prefix = f"amneziawg-{client_name}-"
-            for root, _, files in os.walk(base_dir):
-                for file in files:
-                    if file.startswith(prefix) and file.endswith(ext):
-                        files_found.append(os.path.join(root, file))
+            files_found = profile_catalog.find(client_name, "amneziawg")
         else:
-            base_dir = "/root/antizapret/client/openvpn/"
-            ext = ".ovpn"
-            prefix_vpn = f"vpn-{client_name}-"
-            prefix_antizapret = f"antizapret-{client_name}-"
-            for root, _, files in os.walk(base_dir):
-                for file in files:
-                    if (
-                        (file.startswith(prefix_vpn) or file.startswith(prefix_antizapret))
-                        and file.endswith(ext)
-                    ):
-                        files_found.append(os.path.join(root, file))
+            files_found = profile_catalog.find(client_name, "openvpn", transports=("udp", "tcp"))
         for file_path in files_found:
-            await bot.send_document(
-                chat_id, FSInputFile(file_path), caption=f"🔐 {os.path.basename(file_path)}"
-            )
+            await send_config_file(chat_id, file_path)
         return bool(files_found)
     except Exception as e:
         print(f"Ошибка отправки конфигураций: {e}")
         return False
 
-async def send_backup(chat_id: int) -> bool:
-    paths_to_check = [
-        f"/root/antizapret/backup-{SERVER_IP}.tar.gz",
-        "/root/antizapret/backup.tar.gz",
-    ]
-    for backup_path in paths_to_check:
-        try:
-            if os.path.exists(backup_path):
-                await bot.send_document(
-                    chat_id=chat_id,
-                    document=FSInputFile(backup_path),
-                    caption="📦 Бэкап клиентов",
-                )
-                return True
-        except Exception as e:
-            print(f"Ошибка отправки бэкапа ({backup_path}): {e}")
-            return False
-    return False
+async def send_backup(chat_id: int, backup: dict) -> bool:
+    size_mb = backup["size"] / 1024 / 1024
+    if backup["kind"] == "full":
+        caption = f"📦 Бэкап клиентов (полный, {size_mb:.1f} МБ)"
+    else:
+        caption = (
+            f"📦 Бэкап клиентов (инкрементальный, {size_mb:.1f} МБ)\n"
+            f"Изменено файлов: {backup['files']}, удалено: {backup['deleted']}\n"
+            f"Восстанавливать поверх {backup['base']}"
+        )
+    try:
+        await bot.send_document(chat_id=chat_id, document=FSInputFile(backup["path"]), caption=caption)
+        return True
+    except Exception as e:
+        print(f"Ошибка отправки бэкапа ({backup['path']}): {e}")
+        return False
 
 def get_openvpn_filename(client_name, config_type):
     if config_type == "vpn":
@@ -522,97 +458,95 @@ def get_openvpn_filename(client_name, config_type):
         return f"{FILEVPN_NAME} - {client_name}.ovpn"
 
 async def cleanup_openvpn_files(client_name: str):
-    clean_name = client_name.replace("antizapret-", "").replace("vpn-", "")
-    dirs_to_check = [
-        "/root/antizapret/client/openvpn/antizapret/",
-        "/root/antizapret/client/openvpn/antizapret-tcp/",
-        "/root/antizapret/client/openvpn/antizapret-udp/",
-        "/root/antizapret/client/openvpn/vpn/",
-        "/root/antizapret/client/openvpn/vpn-tcp/",
-        "/root/antizapret/client/openvpn/vpn-udp/",
-    ]
-    deleted_files = []
-    for dir_path in dirs_to_check:
-        if not os.path.exists(dir_path):
-            continue
-        for filename in os.listdir(dir_path):
-            if clean_name in filename:
-                try:
-                    file_path = os.path.join(dir_path, filename)
-                    os.remove(file_path)
-                    deleted_files.append(file_path)
-                except Exception as e:
-                    print(f"Ошибка удаления {file_path}: {e}")
-    return deleted_files
-
-def get_user_id_by_name(client_name):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE profile_name=?", (client_name,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-def get_cert_expiry_info(client_name):
+    # Только точные пути профилей этого клиента: "bob" не задевает файлы "bob2"
     try:
-        result = subprocess.run(
-            ["/etc/openvpn/easyrsa3/easyrsa", "--batch", "show-cert", client_name],
-            capture_output=True, text=True
-        )
-        if result.returncode == 0:
-            for line in result.stdout.split("\n"):
-                if "expire" in line.lower():
-                    expiry_str = line.split(":")[1].strip()
-                    expiry_date = datetime.strptime(expiry_str, "%Y%m%d%H%M%SZ")
-                    days_left = (expiry_date - datetime.now()).days
-                    return {"days_left": days_left}
-        return None
-    except:
+        return profile_catalog.remove(client_name, "openvpn")
+    except OSError as e:
+        print(f"Ошибка удаления профилей {client_name}: {e}")
+        return []
+
+async def render_client_profiles(client_name, days):
+    # Сертификат уже выпущен: копируем его в client/keys и рендерим профили без client.sh
+    context = await load_context()
+    async with client_locks.hold(client_name):
+        try:
+            await asyncio.to_thread(render_openvpn_client, context, client_name)
+        except Exception as e:
+            return {"returncode": 1, "stdout": "", "stderr": str(e)}
+    await file_id_cache.invalidate(client_name)
+    return {"returncode": 0, "stdout": "", "stderr": ""}
+
+async def get_client_bundle(client_name):
+    if client_exists("openvpn", client_name):
+        # Профили WireGuard/AmneziaWG создаются по первому запросу — для полного архива создаём их сразу
+        await ensure_wg_config(client_name, profile_catalog.path(client_name, "wireguard", "antizapret"))
+    files = profile_catalog.find(client_name)
+    if not files:
         return None
+    async with client_locks.hold(client_name):
+        path, removed = await asyncio.to_thread(build_bundle, client_name, files)
+    await file_id_cache.invalidate_paths(removed)
+    return path
+
+async def drop_client_bundles(client_name):
+    await file_id_cache.invalidate_paths(await asyncio.to_thread(remove_bundles, client_name))
+
+async def link_client(client_name, user_id):
+    await save_profile_name(user_id, client_name)
+    approve_user(user_id)
+    save_user_id(user_id)
+
+async def forget_client(client_name):
+    # Всё, что остаётся от клиента после удаления его сертификата
+    user_id = await get_user_id_by_name(client_name)
+    if user_id:
+        remove_user_id(user_id)
+        remove_approved_user(user_id)
+        set_user_emoji(user_id, "")
+        await save_profile_name(user_id, None)
+    await cleanup_openvpn_files(client_name)
+    await drop_client_bundles(client_name)
+    return await management_pool.kill(client_name)
+
+async def revoke_client(client_name, user_id):
+    # Отзыв по истечении срока: пиры WireGuard/AmneziaWG, сертификат, файлы профилей и активные сессии.
+    # Одобрение снимаем, иначе /start тут же выпустит новый сертификат.
+    # Сначала WireGuard: если упадёт он, следующая проверка сроков повторит отзыв целиком,
+    # а уже удалённого пира повторно не тронет.
+    if client_registry.contains("wireguard", client_name):
+        async with client_locks.hold(client_name):
+            summary = await wg_peers.delete([client_name])
+        if summary["failed"]:
+            return {
+                "returncode": 1,
+                "stdout": "",
+                "stderr": "; ".join(f"{name}: {error}" for name, error in summary["failed"]),
+            }
+    result = await execute_script("2", client_name)
+    if result["returncode"] == 0:
+        remove_approved_user(user_id)
+        await cleanup_openvpn_files(client_name)
+        await drop_client_bundles(client_name)
+        await management_pool.kill(client_name)
+    return result
+
+expiry_scheduler = ExpiryScheduler(bot, render_client_profiles, revoke_client, ADMIN_ID)
+bulk_provisioner = BulkProvisioner(execute_script, link_client, forget_client)
+recreate_job = RecreateJob(execute_script)
+backup_engine = BackupEngine()
+
+def get_cert_expiry_info(client_name):
+    return get_cert_expiry_map([client_name]).get(client_name)
 
 def get_online_users_from_log():
-    online = {}
-    try:
-        with open("/var/log/openvpn/status.log", "r") as f:
-            for line in f:
-                if "CLIENT_LIST" in line:
-                    parts = line.split(",")
-                    if len(parts) > 3:
-                        client_name = parts[1]
-                        online[client_name] = "OpenVPN"
-    except Exception as e:
-        print(f"[ERROR] get_online_users_from_log: {e}")
+    # Живые данные management-интерфейса, файлы статуса — только для недоступных экземпляров
+    online = management_pool.online()
+    for client_name, proto in status_aggregator.online(skip_instances=management_pool.live_instances()).items():
+        online.setdefault(client_name, proto)
     return online
 
-def get_online_wg_peers():
-    peers = {}
-    try:
-        result = subprocess.run(["wg", "show", "wg0", "latest-handshakes"], 
-                              capture_output=True, text=True)
-        for line in result.stdout.split("\n"):
-            if line.strip():
-                pubkey, timestamp = line.split()
-                if int(timestamp) > 0:
-                    for base in ["/root/antizapret/client/wireguard", 
-                               "/root/antizapret/client/amneziawg"]:
-                        for root, _, files in os.walk(base):
-                            for fname in files:
-                                if fname.endswith(".conf"):
-                                    path = os.path.join(root, fname)
-                                    with open(path, "r") as cf:
-                                        for cf_line in cf:
-                                            if cf_line.strip().startswith("PublicKey") and pubkey in cf_line:
-                                                client_name = fname.split("-")[1].split(".")[0]
-                                                proto = "Amnezia" if "amneziawg" in path else "WG"
-                                                peers[client_name] = proto
-                                                break
-                            if client_name in peers:
-                                break
-                        if client_name in peers:
-                            break
-    except Exception as e:
-        print(f"[ERROR] wg show: {e}")
-    return peers
+async def get_online_wg_peers():
+    return await get_online_peers()
 
 async def notify_admin_download(user_id, username, filename, vpn_type):
     await safe_send_message(
@@ -649,8 +583,8 @@ async def start(message: types.Message, state: FSMContext):
         return
     if is_approved_user(user_id):
         save_user_id(user_id)
-        client_name = get_profile_name(user_id)
-        if not await client_exists("openvpn", client_name):
+        client_name = await get_profile_name(user_id)
+        if not client_exists("openvpn", client_name):
             result = await execute_script("1", client_name, "30")
             if result["returncode"] != 0:
                 msg = await message.answer("❌ Ошибка при регистрации клиента. Свяжитесь с администратором.")
@@ -658,9 +592,9 @@ async def start(message: types.Message, state: FSMContext):
                 return
         msg = await message.answer(
             f"Привет, <b>твой VPN-аккаунт активирован!</b>\n\n"
-            f"Текущий баланс: <b>{get_balance(user_id):.2f} руб.</b>\n"
+            f"Текущий баланс: <b>{await get_balance(user_id):.2f} руб.</b>\n"
             "Выбери действие ниже:",
-            reply_markup=create_user_menu(client_name, user_id=user_id)
+            reply_markup=await create_user_menu(client_name, user_id=user_id)
         )
         set_last_menu_id(user_id, msg.message_id)
         return
@@ -833,7 +767,7 @@ async def process_manual_client_name(message: types.Message, state: FSMContext):
         )
         await state.clear()
         return
-    save_profile_name(manual_user_id, client_name)
+    await save_profile_name(manual_user_id, client_name)
     approve_user(manual_user_id)
     save_user_id(manual_user_id)
     try:
@@ -842,7 +776,7 @@ async def process_manual_client_name(message: types.Message, state: FSMContext):
             f"✅ Ваша учётная запись VPN <b>{client_name}</b> создана администратором!\n\n"
             "Теперь вы можете писать боту и сразу получать конфиг.",
             parse_mode="HTML",
-            reply_markup=create_user_menu(client_name, user_id=manual_user_id)
+            reply_markup=await create_user_menu(client_name, user_id=manual_user_id)
         )
     except Exception:
         pass
@@ -871,11 +805,12 @@ async def users_menu(callback: types.CallbackQuery):
     await callback.answer()
 
 async def show_users_tab(chat_id: int, tab: str):
-    raw_clients = await get_clients("openvpn")
+    raw_clients = get_clients("openvpn")
     all_clients = [c for c in raw_clients if c != "antizapret-client"]
     open_online = set(get_online_users_from_log().keys())
-    wg_online = set(get_online_wg_peers().keys())
+    wg_online = set((await get_online_wg_peers()).keys())
     online_all = open_online | wg_online
+    uid_by_name = await get_user_ids_by_names(all_clients)
     if tab == "users_tab_all":
         clients = all_clients
         header = "👥 <b>Все пользователи:</b>"
@@ -883,19 +818,20 @@ async def show_users_tab(chat_id: int, tab: str):
         clients = [c for c in all_clients if c in online_all]
         header = "🟢 <b>Сейчас онлайн:</b>"
     else:
-        clients = []
-        for c in all_clients:
-            uid = get_user_id_by_name(c)
-            info = get_cert_expiry_info(c) if uid else None
-            if info and 0 <= info["days_left"] <= 7:
-                clients.append(c)
+        expiry = {
+            name: {"days_left": days_left(not_after)}
+            for name, not_after in expiry_index.expiring_within(7)
+            if name in uid_by_name
+        }
+        clients = [c for c in all_clients if c in expiry]
         header = "⏳ <b>Истекают (≤7д):</b>"
+    emojis = get_user_emojis(uid_by_name.values())
     rows = []
     for c in clients:
-        uid = get_user_id_by_name(c)
-        emoji = get_user_emoji(uid) if uid else ""
+        uid = uid_by_name.get(c)
+        emoji = emojis.get(uid, "")
         if tab == "users_tab_expiring":
-            days = get_cert_expiry_info(c)["days_left"]
+            days = expiry[c]["days_left"]
             status = f"⏳{days}д"
         else:
             status = "🟢" if c in online_all else "🔴"
@@ -925,7 +861,7 @@ async def manage_user(callback: types.CallbackQuery):
     await show_menu(
         user_id,
         f"Управление клиентом <b>{client_name}</b>:",
-        create_user_menu(client_name, back_callback="users_menu", is_admin=(user_id == ADMIN_ID), user_id=user_id)
+        await create_user_menu(client_name, back_callback="users_menu", is_admin=(user_id == ADMIN_ID), user_id=user_id)
     )
     await callback.answer()
 
@@ -933,7 +869,7 @@ async def manage_user(callback: types.CallbackQuery):
 async def set_emoji_start(callback: types.CallbackQuery, state: FSMContext):
     client_name = callback.data[len("set_emoji_"):]
     user_id = callback.from_user.id
-    target_user_id = get_user_id_by_name(client_name)
+    target_user_id = await get_user_id_by_name(client_name)
     if not target_user_id:
         await callback.answer("Пользователь не найден!", show_alert=True)
         return
@@ -966,7 +902,7 @@ async def cancel_set_emoji(callback: types.CallbackQuery, state: FSMContext):
     await show_menu(
         callback.from_user.id,
         f"Меню пользователя <b>{client_name}</b>:",
-        create_user_menu(client_name, back_callback="users_menu", is_admin=True, user_id=get_user_id_by_name(client_name))
+        await create_user_menu(client_name, back_callback="users_menu", is_admin=True, user_id=await get_user_id_by_name(client_name))
     )
 
 @dp.message(SetEmojiState.waiting_for_emoji)
@@ -995,7 +931,7 @@ async def set_emoji_process(message: types.Message, state: FSMContext):
     await show_menu(
         message.from_user.id,
         f"Меню пользователя <b>{client_name}</b>:",
-        create_user_menu(client_name, back_callback="users_menu", is_admin=(message.from_user.id == ADMIN_ID), 
+        await create_user_menu(client_name, back_callback="users_menu", is_admin=(message.from_user.id == ADMIN_ID), 
                         user_id=target_user_id)
     )
     await state.clear()
@@ -1051,25 +987,7 @@ async def show_pending_list(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("Нет прав!", show_alert=True)
         return
-    if not os.path.exists(PENDING_FILE):
-        await callback.message.delete()
-        msg = await bot.send_message(callback.from_user.id, "Нет заявок.")
-        await asyncio.sleep(1)
-        try:
-            await bot.delete_message(callback.from_user.id, msg.message_id)
-        except Exception:
-            pass
-        stats = get_server_info()
-        menu = await bot.send_message(
-            callback.from_user.id,
-            stats + "\n<b>Главное меню:</b>",
-            reply_markup=create_main_menu(),
-            parse_mode="HTML"
-        )
-        set_last_menu_id(callback.from_user.id, menu.message_id)
-        return
-    with open(PENDING_FILE) as f:
-        pending = json.load(f)
+    pending = state_store.pending()
     if not pending:
         await callback.message.delete()
         msg = await bot.send_message(callback.from_user.id, "Нет заявок.")
@@ -1115,7 +1033,7 @@ async def process_application(callback: types.CallbackQuery, state: FSMContext):
         client_name = str(client_name)[:32]
         result = await execute_script("1", client_name, "30")
         if result["returncode"] == 0:
-            save_profile_name(user_id, client_name)
+            await save_profile_name(user_id, client_name)
             approve_user(user_id)
             remove_pending(user_id)
             save_user_id(user_id)
@@ -1128,7 +1046,7 @@ async def process_application(callback: types.CallbackQuery, state: FSMContext):
                 f"✅ Ваша заявка одобрена!\n"
                 f"Имя профиля: <b>{client_name}</b>\nТеперь вам доступны функции VPN.",
                 parse_mode="HTML",
-                reply_markup=create_user_menu(client_name)
+                reply_markup=await create_user_menu(client_name)
             )
             stats = get_server_info()
             await show_menu(
@@ -1195,7 +1113,7 @@ async def process_rename_new_name(message: types.Message, state: FSMContext):
         return
     result = await execute_script("1", new_name, "30")
     if result["returncode"] == 0:
-        save_profile_name(user_id, new_name)
+        await save_profile_name(user_id, new_name)
         approve_user(user_id)
         remove_pending(user_id)
         save_user_id(user_id)
@@ -1203,7 +1121,7 @@ async def process_rename_new_name(message: types.Message, state: FSMContext):
             user_id,
             f"✅ Ваша заявка одобрена!\nИмя профиля: <b>{new_name}</b>\nТеперь вам доступны функции VPN.",
             parse_mode="HTML",
-            reply_markup=create_user_menu(new_name)
+            reply_markup=await create_user_menu(new_name)
         )
         try:
             await bot.delete_message(message.chat.id, msg.message_id)
@@ -1259,7 +1177,7 @@ async def process_payment_amount(message: types.Message, state: FSMContext):
         await show_menu(
             user_id,
             f"Меню пользователя <b>{client_name}</b>:",
-            create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
+            await create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
                             is_admin=(user_id == ADMIN_ID), user_id=user_id)
         )
         return
@@ -1288,35 +1206,26 @@ async def process_payment_amount(message: types.Message, state: FSMContext):
         await message.delete()
     except:
         pass
-    # Создание платежа через ЮKassa
-    payment_id = str(uuid.uuid4())
-    payment = Payment.create({
-        "amount": {
-            "value": f"{amount:.2f}",
-            "currency": "RUB"
-        },
-        "confirmation": {
-            "type": "redirect",
-            "return_url": "https://your-bot-url/return"
-        },
-        "capture": True,
-        "description": f"Пополнение баланса для user_id {user_id}",
-        "metadata": {
-            "user_id": str(user_id),
-            "payment_id": payment_id
-        }
-    })
-    payment_url = payment.confirmation.confirmation_url
-
-    # В продакшене: обновляйте баланс только после вебхука от ЮKassa
-    current_balance = get_balance(user_id)
-    new_balance = current_balance + amount
-    update_balance(user_id, new_balance)
+    try:
+        payment_id, payment_url = await payment_service.create(user_id, amount)
+    except Exception as e:
+        print(f"[process_payment_amount] Ошибка создания платежа: {e}")
+        await state.clear()
+        await bot.send_message(user_id, "❌ Не удалось создать платёж. Попробуйте позже.")
+        await show_menu(
+            user_id,
+            f"Меню пользователя <b>{client_name}</b>:",
+            await create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu",
+                            is_admin=(user_id == ADMIN_ID), user_id=user_id)
+        )
+        return
 
+    current_balance = await get_balance(user_id)
     await bot.send_message(
         user_id,
         f"💳 Для пополнения баланса на {amount:.2f} руб. перейдите по ссылке:\n{payment_url}\n\n"
-        f"Текущий баланс (временно обновлен): {new_balance:.2f} руб.",
+        f"Баланс пополнится автоматически после оплаты.\n"
+        f"Текущий баланс: {current_balance:.2f} руб.",
         parse_mode="HTML"
     )
 
@@ -1331,29 +1240,87 @@ async def process_payment_amount(message: types.Message, state: FSMContext):
     await show_menu(
         user_id,
         f"Меню пользователя <b>{client_name}</b>:",
-        create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
+        await create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
                         is_admin=(user_id == ADMIN_ID), user_id=user_id)
     )
     await state.clear()
 
-@dp.callback_query(lambda c: c.data == "view_balances")
+TRANSACTION_KINDS = {
+    "opening": "Начальный баланс",
+    "topup": "Пополнение",
+    "charge": "Списание",
+    "renew": "Продление доступа",
+}
+
+def format_transaction(tx):
+    when = datetime.fromtimestamp(tx["created_at"]).strftime("%d.%m.%Y %H:%M")
+    kind = TRANSACTION_KINDS.get(tx["kind"], tx["kind"])
+    return f"{when} {kind}: <b>{tx['amount']:+.2f}</b> → {tx['balance_after']:.2f} руб."
+
+@dp.callback_query(lambda c: c.data == "view_balances" or c.data.startswith("view_balances_"))
 async def view_balances(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("Нет прав!", show_alert=True)
         return
-    balances = get_all_balances()
+    page = int(callback.data[len("view_balances_"):]) if callback.data.startswith("view_balances_") else 0
+    balances, total = await get_balances_page(page * BALANCES_PER_PAGE, BALANCES_PER_PAGE)
     if not balances:
         await callback.message.edit_text("Нет пользователей с балансом.")
         await callback.answer()
         return
-    text = "💰 <b>Балансы пользователей:</b>\n"
+    user_ids = [user_id for user_id, _ in balances]
+    profile_names = await get_profile_names(user_ids)
+    last_transactions = await get_last_transactions(user_ids)
+    pages = (total + BALANCES_PER_PAGE - 1) // BALANCES_PER_PAGE
+    text = f"💰 <b>Балансы пользователей</b> (стр. {page + 1}/{pages}):\n"
+    rows = []
     for user_id, balance in balances:
-        profile_name = get_profile_name(user_id) or f"user{user_id}"
+        profile_name = profile_names.get(user_id) or f"user{user_id}"
         text += f"\nID: <code>{user_id}</code>, Профиль: <b>{profile_name}</b>, Баланс: {balance:.2f} руб.\n"
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
-    ])
-    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        if user_id in last_transactions:
+            text += f"Последняя операция: {format_transaction(last_transactions[user_id])}\n"
+        rows.append([InlineKeyboardButton(text=f"📜 {profile_name}", callback_data=f"balance_history_{user_id}_0")])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"view_balances_{page - 1}"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"view_balances_{page + 1}"))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")])
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows), parse_mode="HTML")
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith("balance_history_"))
+async def balance_history(callback: types.CallbackQuery):
+    target_id, before_id = map(int, callback.data[len("balance_history_"):].split("_"))
+    is_admin = callback.from_user.id == ADMIN_ID
+    if target_id != callback.from_user.id and not is_admin:
+        await callback.answer("Нет прав!", show_alert=True)
+        return
+    transactions = await get_transactions(target_id, before_id or None, HISTORY_PER_PAGE + 1)
+    has_more = len(transactions) > HISTORY_PER_PAGE
+    transactions = transactions[:HISTORY_PER_PAGE]
+    client_name = await get_profile_name(target_id)
+    text = f"📜 <b>История операций {client_name}</b>\n"
+    text += f"Текущий баланс: <b>{await get_balance(target_id):.2f} руб.</b>\n\n"
+    if transactions:
+        text += "\n".join(format_transaction(tx) for tx in transactions)
+    else:
+        text += "Операций пока нет."
+    rows = []
+    nav = []
+    if before_id:
+        nav.append(InlineKeyboardButton(text="⏮ К последним", callback_data=f"balance_history_{target_id}_0"))
+    if has_more:
+        nav.append(InlineKeyboardButton(
+            text="Раньше ▶️", callback_data=f"balance_history_{target_id}_{transactions[-1]['id']}"
+        ))
+    if nav:
+        rows.append(nav)
+    back = "view_balances" if is_admin and target_id != callback.from_user.id else f"manage_user_{client_name}"
+    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=back)])
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows), parse_mode="HTML")
     await callback.answer()
 
 @dp.callback_query(lambda c: c.data.startswith("get_wg_"))
@@ -1480,19 +1447,9 @@ async def download_openvpn_config(callback: types.CallbackQuery):
         await callback.message.delete()
     except Exception:
         pass
-    if config_type == "vpn":
-        file_name = f"{FILEVPN_NAME} - Обычный VPN - {client_name}.ovpn"
-        base_path = "/root/antizapret/client/openvpn/vpn/"
-    else:
-        file_name = f"{FILEVPN_NAME} - {client_name}.ovpn"
-        base_path = "/root/antizapret/client/openvpn/antizapret/"
-    file_path = os.path.join(base_path, file_name)
-    if os.path.exists(file_path):
-        await bot.send_document(
-            user_id,
-            FSInputFile(file_path),
-            caption=f"🔐 {os.path.basename(file_path)}"
-        )
+    file_path = profile_catalog.get(client_name, "openvpn", "vpn" if config_type == "vpn" else "antizapret")
+    if file_path:
+        await send_config_file(user_id, file_path)
         await notify_admin_download(user_id, username, os.path.basename(file_path), "ovpn")
         markup = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"cancel_openvpn_config_{client_name}")]
@@ -1503,7 +1460,7 @@ async def download_openvpn_config(callback: types.CallbackQuery):
         await show_menu(
             user_id,
             f"Меню пользователя <b>{client_name}</b>:",
-            create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
+            await create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
                             is_admin=(user_id == ADMIN_ID), user_id=user_id)
         )
     await callback.answer()
@@ -1520,7 +1477,7 @@ async def cancel_openvpn_config(callback: types.CallbackQuery):
     await show_menu(
         user_id,
         f"Меню пользователя <b>{client_name}</b>:",
-        create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
+        await create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
                         is_admin=(user_id == ADMIN_ID), user_id=user_id)
     )
     await callback.answer()
@@ -1537,7 +1494,7 @@ async def back_to_user_menu(callback: types.CallbackQuery):
     await show_menu(
         user_id,
         f"Меню пользователя <b>{client_name}</b>:",
-        create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
+        await create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
                         is_admin=(user_id == ADMIN_ID), user_id=user_id)
     )
     await callback.answer()
@@ -1553,25 +1510,16 @@ async def handle_wg_config(callback: types.CallbackQuery, state: FSMContext):
         await callback.message.delete()
     except Exception:
         pass
-    if config_type == "vpn":
-        file_path = f"/root/antizapret/client/wireguard/vpn/{FILEVPN_NAME} - Обычный VPN -{client_name}.conf"
-    else:
-        file_path = f"/root/antizapret/client/wireguard/antizapret/{FILEVPN_NAME} -{client_name}.conf"
-    if not os.path.exists(file_path):
-        subprocess.run(['/root/antizapret/client.sh', '4', client_name], check=True)
-    if os.path.exists(file_path):
-        await bot.send_document(
-            user_id,
-            FSInputFile(file_path),
-            caption=f"🔐 {os.path.basename(file_path)}"
-        )
+    file_path = profile_catalog.path(client_name, "wireguard", "vpn" if config_type == "vpn" else "antizapret")
+    if await ensure_wg_config(client_name, file_path):
+        await send_config_file(user_id, file_path)
         await notify_admin_download(user_id, username, os.path.basename(file_path), "wg")
     else:
         await bot.send_message(user_id, "❌ Файл конфигурации не найден.")
     await show_menu(
         user_id,
         f"Меню пользователя <b>{client_name}</b>:",
-        create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
+        await create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
                         is_admin=(user_id == ADMIN_ID), user_id=user_id)
     )
     await state.clear()
@@ -1583,36 +1531,64 @@ async def download_am_config(callback: types.CallbackQuery):
     _, _, am_type, client_name = parts
     user_id = callback.from_user.id
     username = callback.from_user.username or "Без username"
-    if am_type == "vpn":
-        file_path = f"/root/antizapret/client/amneziawg/vpn/{FILEVPN_NAME} - Обычный VPN -{client_name}.conf"
-    else:
-        file_path = f"/root/antizapret/client/amneziawg/antizapret/{FILEVPN_NAME} -{client_name}.conf"
-    if not os.path.exists(file_path):
-        subprocess.run(['/root/antizapret/client.sh', '4', client_name], check=True)
+    file_path = profile_catalog.path(client_name, "amneziawg", "vpn" if am_type == "vpn" else "antizapret")
+    found = await ensure_wg_config(client_name, file_path)
     try:
         await callback.message.delete()
     except Exception:
         pass
     await delete_last_menus(user_id)
-    if os.path.exists(file_path):
-        await bot.send_document(user_id, FSInputFile(file_path), caption=f"🔐 {os.path.basename(file_path)}")
+    if found:
+        await send_config_file(user_id, file_path)
         await notify_admin_download(user_id, username, os.path.basename(file_path), "amnezia")
     else:
         await bot.send_message(user_id, "❌ Файл не найден")
     await show_menu(
         user_id,
         f"Меню пользователя <b>{client_name}</b>:",
-        create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
+        await create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu", 
                         is_admin=(user_id == ADMIN_ID), user_id=user_id)
     )
     await callback.answer()
 
+@dp.callback_query(lambda c: c.data.startswith("get_bundle_"))
+async def download_bundle(callback: types.CallbackQuery):
+    client_name = callback.data[len("get_bundle_"):]
+    user_id = callback.from_user.id
+    username = callback.from_user.username or "Без username"
+    if user_id != ADMIN_ID and await get_profile_name(user_id) != client_name:
+        await callback.answer("Нет прав!", show_alert=True)
+        return
+    # Сборка архива может занять пару секунд — отвечаем на нажатие сразу
+    await callback.answer("⏳ Собираю архив...")
+    await delete_last_menus(user_id)
+    try:
+        await callback.message.delete()
+    except Exception:
+        pass
+    try:
+        path = await get_client_bundle(client_name)
+    except Exception as e:
+        print(f"Ошибка сборки архива {client_name}: {e}")
+        path = None
+    if path:
+        await file_id_cache.send(bot, user_id, path, caption=f"📦 Все конфиги {client_name}")
+        await notify_admin_download(user_id, username, os.path.basename(path), "bundle")
+    else:
+        await bot.send_message(user_id, "❌ Файлы конфигурации не найдены.")
+    await show_menu(
+        user_id,
+        f"Меню пользователя <b>{client_name}</b>:",
+        await create_user_menu(client_name, back_callback="users_menu" if user_id == ADMIN_ID else "main_menu",
+                        is_admin=(user_id == ADMIN_ID), user_id=user_id)
+    )
+
 @dp.callback_query(lambda c: c.data == "del_user")
 async def delete_user_start(callback: types.CallbackQuery, state: FSMContext):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("Нет прав!", show_alert=True)
         return
-    clients = await get_clients("openvpn")
+    clients = get_clients("openvpn")
     if not clients:
         await callback.message.edit_text("Нет клиентов для удаления.", 
                                         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -1653,15 +1629,10 @@ async def confirm_delete_client(callback: types.CallbackQuery, state: FSMContext
         return
     result = await execute_script("2", client_name)
     if result["returncode"] == 0:
-        user_id = get_user_id_by_name(client_name)
-        if user_id:
-            remove_user_id(user_id)
-            remove_approved_user(user_id)
-            set_user_emoji(user_id, "")
-            save_profile_name(user_id, None)
-        await cleanup_openvpn_files(client_name)
+        killed = await forget_client(client_name)
         await callback.message.edit_text(
-            f"✅ Клиент <b>{client_name}</b> удалён.",
+            f"✅ Клиент <b>{client_name}</b> удалён."
+            + (f"\nОтключено активных сессий: {killed}" if killed else ""),
             parse_mode="HTML",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
@@ -1694,52 +1665,74 @@ async def recreate_vpn_files(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("Нет прав!", show_alert=True)
         return
-    result = await execute_script("7")
-    if result["returncode"] == 0:
-        await callback.message.edit_text(
-            "✅ VPN-файлы успешно пересозданы.",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
-            ])
+    if recreate_job.busy() or bulk_provisioner.busy() or backup_engine.busy():
+        await callback.answer("Пересоздание или массовая операция уже выполняется", show_alert=True)
+        return
+    await callback.message.edit_text("🔄 <b>Пересоздание файлов VPN</b>\n\nПодготовка...", parse_mode="HTML")
+    await callback.answer()
+    # Пересоздание может идти дольше таймаута обработчика — прогресс обновляется в том же сообщении
+    start_background(run_recreate_job(callback.message.chat.id, callback.message.message_id))
+
+async def run_recreate_job(chat_id, progress_msg_id):
+    back_markup = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
+    ])
+
+    async def report(text, reply_markup=None):
+        await bot.edit_message_text(
+            text, chat_id=chat_id, message_id=progress_msg_id, parse_mode="HTML", reply_markup=reply_markup
         )
+
+    try:
+        summary = await recreate_job.run(report)
+    except Exception as e:
+        summary = {"fallback": {"returncode": 1, "stderr": str(e)}}
+    if "fallback" in summary:
+        result = summary["fallback"]
+        if result["returncode"] == 0:
+            text = "✅ VPN-файлы успешно пересозданы."
+        else:
+            text = f"❌ Ошибка при пересоздании VPN-файлов: {html.escape(result['stderr'][-1000:])}"
     else:
-        await callback.message.edit_text(
-            f"❌ Ошибка при пересоздании VPN-файлов: {result['stderr']}",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
-            ])
+        text = (
+            "✅ <b>VPN-файлы пересозданы</b>\n\n"
+            f"Клиентов: {summary['total']}\n"
+            f"Обновлено: {summary['rendered']}\n"
+            f"Без изменений: {summary['unchanged']}\n"
+            f"Удалено лишних файлов: {summary['removed']}\n"
+            f"Ошибки: {len(summary['failed'])}"
         )
-    await callback.answer()
+        for name, reason in summary["failed"][:20]:
+            text += f"\n• <code>{html.escape(name)}</code>: {html.escape(reason[:200])}"
+    try:
+        await report(text, back_markup)
+    except Exception:
+        await safe_send_message(chat_id, text, parse_mode="HTML", reply_markup=back_markup)
 
 @dp.callback_query(lambda c: c.data == "8")
 async def create_backup(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("Нет прав!", show_alert=True)
         return
-    result = await execute_script("8")
-    if result["returncode"] == 0:
-        if await send_backup(callback.from_user.id):
-            await callback.message.edit_text(
-                "✅ Бэкап создан и отправлен.",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
-                ])
-            )
-        else:
-            await callback.message.edit_text(
-                "❌ Ошибка: Бэкап не найден или не удалось отправить.",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
-                ])
-            )
+    if backup_engine.busy() or bulk_provisioner.busy() or recreate_job.busy():
+        await callback.answer("Дождитесь завершения текущей операции", show_alert=True)
+        return
+    await callback.answer()
+    back_markup = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
+    ])
+    try:
+        backup = await backup_engine.run()
+    except Exception as e:
+        await callback.message.edit_text(f"❌ Ошибка при создании бэкапа: {html.escape(str(e))}", reply_markup=back_markup)
+        return
+    if await send_backup(callback.from_user.id, backup):
+        await callback.message.edit_text("✅ Бэкап создан и отправлен.", reply_markup=back_markup)
     else:
         await callback.message.edit_text(
-            f"❌ Ошибка при создании бэкапа: {result['stderr']}",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")]
-            ])
+            "❌ Ошибка: Бэкап не удалось отправить.",
+            reply_markup=back_markup
         )
-    await callback.answer()
 
 @dp.callback_query(lambda c: c.data == "announce_menu")
 async def announce_menu_start(callback: types.CallbackQuery, state: FSMContext):
@@ -1784,23 +1777,16 @@ async def process_announce_text(message: types.Message, state: FSMContext):
         await message.delete()
     except Exception:
         pass
-    # Отправка объявления всем пользователям
-    with open(USERS_FILE, "r") as f:
-        user_ids = [line.strip() for line in f if line.strip().isdigit()]
-    sent_count = 0
-    for user_id in user_ids:
-        try:
-            await safe_send_message(
-                int(user_id),
-                f"📢 <b>Объявление от админа:</b>\n\n{announcement}",
-                parse_mode="HTML"
-            )
-            sent_count += 1
-        except Exception as e:
-            print(f"[Ошибка отправки объявления] user_id={user_id}: {e}")
+    # Рассылка идёт в фоне, прогресс и итог приходят админу отдельным сообщением
+    user_ids = state_store.user_ids()
+    await broadcast_engine.start(
+        f"📢 <b>Объявление от админа:</b>\n\n{announcement}",
+        message.from_user.id,
+        user_ids,
+    )
     await show_menu(
         message.from_user.id,
-        f"✅ Объявление отправлено {sent_count} пользователям.\n\n<b>Главное меню:</b>",
+        f"✅ Рассылка объявления запущена для {len(user_ids)} пользователей.\n\n<b>Главное меню:</b>",
         create_main_menu()
     )
     await state.clear()
@@ -1811,7 +1797,7 @@ async def who_online(callback: types.CallbackQuery):
         await callback.answer("Нет прав!", show_alert=True)
         return
     openvpn_online = get_online_users_from_log()
-    wg_online = get_online_wg_peers()
+    wg_online = await get_online_wg_peers()
     all_online = {**openvpn_online, **wg_online}
     if not all_online:
         await callback.message.edit_text(
@@ -1823,10 +1809,11 @@ async def who_online(callback: types.CallbackQuery):
         )
         await callback.answer()
         return
+    uid_by_name = await get_user_ids_by_names(all_online)
+    emojis = get_user_emojis(uid_by_name.values())
     text = "🟢 <b>Пользователи в сети:</b>\n\n"
     for client_name, proto in all_online.items():
-        user_id = get_user_id_by_name(client_name)
-        emoji = get_user_emoji(user_id) if user_id else ""
+        emoji = emojis.get(uid_by_name.get(client_name), "")
         text += f"{emoji + ' ' if emoji else ''}{client_name} ({proto})\n"
     await callback.message.edit_text(
         text,
@@ -1853,43 +1840,168 @@ async def select_openvpn_config(callback: types.CallbackQuery):
     )
     await callback.answer()
 
+BULK_MAX_FILE_SIZE = 1024 * 1024
+BULK_HELP = (
+    "📦 <b>Массовое добавление и удаление клиентов</b>\n\n"
+    "Отправьте CSV или JSON файлом. Колонки CSV (первая строка — заголовок):\n"
+    "<code>name,action,days,user_id,wireguard</code>\n"
+    "• name — имя клиента (латиница, цифры, _ или -)\n"
+    "• action — add (по умолчанию) или delete\n"
+    "• days — срок действия сертификата, по умолчанию 30\n"
+    "• user_id — Telegram-ID, которому привязать профиль (необязательно)\n"
+    "• wireguard — 1, чтобы сразу создать WireGuard/AmneziaWG\n\n"
+    "JSON: <code>{\"clients\": [{\"name\": \"ivan\", \"days\": 30}]}</code>\n"
+    "Файл экспорта можно отредактировать и отправить обратно."
+)
+
+def create_bulk_menu():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬆️ Импорт из файла", callback_data="bulk_import")],
+        [
+            InlineKeyboardButton(text="⬇️ Экспорт CSV", callback_data="bulk_export_csv"),
+            InlineKeyboardButton(text="⬇️ Экспорт JSON", callback_data="bulk_export_json"),
+        ],
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")],
+    ])
+
+@dp.callback_query(lambda c: c.data == "bulk_menu")
+async def bulk_menu(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("Нет прав!", show_alert=True)
+        return
+    await callback.message.edit_text(BULK_HELP, reply_markup=create_bulk_menu(), parse_mode="HTML")
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data in ("bulk_export_csv", "bulk_export_json"))
+async def bulk_export(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("Нет прав!", show_alert=True)
+        return
+    fmt = callback.data[len("bulk_export_"):]
+    clients = await collect_clients()
+    data = export_clients(clients, fmt)
+    filename = f"clients-{datetime.now().strftime('%Y%m%d-%H%M')}.{fmt}"
+    await bot.send_document(
+        callback.from_user.id,
+        BufferedInputFile(data, filename=filename),
+        caption=f"📦 Клиентов: {len(clients)}"
+    )
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data == "bulk_import")
+async def bulk_import_start(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("Нет прав!", show_alert=True)
+        return
+    if bulk_provisioner.busy() or recreate_job.busy() or backup_engine.busy():
+        await callback.answer("Массовая операция или пересоздание файлов уже выполняется", show_alert=True)
+        return
+    await delete_last_menus(callback.from_user.id)
+    try:
+        await callback.message.delete()
+    except Exception:
+        pass
+    msg = await bot.send_message(
+        callback.from_user.id, "📎 Отправьте CSV или JSON файл с клиентами.", reply_markup=cancel_markup
+    )
+    await state.set_state(AdminBulk.waiting_for_document)
+    await state.update_data(prompt_msg_id=msg.message_id)
+    await callback.answer()
+
+@dp.message(AdminBulk.waiting_for_document)
+async def process_bulk_document(message: types.Message, state: FSMContext):
+    if message.text in ("❌", "❌ Отмена", "отмена", "Отмена"):
+        await state.clear()
+        await delete_last_menus(message.from_user.id)
+        stats = get_server_info()
+        await show_menu(message.from_user.id, stats + "\n<b>Главное меню:</b>", create_main_menu())
+        return
+    document = message.document
+    if not document:
+        await message.answer("❌ Пришлите файл CSV или JSON.", reply_markup=cancel_markup)
+        return
+    if document.file_size and document.file_size > BULK_MAX_FILE_SIZE:
+        await message.answer("❌ Файл слишком большой (максимум 1 МБ).", reply_markup=cancel_markup)
+        return
+    try:
+        buffer = await bot.download(document)
+        rows = parse_bulk_document(document.file_name or "", buffer.read())
+    except BulkError as e:
+        await message.answer(f"❌ {e}", reply_markup=cancel_markup)
+        return
+    if not rows:
+        await message.answer("❌ В файле нет ни одного клиента.", reply_markup=cancel_markup)
+        return
+    data = await state.get_data()
+    await state.clear()
+    if data.get("prompt_msg_id"):
+        try:
+            await bot.delete_message(message.chat.id, data["prompt_msg_id"])
+        except Exception:
+            pass
+    progress_msg = await message.answer(f"📦 <b>Массовая операция</b>\n\nВ очереди: {len(rows)}", parse_mode="HTML")
+    # Задача может идти минуты, поэтому не держим обработчик обновления
+    start_background(run_bulk_job(message.chat.id, progress_msg.message_id, rows))
+
+async def run_bulk_job(chat_id, progress_msg_id, rows):
+    async def report(text):
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=progress_msg_id, parse_mode="HTML")
+
+    try:
+        summary = await bulk_provisioner.run(rows, report)
+    except Exception as e:
+        await safe_send_message(chat_id, f"❌ Массовая операция прервана: {e}")
+        return
+    text = (
+        "📦 <b>Массовая операция завершена</b>\n\n"
+        f"Добавлено: {len(summary['added'])}\n"
+        f"Удалено: {len(summary['deleted'])}\n"
+        f"Пропущено: {len(summary['skipped'])}\n"
+        f"Ошибки: {len(summary['failed'])}"
+    )
+    for name, reason in (summary["skipped"] + summary["failed"])[:20]:
+        text += f"\n• <code>{html.escape(name)}</code>: {html.escape(reason[:200])}"
+    try:
+        await report(text)
+    except Exception:
+        await safe_send_message(chat_id, text, parse_mode="HTML")
+
 # --- Запуск бота ---
+async def on_startup():
+    await init_db()
+    await import_legacy_files(USERS_FILE, APPROVED_FILE, PENDING_FILE, EMOJI_FILE, LAST_MENUS_FILE)
+    await state_store.load()
+    await file_id_cache.load()
+    await asyncio.to_thread(profile_catalog.load, all_client_names())
+
+background_tasks = set()
+
+def start_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
 async def main():
-    await set_bot_commands()
-    await update_bot_description()
-    await update_bot_about()
-    await dp.start_polling(bot)
+    await on_startup()
+    start_background(client_registry.watch())
+    start_background(server_metrics.run())
+    start_background(sync_bot_metadata())
+    management_pool.start()
+    await broadcast_engine.resume()
+    start_background(payment_service.run())
+    start_background(expiry_scheduler.run())
+    await sync_webhook()
+    try:
+        if BOT_MODE == "webhook":
+            app = create_app(dp, bot)
+            payment_service.register(app)
+            await serve(app)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await state_store.flush()
+        await close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
-```
-
-### Объяснение изменений
-1. **Завершение обработчика `create_backup`**:
-   - Проверяется результат выполнения скрипта для создания бэкапа.
-   - Если бэкап создан успешно (`result["returncode"] == 0`), вызывается функция `send_backup` для отправки файла администратору.
-   - В случае успеха выводится сообщение об успешной отправке, в случае ошибки — сообщение об ошибке.
-   - Добавлена кнопка возврата в главное меню.
-
-2. **Добавление обработчика `announce_menu`**:
-   - Создан обработчик для callback_data="announce_menu", доступный только администратору.
-   - Запрашивается текст объявления через состояние `AdminAnnounce.waiting_for_text`.
-   - При получении текста объявление рассылается всем пользователям из `users.txt` с использованием `safe_send_message`.
-   - После отправки возвращается в главное меню с отображением количества успешно отправленных сообщений.
-
-3. **Добавление обработчика `who_online`**:
-   - Обработчик для callback_data="who_online", доступный только администратору.
-   - Получает списки онлайн-пользователей для OpenVPN и WireGuard/AmneziaWG с помощью функций `get_online_users_from_log` и `get_online_wg_peers`.
-   - Формирует список пользователей в сети с указанием протокола и эмодзи (если есть).
-   - Если никто не онлайн, выводится соответствующее сообщение.
-   - Добавлена кнопка возврата в главное меню.
-
-4. **Сохранение структуры и логики**:
-   - Все существующие функции (управление пользователями, VPN-конфигурации, заявки, уведомления, интеграция с ЮKassa) сохранены без изменений.
-   - Artifact_id и структура кода остались прежними, чтобы обозначить это как обновление.
-   - Добавлены только необходимые обработчики для завершения функциональности.
-
-5. **Запуск бота**:
-   - В конце добавлен основной запуск бота с установкой команд, описания и информации о боте.
-
-Если есть дополнительные функции или изменения, которые нужно добавить, напишите, и я продолжу доработку!
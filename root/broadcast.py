@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+)
+
+from db import (
+    create_broadcast_job, finish_broadcast_job, get_broadcast_counts, get_pending_broadcast_recipients,
+    get_running_broadcast_jobs, mark_broadcast_recipients, set_broadcast_progress_message,
+)
+
+# Лимит Telegram — около 30 сообщений в секунду на бота, оставляем запас
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+MAX_ATTEMPTS = 5
+PROGRESS_INTERVAL = 3
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._resume_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        # RetryAfter касается всего бота, поэтому останавливаем всех отправителей
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._resume_at:
+                    await asyncio.sleep(self._resume_at - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+def _progress_text(counts, total, finished=False):
+    delivered = counts.get("delivered", 0)
+    blocked = counts.get("blocked", 0)
+    failed = counts.get("failed", 0)
+    done = delivered + blocked + failed
+    title = "✅ <b>Рассылка завершена</b>" if finished else "📢 <b>Идёт рассылка...</b>"
+    return (
+        f"{title}\n\n"
+        f"Обработано: {done}/{total}\n"
+        f"Доставлено: {delivered}\n"
+        f"Заблокировали бота: {blocked}\n"
+        f"Ошибки: {failed}"
+    )
+
+class BroadcastEngine:
+    def __init__(self, bot, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self._tasks = {}
+
+    async def start(self, text, admin_chat_id, user_ids):
+        job_id = await create_broadcast_job(text, admin_chat_id, user_ids)
+        job = {"id": job_id, "text": text, "admin_chat_id": admin_chat_id, "progress_message_id": None}
+        self._spawn(job)
+        return job_id
+
+    async def resume(self):
+        for job in await get_running_broadcast_jobs():
+            self._spawn(job)
+
+    def _spawn(self, job):
+        if job["id"] not in self._tasks:
+            task = asyncio.create_task(self._run(job))
+            self._tasks[job["id"]] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job["id"], None))
+
+    async def _send(self, user_id, text):
+        for attempt in range(MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(user_id, text, parse_mode="HTML")
+                return "delivered"
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return "blocked"
+            except TelegramBadRequest as e:
+                print(f"[broadcast] user_id={user_id}: {e}")
+                return "failed"
+            except (TelegramNetworkError, TelegramServerError) as e:
+                print(f"[broadcast] user_id={user_id}, попытка {attempt + 1}: {e}")
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                print(f"[broadcast] user_id={user_id}: {e}")
+                return "failed"
+        return "failed"
+
+    async def _report(self, job, total, finished=False):
+        counts = await get_broadcast_counts(job["id"])
+        text = _progress_text(counts, total, finished)
+        try:
+            if job["progress_message_id"]:
+                await self.bot.edit_message_text(
+                    text, chat_id=job["admin_chat_id"], message_id=job["progress_message_id"], parse_mode="HTML"
+                )
+                return
+        except TelegramBadRequest as e:
+            if "not modified" in str(e):
+                return
+        except Exception as e:
+            print(f"[broadcast] Не удалось обновить прогресс: {e}")
+            return
+        try:
+            msg = await self.bot.send_message(job["admin_chat_id"], text, parse_mode="HTML")
+            job["progress_message_id"] = msg.message_id
+            await set_broadcast_progress_message(job["id"], msg.message_id)
+        except Exception as e:
+            print(f"[broadcast] Не удалось отправить прогресс: {e}")
+
+    async def _run(self, job):
+        pending = await get_pending_broadcast_recipients(job["id"])
+        counts = await get_broadcast_counts(job["id"])
+        total = sum(counts.values())
+        queue = asyncio.Queue()
+        for uid in pending:
+            queue.put_nowait(uid)
+        results = []
+
+        async def worker():
+            while True:
+                try:
+                    uid = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results.append((uid, await self._send(uid, job["text"])))
+
+        async def flush():
+            if results:
+                batch = results[:]
+                del results[:len(batch)]
+                await mark_broadcast_recipients(job["id"], batch)
+
+        await self._report(job, total)
+        workers = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            while not all(w.done() for w in workers):
+                await asyncio.wait(workers, timeout=PROGRESS_INTERVAL)
+                await flush()
+                await self._report(job, total)
+        finally:
+            await flush()
+        await finish_broadcast_job(job["id"])
+        await self._report(job, total, finished=True)
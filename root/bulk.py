@@ -0,0 +1,327 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import time
+from datetime import timezone
+
+from certs import days_left, expiry_index, pki_lock
+from db import get_balances, get_user_ids_by_names
+from file_cache import file_id_cache
+from profiles import PKI_DIR, load_context, render_openvpn_client
+from registry import client_registry
+from runner import MAX_CONCURRENT, run_command
+from wg_peers import wg_peers
+
+EASYRSA = "/usr/share/easy-rsa/easyrsa"
+EASYRSA_DIR = "/etc/openvpn/easyrsa3"
+SERVER_CRL = "/etc/openvpn/server/keys/crl.pem"
+CLIENT_NAME_RE = re.compile(r"^[a-zA-Z0-9_-]{1,32}$")
+DEFAULT_DAYS = 30
+MAX_DAYS = 3650
+EASYRSA_TIMEOUT = 120
+PROGRESS_INTERVAL = 2
+# Один слот runner всегда остаётся свободным для /start, «В сети» и действий админа
+BULK_WORKERS = max(1, MAX_CONCURRENT - 1)
+EXPORT_COLUMNS = ["name", "user_id", "days", "wireguard", "expires", "balance"]
+
+class BulkError(ValueError):
+    pass
+
+async def _run_pool(func, items, workers=BULK_WORKERS):
+    # Ограниченный пул воркеров вместо gather по всей пачке: в очереди runner одновременно
+    # не больше workers команд импорта, результаты — в порядке items
+    queue = asyncio.Queue()
+    for item in enumerate(items):
+        queue.put_nowait(item)
+    results = [None] * len(items)
+
+    async def worker():
+        while not queue.empty():
+            i, item = queue.get_nowait()
+            results[i] = await func(item)
+
+    await asyncio.gather(*(worker() for _ in range(min(workers, len(items)))))
+    return results
+
+def _discard_request(name):
+    # Ключ и CSR после неудачной подписи: иначе повторный импорт имени упадёт на "request already exists"
+    for path in (os.path.join(PKI_DIR, "private", f"{name}.key"), os.path.join(PKI_DIR, "reqs", f"{name}.req")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _flag(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "y", "да", "+")
+
+def _normalize(number, row):
+    if not isinstance(row, dict):
+        raise BulkError(f"Запись {number}: ожидается объект с полями name, action, days, user_id, wireguard")
+    name = str(row.get("name") or "").strip()
+    if not CLIENT_NAME_RE.match(name):
+        raise BulkError(f"Запись {number}: некорректное имя клиента {name!r}")
+    action = str(row.get("action") or "add").strip().lower()
+    if action not in ("add", "delete"):
+        raise BulkError(f"Запись {number}: неизвестное действие {action!r} (ожидается add или delete)")
+    try:
+        days = int(row.get("days") or DEFAULT_DAYS)
+    except (TypeError, ValueError):
+        raise BulkError(f"Запись {number}: срок действия должен быть числом")
+    if not 1 <= days <= MAX_DAYS:
+        raise BulkError(f"Запись {number}: срок действия должен быть от 1 до {MAX_DAYS} дней")
+    user_id = str(row.get("user_id") or "").strip()
+    if user_id and not user_id.isdigit():
+        raise BulkError(f"Запись {number}: user_id должен состоять из цифр")
+    return {
+        "name": name,
+        "action": action,
+        "days": days,
+        "user_id": int(user_id) if user_id else None,
+        "wireguard": _flag(row.get("wireguard", "")),
+    }
+
+def parse_bulk_document(filename, data):
+    # CSV с заголовком (name,action,days,user_id,wireguard) или JSON: список объектов либо {"clients": [...]}
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise BulkError("Файл должен быть в кодировке UTF-8")
+    if filename.lower().endswith(".json") or text.lstrip().startswith(("[", "{")):
+        try:
+            document = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise BulkError(f"Некорректный JSON: {e}")
+        rows = document.get("clients", []) if isinstance(document, dict) else document
+        if not isinstance(rows, list):
+            raise BulkError("Ожидается список клиентов")
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    result = [_normalize(number, row) for number, row in enumerate(rows, 1)]
+    seen = set()
+    for row in result:
+        if row["name"] in seen:
+            raise BulkError(f"Клиент {row['name']} указан несколько раз")
+        seen.add(row["name"])
+    return result
+
+async def collect_clients():
+    openvpn = set(client_registry.clients("openvpn")) - {"antizapret-client"}
+    wireguard = set(client_registry.clients("wireguard")) - {"antizapret-client"}
+    names = sorted(openvpn | wireguard)
+    uid_by_name = await get_user_ids_by_names(names)
+    balances = await get_balances(set(uid_by_name.values()))
+    expiry = expiry_index.lookup(names)
+    clients = []
+    for name in names:
+        user_id = uid_by_name.get(name)
+        not_after = expiry.get(name)
+        clients.append({
+            "name": name,
+            "user_id": user_id,
+            "days": max(days_left(not_after), 1) if not_after else None,
+            "wireguard": name in wireguard,
+            "expires": not_after.astimezone(timezone.utc).strftime("%Y-%m-%d") if not_after else None,
+            "balance": balances.get(user_id, 0.0) if user_id else None,
+        })
+    return clients
+
+def export_clients(clients, fmt):
+    # Экспорт можно отправить обратно как импорт: лишние колонки при импорте игнорируются
+    if fmt == "json":
+        return json.dumps({"clients": clients}, ensure_ascii=False, indent=2).encode("utf-8")
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for client in clients:
+        writer.writerow({
+            key: ("1" if value else "0") if key == "wireguard" else ("" if value is None else value)
+            for key, value in client.items()
+        })
+    return buffer.getvalue().encode("utf-8-sig")
+
+class BulkProgress:
+    def __init__(self, report, total, title="📦 <b>Массовая операция</b>"):
+        self.report = report
+        self.total = total
+        self.title = title
+        self._last = 0.0
+
+    async def update(self, stage, done, force=False):
+        now = time.monotonic()
+        if not force and now - self._last < PROGRESS_INTERVAL:
+            return
+        self._last = now
+        try:
+            await self.report(f"{self.title}\n\n{stage}: {done}/{self.total}")
+        except Exception as e:
+            print(f"[bulk] Не удалось обновить прогресс: {e}")
+
+class BulkProvisioner:
+    # Добавление и удаление многих клиентов одной задачей:
+    #  - ключи и запросы на сертификат (gen-req) генерируются параллельно;
+    #  - подпись и отзыв меняют общий index.txt и идут по одному;
+    #  - профили OpenVPN рендерятся в Python, без client.sh;
+    #  - клиенты WireGuard добавляются и удаляются одной пачкой через wg_peers;
+    #  - CRL пересоздаётся и WireGuard перечитывает конфиг один раз, а не после каждого клиента.
+
+    def __init__(self, execute_script, on_added, on_deleted):
+        self.execute_script = execute_script
+        self.on_added = on_added
+        self.on_deleted = on_deleted
+        self._lock = asyncio.Lock()
+
+    def busy(self):
+        return self._lock.locked()
+
+    async def run(self, rows, report):
+        async with self._lock:
+            summary = {"added": [], "deleted": [], "skipped": [], "failed": []}
+            progress = BulkProgress(report, len(rows))
+            openvpn = set(client_registry.clients("openvpn"))
+            wireguard = set(client_registry.clients("wireguard"))
+            try:
+                crl_dirty = await self._delete(
+                    [r for r in rows if r["action"] == "delete"], openvpn, wireguard, summary, progress
+                )
+                await self._add([r for r in rows if r["action"] == "add"], openvpn, wireguard, summary, progress)
+                await progress.update("Применение изменений", len(rows), force=True)
+                if crl_dirty:
+                    await self._gen_crl(summary)
+            finally:
+                client_registry.invalidate()
+            return summary
+
+    async def _delete(self, rows, openvpn, wireguard, summary, progress):
+        crl_dirty = False
+        errors = {}
+        names = []
+        for done, row in enumerate(rows, 1):
+            name = row["name"]
+            if name not in openvpn and name not in wireguard:
+                summary["skipped"].append((name, "не найден"))
+                continue
+            names.append(name)
+            if name in openvpn:
+                result = await self.execute_script("2", name, env={"SKIP_CRL": "1"})
+                crl_dirty = True
+                if result["returncode"] != 0:
+                    errors.setdefault(name, []).append(result["stderr"].strip())
+            await progress.update("Удаление", done)
+        wg_names = [name for name in names if name in wireguard]
+        if wg_names:
+            result = await wg_peers.delete(wg_names)
+            for name, error in result["failed"]:
+                errors.setdefault(name, []).append(f"WireGuard: {error}")
+        for name in names:
+            if name in errors:
+                summary["failed"].append((name, "; ".join(errors[name])))
+            else:
+                await self.on_deleted(name)
+                summary["deleted"].append(name)
+        for name, reasons in errors.items():
+            if name not in names:
+                summary["failed"].append((name, "; ".join(reasons)))
+        return crl_dirty
+
+    async def _add(self, rows, openvpn, wireguard, summary, progress):
+        fresh = []
+        for row in rows:
+            if row["name"] in openvpn:
+                summary["skipped"].append((row["name"], "уже существует"))
+                if row["user_id"]:
+                    await self.on_added(row["name"], row["user_id"])
+            else:
+                fresh.append(row)
+
+        # 1. Ключи и CSR — независимые файлы, параллельно в BULK_WORKERS процессов
+        done = 0
+
+        async def gen_req(row):
+            nonlocal done
+            result = await run_command(
+                [EASYRSA, "--batch", "gen-req", row["name"], "nopass"], timeout=EASYRSA_TIMEOUT, cwd=EASYRSA_DIR
+            )
+            done += 1
+            await progress.update("Генерация ключей", done)
+            return result
+
+        results = await _run_pool(gen_req, fresh)
+        requested = []
+        for row, result in zip(fresh, results):
+            if result["returncode"] == 0:
+                requested.append(row)
+            else:
+                summary["failed"].append((row["name"], result["stderr"].strip()))
+
+        # 2. Подпись по одному: easyrsa ведёт общий index.txt и serial
+        signed = []
+        for done, row in enumerate(requested, 1):
+            env = {**os.environ, "EASYRSA_CERT_EXPIRE": str(row["days"])}
+            async with pki_lock:
+                result = await run_command(
+                    [EASYRSA, "--batch", "sign-req", "client", row["name"]],
+                    timeout=EASYRSA_TIMEOUT, env=env, cwd=EASYRSA_DIR,
+                )
+                if result["returncode"] != 0:
+                    _discard_request(row["name"])
+            if result["returncode"] == 0:
+                signed.append(row)
+            else:
+                summary["failed"].append((row["name"], result["stderr"].strip()))
+            await progress.update("Подпись сертификатов", done)
+
+        # 3. Профили OpenVPN: контекст читается один раз, шаблоны уже скомпилированы
+        context = await load_context()
+
+        def render_all():
+            errors = {}
+            for row in signed:
+                try:
+                    render_openvpn_client(context, row["name"])
+                except Exception as e:
+                    errors[row["name"]] = str(e)
+            return errors
+
+        await progress.update("Создание профилей", 0, force=True)
+        render_errors = await asyncio.to_thread(render_all)
+
+        # 4. WireGuard: все новые клиенты одной пачкой — одна запись конфигов и один syncconf
+        wg_errors = {}
+        wg_names = [
+            row["name"] for row in signed
+            if row["wireguard"] and row["name"] not in wireguard and row["name"] not in render_errors
+        ]
+        if wg_names and not wg_peers.ready():
+            wg_errors = {name: "серверные ключи WireGuard не созданы" for name in wg_names}
+        elif wg_names:
+            result = await wg_peers.add(wg_names)
+            wg_errors = dict(result["failed"])
+        for row in signed:
+            name = row["name"]
+            if name in render_errors:
+                summary["failed"].append((name, render_errors[name]))
+                continue
+            await file_id_cache.invalidate(name)
+            if row["user_id"]:
+                await self.on_added(name, row["user_id"])
+            if name in wg_errors:
+                # Клиент OpenVPN уже рабочий, но в добавленные не считаем: одна запись с частичным результатом
+                summary["failed"].append((name, f"OpenVPN создан, WireGuard: {wg_errors.pop(name)}"))
+            else:
+                summary["added"].append(name)
+        # Ошибки syncconf относятся к интерфейсу, а не к клиенту
+        summary["failed"].extend(wg_errors.items())
+
+    async def _gen_crl(self, summary):
+        env = {**os.environ, "EASYRSA_CRL_DAYS": "3650"}
+        async with pki_lock:
+            result = await run_command([EASYRSA, "gen-crl"], timeout=EASYRSA_TIMEOUT, env=env, cwd=EASYRSA_DIR)
+            if result["returncode"] == 0:
+                result = await run_command(
+                    ["bash", "-c", f"cp ./pki/crl.pem {SERVER_CRL} && chmod 644 {SERVER_CRL}"], cwd=EASYRSA_DIR
+                )
+        if result["returncode"] != 0:
+            summary["failed"].append(("CRL", result["stderr"].strip()))
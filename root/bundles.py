@@ -0,0 +1,111 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+import zipfile
+
+from profiles import CLIENT_DIR
+
+BUNDLE_DIR = "/root/antizapret/bundles"
+# Поменять, если меняется состав архива: старые архивы пересоберутся
+BUNDLE_VERSION = "1"
+QR_PROTOCOL_DIRS = ("wireguard", "amneziawg")
+
+_BUNDLE_SUFFIX = re.compile(r"[0-9a-f]{16}\.zip")
+_digests = {}
+_qrcode_missing_reported = False
+
+def _qrcode():
+    # qrcode — необязательная зависимость: без неё архив собирается без PNG
+    global _qrcode_missing_reported
+    try:
+        import qrcode
+    except ImportError:
+        if not _qrcode_missing_reported:
+            print("[bundles] Пакет qrcode не установлен, QR-коды в архив не добавляются")
+            _qrcode_missing_reported = True
+        return None
+    return qrcode
+
+def _qr_png(text):
+    qrcode = _qrcode()
+    if qrcode is None:
+        return None
+    try:
+        buffer = io.BytesIO()
+        qrcode.make(text).save(buffer)
+        return buffer.getvalue()
+    except Exception as e:
+        # Например, конфиг со списком маршрутов не помещается в QR-код
+        print(f"[bundles] Не удалось построить QR-код: {e}")
+        return None
+
+def _digest(path):
+    # Хэш файла пересчитывается только при смене mtime/размера
+    st = os.stat(path)
+    cached = _digests.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _digests[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+def bundle_key(paths):
+    h = hashlib.sha256(f"{BUNDLE_VERSION}\0{_qrcode() is not None}\0".encode("utf-8"))
+    for path in sorted(paths):
+        h.update(f"{os.path.relpath(path, CLIENT_DIR)}\0{_digest(path)}\0".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def build_bundle(client_name, paths):
+    # Zip со всеми профилями клиента и QR-кодами WireGuard/AmneziaWG.
+    # Имя архива содержит хэш профилей: пока они не менялись, отдаётся готовый файл
+    # (и его file_id из кэша), а старые архивы клиента удаляются. Возвращает (путь, удалённые архивы).
+    path = os.path.join(BUNDLE_DIR, f"{client_name}-{bundle_key(paths)}.zip")
+    if os.path.exists(path):
+        return path, []
+    os.makedirs(BUNDLE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=BUNDLE_DIR, prefix=".tmp-", suffix=".zip")
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as archive:
+            for source in sorted(paths):
+                arcname = os.path.relpath(source, CLIENT_DIR)
+                with open(source, "rb") as src:
+                    data = src.read()
+                archive.writestr(arcname, data)
+                if arcname.split(os.sep, 1)[0] in QR_PROTOCOL_DIRS:
+                    png = _qr_png(data.decode("utf-8", "replace"))
+                    if png:
+                        archive.writestr(os.path.splitext(arcname)[0] + ".png", png)
+        # В архиве приватные ключи клиента
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return path, remove_bundles(client_name, keep=path)
+
+def remove_bundles(client_name, keep=None):
+    try:
+        names = os.listdir(BUNDLE_DIR)
+    except OSError:
+        return []
+    prefix = f"{client_name}-"
+    removed = []
+    for name in names:
+        # Точное совпадение: архивы клиента "bob-x" не относятся к "bob"
+        if not name.startswith(prefix) or not _BUNDLE_SUFFIX.fullmatch(name[len(prefix):]):
+            continue
+        path = os.path.join(BUNDLE_DIR, name)
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            removed.append(path)
+        except FileNotFoundError:
+            pass
+    return removed
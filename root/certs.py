@@ -0,0 +1,104 @@
+import asyncio
+import bisect
+import os
+from datetime import datetime, timedelta, timezone
+
+INDEX_FILE = "/etc/openvpn/easyrsa3/pki/index.txt"
+
+# easyrsa пишет общие index.txt, serial и crl.pem: выпуск, подпись и отзыв идут строго по одному
+pki_lock = asyncio.Lock()
+
+def parse_openssl_time(value):
+    # index.txt хранит даты как YYMMDDHHMMSSZ (до 2050 года) или YYYYMMDDHHMMSSZ
+    if len(value) == 13:
+        dt = datetime.strptime(value, "%y%m%d%H%M%SZ")
+    else:
+        dt = datetime.strptime(value, "%Y%m%d%H%M%SZ")
+    return dt.replace(tzinfo=timezone.utc)
+
+def read_index(index_path=INDEX_FILE):
+    # Один проход по index.txt: имя клиента -> самый поздний notAfter среди действующих сертификатов
+    expiry = {}
+    with open(index_path, "r") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 6 or parts[0] != "V":
+                continue
+            cn = None
+            for rdn in parts[5].split("/"):
+                if rdn.startswith("CN="):
+                    cn = rdn[3:]
+            if not cn:
+                continue
+            try:
+                not_after = parse_openssl_time(parts[1])
+            except ValueError:
+                continue
+            if cn not in expiry or not_after > expiry[cn]:
+                expiry[cn] = not_after
+    return expiry
+
+def days_left(not_after, now=None):
+    now = now or datetime.now(timezone.utc)
+    return (not_after - now).days
+
+class ExpiryIndex:
+    # Индекс сроков действия сертификатов: имя -> notAfter плюс отсортированный список
+    # для запросов вида "истекают в ближайшие N дней". Перечитывается при изменении index.txt.
+
+    def __init__(self, index_path=INDEX_FILE):
+        self.index_path = index_path
+        self._mtime = None
+        self._by_name = {}
+        self._dates = []
+        self._names = []
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        try:
+            by_name = read_index(self.index_path) if mtime is not None else {}
+        except OSError as e:
+            print(f"[ExpiryIndex] Не удалось прочитать {self.index_path}: {e}")
+            return
+        ordered = sorted(by_name.items(), key=lambda item: item[1])
+        self._by_name = by_name
+        self._dates = [not_after for _, not_after in ordered]
+        self._names = [name for name, _ in ordered]
+        self._mtime = mtime
+
+    def not_after(self, client_name):
+        self.refresh()
+        return self._by_name.get(client_name)
+
+    def between(self, start, end):
+        # Клиенты с notAfter в [start, end), отсортированные по дате
+        self.refresh()
+        lo = bisect.bisect_left(self._dates, start)
+        hi = bisect.bisect_left(self._dates, end)
+        return list(zip(self._names[lo:hi], self._dates[lo:hi]))
+
+    def expiring_within(self, days, now=None):
+        now = now or datetime.now(timezone.utc)
+        return self.between(now, now + timedelta(days=days + 1))
+
+    def expired(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        return self.between(datetime.min.replace(tzinfo=timezone.utc), now)
+
+    def lookup(self, client_names):
+        self.refresh()
+        return {name: self._by_name[name] for name in client_names if name in self._by_name}
+
+expiry_index = ExpiryIndex()
+
+def get_cert_expiry_map(client_names):
+    now = datetime.now(timezone.utc)
+    return {
+        name: {"days_left": days_left(not_after, now)}
+        for name, not_after in expiry_index.lookup(client_names).items()
+    }
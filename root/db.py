@@ -1,31 +1,547 @@
-# db.py
-import sqlite3
-
-def init_db(db_path="vpn.db"):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            profile_name TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-def save_profile_name(user_id, profile_name, db_path="vpn.db"):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, profile_name TEXT)")
-    cur.execute("INSERT OR REPLACE INTO users (id, profile_name) VALUES (?, ?)", (user_id, profile_name))
-    conn.commit()
-    conn.close()
-
-def get_profile_name(user_id, db_path="vpn.db"):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, profile_name TEXT)")
-    cur.execute("SELECT profile_name FROM users WHERE id=?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row and row[0] else f"user{user_id}"
+# db.py
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+DB_PATH = "vpn.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    profile_name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_profile_name ON users(profile_name);
+
+CREATE TABLE IF NOT EXISTS balances (
+    user_id INTEGER PRIMARY KEY,
+    balance REAL DEFAULT 0.0
+);
+CREATE INDEX IF NOT EXISTS idx_balances_balance ON balances(balance DESC, user_id);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    balance_after REAL NOT NULL,
+    kind TEXT NOT NULL,
+    ref TEXT,
+    description TEXT,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions(user_id, id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_ref ON transactions(kind, ref) WHERE ref IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS known_users (
+    user_id INTEGER PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS approved_users (
+    user_id INTEGER PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS pending_users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    fullname TEXT
+);
+
+CREATE TABLE IF NOT EXISTS user_emojis (
+    user_id INTEGER PRIMARY KEY,
+    emoji TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS last_menus (
+    user_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, message_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    admin_chat_id INTEGER,
+    progress_message_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'running',
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    job_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    PRIMARY KEY (job_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients(job_id, status);
+
+CREATE TABLE IF NOT EXISTS file_ids (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    file_id TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    status TEXT NOT NULL,
+    confirmation_url TEXT,
+    credited INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER NOT NULL,
+    checked_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status, checked_at);
+
+CREATE TABLE IF NOT EXISTS expiry_notices (
+    client_name TEXT NOT NULL,
+    not_after TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    PRIMARY KEY (client_name, not_after, kind)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+USER_STATE_SQL = {
+    "add_user": "INSERT OR IGNORE INTO known_users (user_id) VALUES (?)",
+    "remove_user": "DELETE FROM known_users WHERE user_id=?",
+    "approve": "INSERT OR IGNORE INTO approved_users (user_id) VALUES (?)",
+    "unapprove": "DELETE FROM approved_users WHERE user_id=?",
+    "add_pending": "INSERT OR REPLACE INTO pending_users (user_id, username, fullname) VALUES (?, ?, ?)",
+    "remove_pending": "DELETE FROM pending_users WHERE user_id=?",
+    "set_emoji": "INSERT OR REPLACE INTO user_emojis (user_id, emoji) VALUES (?, ?)",
+    "remove_emoji": "DELETE FROM user_emojis WHERE user_id=?",
+    "clear_last_menus": "DELETE FROM last_menus WHERE user_id=?",
+    "add_last_menu": "INSERT OR IGNORE INTO last_menus (user_id, message_id) VALUES (?, ?)",
+}
+
+# Все обращения к базе идут через один поток с одним постоянным соединением,
+# чтобы запросы не блокировали event loop aiogram. sqlite3 кэширует
+# подготовленные выражения на соединение, поэтому SQL держим неизменным.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vpn-db")
+_conn = None
+
+def _get_connection():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, cached_statements=256)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+    return _conn
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def db_call(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    wrapper.sync = func
+    return wrapper
+
+@db_call
+def close_db():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+@db_call
+def snapshot_db(path):
+    # Онлайн-копия через SQLite backup API в потоке базы: согласованный снимок без остановки бота
+    target = sqlite3.connect(path)
+    try:
+        _get_connection().backup(target)
+    finally:
+        target.close()
+
+@db_call
+def init_db():
+    conn = _get_connection()
+    conn.executescript(SCHEMA)
+    conn.commit()
+    with conn:
+        # Балансы, накопленные до появления журнала операций, записываем одной начальной операцией
+        if not conn.execute("SELECT 1 FROM meta WHERE key='ledger_opened'").fetchone():
+            conn.execute(
+                "INSERT INTO transactions (user_id, amount, balance_after, kind, description, created_at) "
+                "SELECT user_id, balance, balance, 'opening', 'Начальный баланс', strftime('%s','now') "
+                "FROM balances WHERE balance != 0"
+            )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('ledger_opened', '1')")
+
+@db_call
+def get_meta(key):
+    row = _get_connection().execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+    return row[0] if row else None
+
+@db_call
+def set_meta(key, value):
+    conn = _get_connection()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+# --- Профили ---
+@db_call
+def save_profile_name(user_id, profile_name):
+    conn = _get_connection()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO users (id, profile_name) VALUES (?, ?)", (user_id, profile_name))
+
+@db_call
+def get_profile_name(user_id):
+    row = _get_connection().execute("SELECT profile_name FROM users WHERE id=?", (user_id,)).fetchone()
+    return row[0] if row and row[0] else f"user{user_id}"
+
+@db_call
+def get_user_id_by_name(client_name):
+    row = _get_connection().execute("SELECT id FROM users WHERE profile_name=?", (client_name,)).fetchone()
+    return row[0] if row else None
+
+def _chunks(items, size=500):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+@db_call
+def get_user_ids_by_names(client_names):
+    conn = _get_connection()
+    result = {}
+    for chunk in _chunks(client_names):
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT profile_name, id FROM users WHERE profile_name IN ({placeholders})", chunk)
+        result.update(rows)
+    return result
+
+@db_call
+def get_profile_names(user_ids):
+    conn = _get_connection()
+    result = {}
+    for chunk in _chunks(user_ids):
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT id, profile_name FROM users WHERE id IN ({placeholders})", chunk)
+        result.update((uid, name) for uid, name in rows if name)
+    return result
+
+# --- Балансы ---
+# Баланс меняется только через журнал transactions: запись операции и изменение баланса
+# выполняются в одной транзакции, а сам баланс считает SQLite (balance = balance + ?),
+# поэтому параллельные пополнения и списания не затирают друг друга.
+class InsufficientFunds(Exception):
+    pass
+
+def _apply_transaction(conn, user_id, amount, kind, ref=None, description=None, allow_negative=True):
+    if ref is not None and conn.execute(
+        "SELECT 1 FROM transactions WHERE kind=? AND ref=?", (kind, ref)
+    ).fetchone():
+        return None
+    conn.execute("INSERT OR IGNORE INTO balances (user_id, balance) VALUES (?, 0)", (user_id,))
+    cur = conn.execute(
+        "UPDATE balances SET balance = round(balance + ?, 2) WHERE user_id=? AND (? OR round(balance + ?, 2) >= 0)",
+        (amount, user_id, allow_negative, amount),
+    )
+    if cur.rowcount == 0:
+        raise InsufficientFunds(user_id)
+    balance = conn.execute("SELECT balance FROM balances WHERE user_id=?", (user_id,)).fetchone()[0]
+    cur = conn.execute(
+        "INSERT INTO transactions (user_id, amount, balance_after, kind, ref, description, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, strftime('%s','now'))",
+        (user_id, amount, balance, kind, ref, description),
+    )
+    return {"id": cur.lastrowid, "user_id": user_id, "amount": amount, "balance": balance}
+
+@db_call
+def get_balance(user_id):
+    row = _get_connection().execute("SELECT balance FROM balances WHERE user_id=?", (user_id,)).fetchone()
+    return row[0] if row else 0.0
+
+@db_call
+def get_balances(user_ids):
+    conn = _get_connection()
+    result = {}
+    for chunk in _chunks(user_ids):
+        placeholders = ",".join("?" * len(chunk))
+        result.update(conn.execute(f"SELECT user_id, balance FROM balances WHERE user_id IN ({placeholders})", chunk))
+    return result
+
+@db_call
+def add_transaction(user_id, amount, kind, ref=None, description=None, allow_negative=True):
+    # Повтор операции с тем же (kind, ref) ничего не меняет и возвращает None
+    conn = _get_connection()
+    with conn:
+        return _apply_transaction(conn, user_id, amount, kind, ref, description, allow_negative)
+
+@db_call
+def get_balances_page(offset, limit):
+    conn = _get_connection()
+    total = conn.execute("SELECT COUNT(*) FROM balances").fetchone()[0]
+    rows = conn.execute(
+        "SELECT user_id, balance FROM balances ORDER BY balance DESC, user_id LIMIT ? OFFSET ?", (limit, offset)
+    ).fetchall()
+    return rows, total
+
+_TRANSACTION_COLUMNS = ("id", "user_id", "amount", "balance_after", "kind", "ref", "description", "created_at")
+
+@db_call
+def get_transactions(user_id, before_id=None, limit=10):
+    # Постраничный вывод по ключу id (а не OFFSET), чтобы длинная история читалась по индексу
+    rows = _get_connection().execute(
+        f"SELECT {', '.join(_TRANSACTION_COLUMNS)} FROM transactions "
+        "WHERE user_id=? AND id < ? ORDER BY id DESC LIMIT ?",
+        (user_id, before_id or 2 ** 63 - 1, limit),
+    )
+    return [dict(zip(_TRANSACTION_COLUMNS, r)) for r in rows]
+
+@db_call
+def get_transaction_refs(kind, refs):
+    conn = _get_connection()
+    result = set()
+    for chunk in _chunks(refs):
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT ref FROM transactions WHERE kind=? AND ref IN ({placeholders})", (kind, *chunk))
+        result.update(r[0] for r in rows)
+    return result
+
+@db_call
+def get_last_transactions(user_ids):
+    conn = _get_connection()
+    columns = ", ".join(f"t.{c}" for c in _TRANSACTION_COLUMNS)
+    result = {}
+    for chunk in _chunks(user_ids):
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(
+            f"SELECT {columns} FROM transactions t JOIN ("
+            f"SELECT MAX(id) AS id FROM transactions WHERE user_id IN ({placeholders}) GROUP BY user_id"
+            ") last ON t.id = last.id",
+            chunk,
+        )
+        for r in rows:
+            row = dict(zip(_TRANSACTION_COLUMNS, r))
+            result[row["user_id"]] = row
+    return result
+
+# --- Состояние пользователей ---
+@db_call
+def load_user_state():
+    conn = _get_connection()
+    last_menus = {}
+    for user_id, message_id in conn.execute("SELECT user_id, message_id FROM last_menus"):
+        last_menus.setdefault(user_id, []).append(message_id)
+    return {
+        "users": [r[0] for r in conn.execute("SELECT user_id FROM known_users ORDER BY rowid")],
+        "approved": [r[0] for r in conn.execute("SELECT user_id FROM approved_users ORDER BY rowid")],
+        "pending": {
+            r[0]: {"username": r[1], "fullname": r[2]}
+            for r in conn.execute("SELECT user_id, username, fullname FROM pending_users ORDER BY rowid")
+        },
+        "emojis": dict(conn.execute("SELECT user_id, emoji FROM user_emojis")),
+        "last_menus": last_menus,
+    }
+
+@db_call
+def apply_user_state_ops(ops):
+    conn = _get_connection()
+    with conn:
+        for name, params in ops:
+            conn.execute(USER_STATE_SQL[name], params)
+
+# --- Рассылки ---
+@db_call
+def create_broadcast_job(text, admin_chat_id, user_ids):
+    conn = _get_connection()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO broadcast_jobs (text, admin_chat_id) VALUES (?, ?)", (text, admin_chat_id)
+        )
+        job_id = cur.lastrowid
+        conn.executemany(
+            "INSERT OR IGNORE INTO broadcast_recipients (job_id, user_id) VALUES (?, ?)",
+            [(job_id, uid) for uid in user_ids],
+        )
+    return job_id
+
+@db_call
+def get_running_broadcast_jobs():
+    rows = _get_connection().execute(
+        "SELECT id, text, admin_chat_id, progress_message_id FROM broadcast_jobs WHERE status='running' ORDER BY id"
+    )
+    return [
+        {"id": r[0], "text": r[1], "admin_chat_id": r[2], "progress_message_id": r[3]}
+        for r in rows
+    ]
+
+@db_call
+def set_broadcast_progress_message(job_id, message_id):
+    conn = _get_connection()
+    with conn:
+        conn.execute("UPDATE broadcast_jobs SET progress_message_id=? WHERE id=?", (message_id, job_id))
+
+@db_call
+def get_pending_broadcast_recipients(job_id):
+    rows = _get_connection().execute(
+        "SELECT user_id FROM broadcast_recipients WHERE job_id=? AND status='pending'", (job_id,)
+    )
+    return [r[0] for r in rows]
+
+@db_call
+def mark_broadcast_recipients(job_id, results):
+    conn = _get_connection()
+    with conn:
+        conn.executemany(
+            "UPDATE broadcast_recipients SET status=? WHERE job_id=? AND user_id=?",
+            [(status, job_id, uid) for uid, status in results],
+        )
+
+@db_call
+def get_broadcast_counts(job_id):
+    rows = _get_connection().execute(
+        "SELECT status, COUNT(*) FROM broadcast_recipients WHERE job_id=? GROUP BY status", (job_id,)
+    )
+    return dict(rows)
+
+@db_call
+def finish_broadcast_job(job_id):
+    conn = _get_connection()
+    with conn:
+        conn.execute("UPDATE broadcast_jobs SET status='done' WHERE id=?", (job_id,))
+
+# --- Платежи ---
+# Статусы ЮKassa, после которых платёж ещё может измениться
+PAYMENT_OPEN_STATUSES = ("pending", "waiting_for_capture")
+
+@db_call
+def create_payment(payment_id, user_id, amount, status, confirmation_url):
+    conn = _get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO payments "
+            "(payment_id, user_id, amount, status, confirmation_url, created_at, checked_at) "
+            "VALUES (?, ?, ?, ?, ?, strftime('%s','now'), strftime('%s','now'))",
+            (payment_id, user_id, amount, status, confirmation_url),
+        )
+
+@db_call
+def has_payment(payment_id):
+    return _get_connection().execute("SELECT 1 FROM payments WHERE payment_id=?", (payment_id,)).fetchone() is not None
+
+@db_call
+def get_pending_payments(limit):
+    rows = _get_connection().execute(
+        "SELECT payment_id FROM payments WHERE status IN (?, ?) ORDER BY checked_at LIMIT ?",
+        (*PAYMENT_OPEN_STATUSES, limit),
+    )
+    return [r[0] for r in rows]
+
+@db_call
+def apply_payment_status(payment_id, status, amount):
+    # Зачисление идемпотентно: флаг credited и операция в журнале (kind='topup', ref=payment_id)
+    # пишутся в одной транзакции, поэтому повторное уведомление или сверка деньги второй раз не начислят
+    conn = _get_connection()
+    with conn:
+        row = conn.execute("SELECT user_id, credited FROM payments WHERE payment_id=?", (payment_id,)).fetchone()
+        if not row:
+            return None
+        user_id, credited = row
+        conn.execute(
+            "UPDATE payments SET status=?, checked_at=strftime('%s','now') WHERE payment_id=?", (status, payment_id)
+        )
+        if status != "succeeded" or credited:
+            return None
+        conn.execute("UPDATE payments SET credited=1, amount=? WHERE payment_id=?", (amount, payment_id))
+        return _apply_transaction(conn, user_id, amount, "topup", payment_id, "Пополнение через ЮKassa")
+
+# --- Уведомления о сроке действия ---
+# Ключ включает notAfter сертификата: после продления напоминания для нового срока отправятся заново
+@db_call
+def get_expiry_notices(client_names):
+    conn = _get_connection()
+    result = set()
+    for chunk in _chunks(client_names):
+        placeholders = ",".join("?" * len(chunk))
+        result.update(conn.execute(
+            f"SELECT client_name, not_after, kind FROM expiry_notices WHERE client_name IN ({placeholders})", chunk
+        ))
+    return result
+
+@db_call
+def add_expiry_notice(client_name, not_after, kind):
+    conn = _get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO expiry_notices (client_name, not_after, kind) VALUES (?, ?, ?)",
+            (client_name, not_after, kind),
+        )
+
+# --- file_id загруженных документов ---
+@db_call
+def load_file_ids():
+    return _get_connection().execute("SELECT path, mtime_ns, size, file_id FROM file_ids").fetchall()
+
+@db_call
+def save_file_id(path, mtime_ns, size, file_id):
+    conn = _get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO file_ids (path, mtime_ns, size, file_id) VALUES (?, ?, ?, ?)",
+            (path, mtime_ns, size, file_id),
+        )
+
+@db_call
+def delete_file_ids(paths):
+    conn = _get_connection()
+    with conn:
+        conn.executemany("DELETE FROM file_ids WHERE path=?", [(p,) for p in paths])
+
+# --- Импорт старых файлов ---
+def _read_ids(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [int(line.strip()) for line in f if line.strip().isdigit()]
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[import_legacy_files] Не удалось прочитать {path}: {e}")
+        return {}
+
+@db_call
+def import_legacy_files(users_file, approved_file, pending_file, emoji_file, last_menus_file):
+    conn = _get_connection()
+    if conn.execute("SELECT 1 FROM meta WHERE key='legacy_files_imported'").fetchone():
+        return False
+    with conn:
+        conn.executemany(USER_STATE_SQL["add_user"], [(uid,) for uid in _read_ids(users_file)])
+        conn.executemany(USER_STATE_SQL["approve"], [(uid,) for uid in _read_ids(approved_file)])
+        conn.executemany(
+            USER_STATE_SQL["add_pending"],
+            [
+                (int(uid), (info or {}).get("username"), (info or {}).get("fullname"))
+                for uid, info in _read_json(pending_file).items() if uid.isdigit()
+            ],
+        )
+        conn.executemany(
+            USER_STATE_SQL["set_emoji"],
+            [(int(uid), emoji) for uid, emoji in _read_json(emoji_file).items() if uid.isdigit() and emoji],
+        )
+        conn.executemany(
+            USER_STATE_SQL["add_last_menu"],
+            [
+                (int(uid), int(mid))
+                for uid, ids in _read_json(last_menus_file).items() if uid.isdigit()
+                for mid in ids
+            ],
+        )
+        conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_files_imported', '1')")
+    return True
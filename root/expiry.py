@@ -0,0 +1,156 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+from certs import days_left, expiry_index, pki_lock
+from db import (
+    InsufficientFunds, add_expiry_notice, add_transaction, get_balances, get_expiry_notices, get_transaction_refs,
+    get_user_ids_by_names,
+)
+from registry import client_registry
+from runner import run_command
+
+RENEW_SCRIPT = "/etc/openvpn/easyrsa3/renew_cert.sh"
+CLIENT_KEYS_DIR = "/etc/openvpn/client/keys"
+# RENEW_PRICE=0 отключает автопродление: остаются только напоминания и отзыв
+RENEW_PRICE = float(os.getenv("RENEW_PRICE", "0"))
+RENEW_DAYS = int(os.getenv("RENEW_DAYS", "30"))
+RENEW_WORKERS = int(os.getenv("RENEW_WORKERS", "4"))
+RENEW_TIMEOUT = 120
+EXPIRY_NOTICE_DAYS = int(os.getenv("EXPIRY_NOTICE_DAYS", "3"))
+EXPIRY_GRACE_DAYS = int(os.getenv("EXPIRY_GRACE_DAYS", "3"))
+# Отзыв включается явно: до планировщика сертификаты с истёкшим сроком никто не отзывал
+EXPIRY_REVOKE = os.getenv("EXPIRY_REVOKE", "0") == "1"
+EXPIRY_CHECK_INTERVAL = int(os.getenv("EXPIRY_CHECK_INTERVAL", "3600"))
+
+class ExpiryScheduler:
+    # Периодический проход по индексу сроков действия сертификатов:
+    #  - истекает в ближайшие EXPIRY_NOTICE_DAYS дней (или истёк, но не прошёл льготный срок):
+    #    продлеваем, если баланса хватает на RENEW_PRICE, иначе один раз напоминаем;
+    #  - истёк больше EXPIRY_GRACE_DAYS дней назад: отзываем сертификат (только при EXPIRY_REVOKE=1).
+    # Действуем только для клиентов, привязанных к пользователю бота.
+
+    def __init__(self, bot, render_profiles, revoke_client, admin_id):
+        self.bot = bot
+        self.render_profiles = render_profiles
+        self.revoke_client = revoke_client
+        self.admin_id = admin_id
+
+    async def run(self, interval=EXPIRY_CHECK_INTERVAL):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"[ExpiryScheduler] Ошибка проверки сроков: {e}")
+            await asyncio.sleep(interval)
+
+    async def sweep(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        grace_start = now - timedelta(days=EXPIRY_GRACE_DAYS)
+        upcoming = expiry_index.between(grace_start, now + timedelta(days=EXPIRY_NOTICE_DAYS + 1))
+        lapsed = expiry_index.between(datetime.min.replace(tzinfo=timezone.utc), grace_start) if EXPIRY_REVOKE else []
+        upcoming = [(n, d) for n, d in upcoming if client_registry.contains("openvpn", n)]
+        lapsed = [(n, d) for n, d in lapsed if client_registry.contains("openvpn", n)]
+        names = [name for name, _ in upcoming + lapsed]
+        if not names:
+            return
+
+        uid_by_name = await get_user_ids_by_names(names)
+        notices = await get_expiry_notices(names)
+        balances = await get_balances(set(uid_by_name.values()))
+        # Уже оплаченные продления (например, если прошлый запуск renew_cert.sh упал) повторяем без списания
+        paid = await get_transaction_refs("renew", [_ref(n, d) for n, d in upcoming])
+
+        jobs = []
+        for name, not_after in upcoming:
+            user_id = uid_by_name.get(name)
+            if user_id is None:
+                continue
+            if (name, not_after.isoformat(), "renewed") in notices:
+                continue
+            if _ref(name, not_after) in paid:
+                jobs.append(self._renew(name, user_id, not_after, now, charge=False))
+            elif RENEW_PRICE > 0 and balances.get(user_id, 0.0) >= RENEW_PRICE:
+                jobs.append(self._renew(name, user_id, not_after, now, charge=True))
+            else:
+                kind = "expired" if not_after <= now else "reminder"
+                if (name, not_after.isoformat(), kind) not in notices:
+                    jobs.append(self._remind(name, user_id, not_after, now, kind))
+        for name, not_after in lapsed:
+            user_id = uid_by_name.get(name)
+            if user_id is not None and (name, not_after.isoformat(), "revoked") not in notices:
+                jobs.append(self._revoke(name, user_id, not_after))
+
+        semaphore = asyncio.Semaphore(RENEW_WORKERS)
+
+        async def bounded(job):
+            async with semaphore:
+                return await job
+
+        results = await asyncio.gather(*(bounded(job) for job in jobs), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"[ExpiryScheduler] Ошибка обработки клиента: {result}")
+
+    async def _renew(self, name, user_id, not_after, now, charge):
+        if charge:
+            try:
+                await add_transaction(
+                    user_id, -RENEW_PRICE, "renew", _ref(name, not_after),
+                    f"Продление {name} на {RENEW_DAYS} дн.", allow_negative=False
+                )
+            except InsufficientFunds:
+                return
+        # Неистёкшие дни не сгорают: новый сертификат выпускается на остаток + RENEW_DAYS
+        days = RENEW_DAYS + max(days_left(not_after, now), 0)
+        async with pki_lock:
+            result = await run_command([RENEW_SCRIPT, name, str(days)], timeout=RENEW_TIMEOUT)
+        if result["returncode"] != 0:
+            await self._send(self.admin_id, f"❌ Не удалось продлить сертификат <b>{name}</b>: {result['stderr']}")
+            return
+        # client.sh копирует сертификат в client/keys, только если его там нет
+        try:
+            os.remove(os.path.join(CLIENT_KEYS_DIR, f"{name}.crt"))
+        except FileNotFoundError:
+            pass
+        await add_expiry_notice(name, not_after.isoformat(), "renewed")
+        result = await self.render_profiles(name, days)
+        if result["returncode"] != 0:
+            await self._send(self.admin_id, f"❌ Сертификат <b>{name}</b> продлён, но конфиги не пересозданы: {result['stderr']}")
+        await self._send(
+            user_id,
+            f"✅ Доступ к VPN продлён на {RENEW_DAYS} дн."
+            + (f" Списано {RENEW_PRICE:.2f} руб." if charge else "")
+            + "\nСкачайте конфиг OpenVPN заново в меню бота."
+        )
+
+    async def _remind(self, name, user_id, not_after, now, kind):
+        if kind == "expired":
+            text = f"⛔ Срок действия VPN-доступа <b>{name}</b> истёк."
+        else:
+            text = f"⏳ Срок действия VPN-доступа <b>{name}</b> истекает через {max(days_left(not_after, now), 0)} дн."
+        if RENEW_PRICE > 0:
+            text += f"\nПополните баланс на {RENEW_PRICE:.2f} руб. — доступ продлится автоматически."
+        else:
+            text += "\nДля продления свяжитесь с администратором."
+        await self._send(user_id, text)
+        await add_expiry_notice(name, not_after.isoformat(), kind)
+
+    async def _revoke(self, name, user_id, not_after):
+        # revoke_client идёт через execute_script, который сам берёт pki_lock
+        result = await self.revoke_client(name, user_id)
+        if result["returncode"] != 0:
+            print(f"[ExpiryScheduler] Не удалось отозвать {name}: {result['stderr']}")
+            return
+        await add_expiry_notice(name, not_after.isoformat(), "revoked")
+        await self._send(user_id, f"⛔ Доступ <b>{name}</b> отключён: срок действия истёк {EXPIRY_GRACE_DAYS}+ дн. назад.")
+        await self._send(self.admin_id, f"⛔ Клиент <b>{name}</b> отозван по истечении срока.")
+
+    async def _send(self, chat_id, text):
+        try:
+            await self.bot.send_message(chat_id, text, parse_mode="HTML")
+        except Exception as e:
+            print(f"[ExpiryScheduler] Не удалось отправить сообщение {chat_id}: {e}")
+
+def _ref(name, not_after):
+    return f"{name}:{not_after.isoformat()}"
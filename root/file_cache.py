@@ -0,0 +1,63 @@
+import os
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+from db import delete_file_ids, load_file_ids, save_file_id
+from profiles import CLIENT_PROTOCOLS, client_paths
+
+class FileIdCache:
+    # Telegram file_id уже загруженных конфигов: (путь, mtime, размер) -> file_id.
+    # Если client.sh перегенерировал файл, mtime/размер меняются и файл загружается заново.
+
+    def __init__(self):
+        self._entries = {}
+
+    async def load(self):
+        self._entries = {path: (mtime_ns, size, file_id) for path, mtime_ns, size, file_id in await load_file_ids()}
+
+    def get(self, path, st):
+        entry = self._entries.get(path)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        return None
+
+    async def put(self, path, st, file_id):
+        self._entries[path] = (st.st_mtime_ns, st.st_size, file_id)
+        await save_file_id(path, st.st_mtime_ns, st.st_size, file_id)
+
+    async def invalidate(self, client_name=None):
+        if client_name is None:
+            paths = list(self._entries)
+        else:
+            # Точные пути профилей клиента: "user1" не задевает файлы "user10" и "xuser1"
+            targets = {p for client_type in CLIENT_PROTOCOLS for p in client_paths(client_name, client_type)}
+            paths = [p for p in self._entries if p in targets]
+        for p in paths:
+            self._entries.pop(p, None)
+        if paths:
+            await delete_file_ids(paths)
+
+    async def send(self, bot, chat_id, path, caption=None):
+        st = os.stat(path)
+        file_id = self.get(path, st)
+        if file_id:
+            try:
+                return await bot.send_document(chat_id, file_id, caption=caption)
+            except TelegramBadRequest as e:
+                print(f"[FileIdCache] file_id для {path} больше не действителен: {e}")
+                await self.invalidate_path(path)
+        msg = await bot.send_document(chat_id, FSInputFile(path), caption=caption)
+        if msg.document:
+            await self.put(path, st, msg.document.file_id)
+        return msg
+
+    async def invalidate_path(self, path):
+        await self.invalidate_paths([path])
+
+    async def invalidate_paths(self, paths):
+        paths = [p for p in paths if self._entries.pop(p, None)]
+        if paths:
+            await delete_file_ids(paths)
+
+file_id_cache = FileIdCache()
@@ -0,0 +1,227 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+
+from openvpn_status import parse_status_v2
+
+# Совпадает с директивами "management" в etc/openvpn/server/*.conf
+MANAGEMENT_ENDPOINTS = {
+    "antizapret-udp": ("127.0.0.1", 7505),
+    "antizapret-tcp": ("127.0.0.1", 7506),
+    "vpn-udp": ("127.0.0.1", 7507),
+    "vpn-tcp": ("127.0.0.1", 7508),
+}
+# Файл пароля из тех же директив "management"; OpenVPN спрашивает его сразу после подключения
+MANAGEMENT_PASSWORD_FILE = os.getenv("MANAGEMENT_PASSWORD_FILE", "/etc/openvpn/server/management-pw")
+PASSWORD_PROMPT = b"ENTER PASSWORD:"
+RECONNECT_DELAY = 5
+BYTECOUNT_INTERVAL = 5
+RESYNC_INTERVAL = 60
+COMMAND_TIMEOUT = 10
+
+def _read_password(path):
+    # OpenVPN берёт из файла первую строку
+    with open(path, "r", encoding="utf-8") as f:
+        return f.readline().strip()
+
+def _session_from_env(env, instance, cid):
+    since = env.get("time_unix", "")
+    address = env.get("trusted_ip", "")
+    if address and env.get("trusted_port"):
+        address = f"{address}:{env['trusted_port']}"
+    return {
+        "client": env.get("common_name", ""),
+        "real_address": address,
+        "virtual_address": env.get("ifconfig_pool_remote_ip", ""),
+        "bytes_received": int(env.get("bytes_received", 0) or 0),
+        "bytes_sent": int(env.get("bytes_sent", 0) or 0),
+        "connected_since": datetime.fromtimestamp(int(since), timezone.utc) if since.isdigit() else None,
+        "instance": instance,
+        "client_id": cid,
+    }
+
+class ManagementConnection:
+    # Постоянное соединение с management-интерфейсом одного экземпляра OpenVPN.
+    # Сессии держим в памяти и обновляем по событиям >CLIENT: и >BYTECOUNT_CLI:.
+
+    def __init__(self, instance, host, port, password_file=MANAGEMENT_PASSWORD_FILE):
+        self.instance = instance
+        self.host = host
+        self.port = port
+        self.password_file = password_file
+        self.sessions = {}
+        self.connected = False
+        self._writer = None
+        self._command_lock = asyncio.Lock()
+        self._response = None
+        self._client_event = None
+
+    async def run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                await asyncio.wait_for(self._login(reader, writer), COMMAND_TIMEOUT)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+                print(f"[management {self.instance}] Не удалось войти: {e}")
+                writer.close()
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self._writer = writer
+            read_task = asyncio.create_task(self._read_loop(reader))
+            try:
+                await self.command(f"bytecount {BYTECOUNT_INTERVAL}")
+                await self.resync()
+                self.connected = True
+                while not read_task.done():
+                    await asyncio.wait({read_task}, timeout=RESYNC_INTERVAL)
+                    if not read_task.done():
+                        await self.resync()
+            except Exception as e:
+                print(f"[management {self.instance}] Соединение потеряно: {e}")
+            finally:
+                self.connected = False
+                self.sessions = {}
+                read_task.cancel()
+                writer.close()
+                if self._response and not self._response[0].done():
+                    self._response[0].set_exception(ConnectionError("management connection closed"))
+                self._response = None
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _login(self, reader, writer):
+        # С паролем OpenVPN первым делом шлёт "ENTER PASSWORD:" без перевода строки, без пароля — ">INFO:...".
+        # Оба варианта заканчиваются на первом ":", дальше баннер дочитываем строкой.
+        head = await reader.readuntil(b":")
+        if head != PASSWORD_PROMPT:
+            await reader.readline()
+            return
+        writer.write(f"{_read_password(self.password_file)}\n".encode())
+        await writer.drain()
+        reply = (await reader.readline()).decode(errors="replace").strip()
+        if not reply.startswith("SUCCESS:"):
+            raise ConnectionError(reply or "management interface closed the connection")
+
+    async def _read_loop(self, reader):
+        while True:
+            raw = await reader.readline()
+            if not raw:
+                return
+            line = raw.decode(errors="replace").rstrip("\r\n")
+            if line.startswith(">"):
+                self._on_notification(line[1:])
+            elif self._response:
+                future, multiline, lines = self._response
+                if multiline and line != "END" and not line.startswith("ERROR:"):
+                    lines.append(line)
+                    continue
+                lines.append(line)
+                if not future.done():
+                    future.set_result(lines)
+                self._response = None
+
+    def _on_notification(self, line):
+        kind, _, payload = line.partition(":")
+        if kind == "BYTECOUNT_CLI":
+            cid, bytes_in, bytes_out = (payload.split(",") + ["", "", ""])[:3]
+            session = self.sessions.get(cid)
+            if session:
+                session["bytes_received"] = int(bytes_in or 0)
+                session["bytes_sent"] = int(bytes_out or 0)
+        elif kind == "CLIENT":
+            event, _, rest = payload.partition(",")
+            if event == "ENV" and self._client_event:
+                if rest == "END":
+                    self._finish_client_event()
+                else:
+                    name, _, value = rest.partition("=")
+                    self._client_event[2][name] = value
+            elif event in ("ESTABLISHED", "DISCONNECT", "CONNECT", "REAUTH"):
+                self._client_event = (event, rest.split(",")[0], {})
+
+    def _finish_client_event(self):
+        event, cid, env = self._client_event
+        self._client_event = None
+        if event == "ESTABLISHED":
+            self.sessions[cid] = _session_from_env(env, self.instance, cid)
+        elif event == "DISCONNECT":
+            self.sessions.pop(cid, None)
+
+    async def command(self, cmd, multiline=False):
+        async with self._command_lock:
+            if self._writer is None:
+                raise ConnectionError("management interface is not connected")
+            future = asyncio.get_running_loop().create_future()
+            self._response = (future, multiline, [])
+            self._writer.write(f"{cmd}\n".encode())
+            await self._writer.drain()
+            try:
+                return await asyncio.wait_for(future, COMMAND_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Запоздавший ответ иначе достался бы следующей команде: рвём соединение,
+                # run() переподключится и заново снимет status
+                self._response = None
+                self._writer.close()
+                self._writer = None
+                raise
+
+    async def resync(self):
+        lines = await self.command("status 2", multiline=True)
+        self.sessions = {s["client_id"]: s for s in parse_status_v2(lines, self.instance)}
+
+    async def kill(self, common_name):
+        lines = await self.command(f"kill {common_name}")
+        reply = lines[-1] if lines else ""
+        if not reply.startswith("SUCCESS:"):
+            return 0
+        # "SUCCESS: common name 'x' found, 1 client(s) killed"
+        for part in reply.split(","):
+            words = part.split()
+            if words and words[0].isdigit():
+                return int(words[0])
+        return 1
+
+class ManagementPool:
+    def __init__(self, endpoints=MANAGEMENT_ENDPOINTS, password_file=MANAGEMENT_PASSWORD_FILE):
+        self.connections = {
+            instance: ManagementConnection(instance, host, port, password_file)
+            for instance, (host, port) in endpoints.items()
+        }
+        self._tasks = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(c.run()) for c in self.connections.values()]
+
+    def live_instances(self):
+        return {name for name, c in self.connections.items() if c.connected}
+
+    def sessions(self):
+        result = []
+        for c in self.connections.values():
+            if c.connected:
+                result.extend(c.sessions.values())
+        return result
+
+    def online(self):
+        online = {}
+        for session in self.sessions():
+            if session["client"] and session["client"] != "UNDEF":
+                online.setdefault(session["client"], f"OpenVPN {session['instance']}")
+        return online
+
+    async def kill(self, common_name):
+        live = [c for c in self.connections.values() if c.connected]
+        results = await asyncio.gather(*(c.kill(common_name) for c in live), return_exceptions=True)
+        killed = 0
+        for conn, result in zip(live, results):
+            if isinstance(result, Exception):
+                print(f"[management {conn.instance}] Не удалось отключить {common_name}: {result}")
+            else:
+                killed += result
+        return killed
+
+management_pool = ManagementPool()
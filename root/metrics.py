@@ -0,0 +1,91 @@
+import asyncio
+import platform
+import socket
+import time
+from datetime import timedelta
+
+import psutil
+import requests
+
+SAMPLE_INTERVAL = 10
+IP_TTL = 3600
+IP_RETRY_INTERVAL = 60
+
+def get_external_ip():
+    try:
+        response = requests.get("https://api.ipify.org", timeout=10)
+        if response.status_code == 200:
+            return response.text
+        return "IP не найден"
+    except requests.RequestException as e:
+        return f"Ошибка при запросе: {e}"
+
+def _format_rate(bytes_per_second):
+    return f"{bytes_per_second * 8 / 1_000_000:.2f} Мбит/с"
+
+class ServerMetrics:
+    # Снимок состояния сервера, который фоновая задача обновляет раз в SAMPLE_INTERVAL.
+    # Меню только читают снимок и не ждут ни psutil, ни api.ipify.org.
+
+    def __init__(self):
+        self.snapshot = {
+            "hostname": socket.gethostname(),
+            "os_version": platform.platform(),
+            "boot_time": psutil.boot_time(),
+            "cpu": 0.0,
+            "mem": 0.0,
+            "net_recv_rate": 0.0,
+            "net_sent_rate": 0.0,
+            "ip": None,
+        }
+        self._ip_checked_at = 0.0
+        self._last_net = None
+        psutil.cpu_percent(interval=None)
+
+    def sample(self):
+        now = time.monotonic()
+        net = psutil.net_io_counters()
+        if self._last_net:
+            prev_time, prev = self._last_net
+            elapsed = max(now - prev_time, 1e-6)
+            self.snapshot["net_recv_rate"] = (net.bytes_recv - prev.bytes_recv) / elapsed
+            self.snapshot["net_sent_rate"] = (net.bytes_sent - prev.bytes_sent) / elapsed
+        self._last_net = (now, net)
+        self.snapshot["cpu"] = psutil.cpu_percent(interval=None)
+        self.snapshot["mem"] = psutil.virtual_memory().percent
+        self.snapshot["boot_time"] = psutil.boot_time()
+
+    async def refresh_ip(self, force=False):
+        ttl = IP_TTL if self._ip_ok() else IP_RETRY_INTERVAL
+        if not force and time.monotonic() - self._ip_checked_at < ttl:
+            return self.snapshot["ip"]
+        self._ip_checked_at = time.monotonic()
+        self.snapshot["ip"] = await asyncio.to_thread(get_external_ip)
+        return self.snapshot["ip"]
+
+    def _ip_ok(self):
+        ip = self.snapshot["ip"]
+        return bool(ip) and not ip.startswith("Ошибка") and ip != "IP не найден"
+
+    async def run(self, interval=SAMPLE_INTERVAL):
+        while True:
+            try:
+                self.sample()
+                await self.refresh_ip()
+            except Exception as e:
+                print(f"[ServerMetrics] Ошибка обновления метрик: {e}")
+            await asyncio.sleep(interval)
+
+    def render(self):
+        s = self.snapshot
+        uptime = timedelta(seconds=int(time.time() - s["boot_time"]))
+        return f"""<b>💻 Сервер:</b> <code>{s['hostname']}</code>
+<b>🌐 IP:</b> <code>{s['ip'] or 'определяется...'}</code>
+<b>🕒 Аптайм:</b> <code>{uptime}</code>
+<b>🧠 RAM:</b> <code>{s['mem']}%</code>
+<b>⚡ CPU:</b> <code>{s['cpu']}%</code>
+<b>📶 Сеть:</b> <code>↓ {_format_rate(s['net_recv_rate'])} ↑ {_format_rate(s['net_sent_rate'])}</code>
+<b>🛠 ОС:</b> <code>{s['os_version']}</code>
+"""
+
+server_metrics = ServerMetrics()
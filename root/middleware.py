@@ -0,0 +1,93 @@
+import asyncio
+import contextlib
+import os
+import time
+
+from aiogram import BaseMiddleware
+
+# Нажатий в секунду на пользователя и допустимая пачка подряд
+CALLBACK_RATE = float(os.getenv("CALLBACK_RATE", "3"))
+CALLBACK_BURST = int(os.getenv("CALLBACK_BURST", "6"))
+MAX_TRACKED_USERS = 10000
+
+class KeyedLock:
+    # Блокировка на имя клиента. Повторный вход из той же задачи не блокирует,
+    # чтобы обработчик под блокировкой мог вызывать execute_script, который тоже её берёт.
+    # Записи удаляются, когда блокировку никто не держит и не ждёт.
+
+    def __init__(self):
+        self._entries = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        task = asyncio.current_task()
+        entry = self._entries.get(key)
+        if entry and entry["owner"] is task:
+            yield
+            return
+        entry = self._entries.setdefault(key, {"lock": asyncio.Lock(), "users": 0, "owner": None})
+        entry["users"] += 1
+        try:
+            async with entry["lock"]:
+                entry["owner"] = task
+                try:
+                    yield
+                finally:
+                    entry["owner"] = None
+        finally:
+            entry["users"] -= 1
+            if not entry["users"]:
+                self._entries.pop(key, None)
+
+client_locks = KeyedLock()
+
+async def _answer(event, text=None):
+    try:
+        await event.answer(text)
+    except Exception:
+        pass
+
+class CallbackGuard(BaseMiddleware):
+    # Внешний middleware для callback_query:
+    #  - пока обрабатывается нажатие, такие же нажатия (тот же пользователь, те же callback_data) отбрасываются;
+    #  - частота нажатий ограничена token bucket'ом на пользователя.
+
+    def __init__(self, rate=CALLBACK_RATE, burst=CALLBACK_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._in_flight = set()
+        self._buckets = {}
+
+    def _allow(self, user_id):
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        self._buckets[user_id] = (tokens - 1 if allowed else tokens, now)
+        if len(self._buckets) > MAX_TRACKED_USERS:
+            self._prune(now)
+        return allowed
+
+    def _prune(self, now):
+        # Пользователи с полным запасом ничем не отличаются от новых — их можно забыть
+        self._buckets = {
+            uid: (tokens, updated) for uid, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self.rate < self.burst
+        }
+
+    async def __call__(self, handler, event, data):
+        user = event.from_user
+        if user is None:
+            return await handler(event, data)
+        key = (user.id, event.data)
+        if key in self._in_flight:
+            await _answer(event)
+            return None
+        if not self._allow(user.id):
+            await _answer(event, "⏳ Слишком часто, подождите секунду")
+            return None
+        self._in_flight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(key)
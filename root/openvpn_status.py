@@ -0,0 +1,85 @@
+import csv
+import os
+from datetime import datetime, timezone
+
+STATUS_DIR = "/etc/openvpn/server/logs"
+INSTANCES = ["antizapret-udp", "antizapret-tcp", "vpn-udp", "vpn-tcp"]
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def parse_status_v2(lines, instance):
+    # status-version 2: строки CSV, колонки CLIENT_LIST описаны строкой HEADER,CLIENT_LIST,...
+    columns = None
+    sessions = []
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        if row[0] == "HEADER" and len(row) > 1 and row[1] == "CLIENT_LIST":
+            columns = row[2:]
+        elif row[0] == "CLIENT_LIST" and columns:
+            data = dict(zip(columns, row[1:]))
+            since = _to_int(data.get("Connected Since (time_t)"))
+            sessions.append({
+                "client": data.get("Common Name", ""),
+                "real_address": data.get("Real Address", ""),
+                "virtual_address": data.get("Virtual Address", ""),
+                "bytes_received": _to_int(data.get("Bytes Received")),
+                "bytes_sent": _to_int(data.get("Bytes Sent")),
+                "connected_since": datetime.fromtimestamp(since, timezone.utc) if since else None,
+                "instance": instance,
+                "client_id": data.get("Client ID", ""),
+            })
+    return sessions
+
+class StatusAggregator:
+    # Сессии всех четырёх экземпляров OpenVPN; файл статуса перечитывается только при смене mtime.
+
+    def __init__(self, status_dir=STATUS_DIR, instances=INSTANCES):
+        self.status_dir = status_dir
+        self.instances = list(instances)
+        self._cache = {}
+
+    def _path(self, instance):
+        return os.path.join(self.status_dir, f"{instance}-status.log")
+
+    def refresh(self):
+        for instance in self.instances:
+            path = self._path(instance)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self._cache.pop(instance, None)
+                continue
+            cached = self._cache.get(instance)
+            if cached and cached[0] == mtime:
+                continue
+            try:
+                with open(path, "r", newline="") as f:
+                    sessions = parse_status_v2(f, instance)
+            except OSError as e:
+                print(f"[StatusAggregator] Не удалось прочитать {path}: {e}")
+                continue
+            self._cache[instance] = (mtime, sessions)
+
+    def sessions(self):
+        self.refresh()
+        result = []
+        for instance in self.instances:
+            if instance in self._cache:
+                result.extend(self._cache[instance][1])
+        return result
+
+    def online(self, skip_instances=()):
+        online = {}
+        for session in self.sessions():
+            if session["instance"] in skip_instances:
+                continue
+            if session["client"] and session["client"] != "UNDEF":
+                online.setdefault(session["client"], f"OpenVPN {session['instance']}")
+        return online
+
+status_aggregator = StatusAggregator()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import uuid
+
+from aiohttp import web
+from yookassa import Configuration, Payment as YooPayment
+from yookassa.domain.exceptions import NotFoundError
+
+from db import apply_payment_status, create_payment, get_pending_payments, has_payment
+
+# YOOKASSA_API_URL позволяет направить SDK на локальную заглушку API при тестах
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL")
+PAYMENT_RETURN_URL = os.getenv("PAYMENT_RETURN_URL", "https://your-bot-url/return")
+PAYMENT_WEBHOOK_PATH = os.getenv("PAYMENT_WEBHOOK_PATH", "/yookassa")
+RECONCILE_INTERVAL = int(os.getenv("PAYMENT_RECONCILE_INTERVAL", "30"))
+RECONCILE_BATCH = 50
+RECONCILE_CONCURRENCY = 4
+
+def configure_yookassa(shop_id, secret_key, api_url=YOOKASSA_API_URL):
+    Configuration.configure(shop_id, secret_key)
+    if api_url:
+        Configuration.api_url = api_url.rstrip("/")
+
+class PaymentService:
+    # Платёж создаётся в ЮKassa, в vpn.db записывается со статусом pending,
+    # а баланс пополняется только когда ЮKassa подтвердит статус succeeded.
+    # Статус узнаём из уведомления (HTTP) или фоновой сверкой — что случится раньше.
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+
+    async def create(self, user_id, amount):
+        # SDK синхронный (requests), поэтому уводим его в отдельный поток
+        payment = await asyncio.to_thread(
+            YooPayment.create,
+            {
+                "amount": {"value": f"{amount:.2f}", "currency": "RUB"},
+                "confirmation": {"type": "redirect", "return_url": PAYMENT_RETURN_URL},
+                "capture": True,
+                "description": f"Пополнение баланса для user_id {user_id}",
+                "metadata": {"user_id": str(user_id)},
+            },
+            str(uuid.uuid4()),
+        )
+        url = payment.confirmation.confirmation_url
+        await create_payment(payment.id, user_id, amount, payment.status, url)
+        return payment.id, url
+
+    async def check(self, payment_id):
+        # Данным из уведомления не доверяем: статус и сумму берём из API ЮKassa
+        async with self._semaphore:
+            payment = await asyncio.to_thread(YooPayment.find_one, payment_id)
+        credit = await apply_payment_status(payment.id, payment.status, float(payment.amount.value))
+        if credit:
+            await self._notify(credit)
+        return payment.status
+
+    async def _notify(self, credit):
+        try:
+            await self.bot.send_message(
+                credit["user_id"],
+                f"✅ Баланс пополнен на {credit['amount']:.2f} руб.\n"
+                f"Текущий баланс: {credit['balance']:.2f} руб.",
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            print(f"[payments] Не удалось уведомить user_id={credit['user_id']}: {e}")
+
+    async def handle_notification(self, request):
+        try:
+            data = await request.json()
+            payment_id = data["object"]["id"]
+        except Exception:
+            return web.Response(status=400)
+        try:
+            # Чужой или неизвестный платёж: отвечаем 200, иначе ЮKassa будет повторять уведомление бесконечно
+            if not await has_payment(payment_id):
+                print(f"[payments] Уведомление о неизвестном платеже {payment_id}, пропускаем")
+                return web.Response()
+            await self.check(payment_id)
+        except NotFoundError:
+            print(f"[payments] Платёж {payment_id} не найден в ЮKassa, пропускаем")
+            return web.Response()
+        except Exception as e:
+            # Ответ не 200 — ЮKassa повторит уведомление позже
+            print(f"[payments] Ошибка обработки уведомления {payment_id}: {e}")
+            return web.Response(status=500)
+        return web.Response()
+
+    def register(self, app, path=PAYMENT_WEBHOOK_PATH):
+        app.router.add_post(path, self.handle_notification)
+
+    async def reconcile(self):
+        payment_ids = await get_pending_payments(RECONCILE_BATCH)
+        results = await asyncio.gather(*(self.check(pid) for pid in payment_ids), return_exceptions=True)
+        for payment_id, result in zip(payment_ids, results):
+            if isinstance(result, Exception):
+                print(f"[payments] Не удалось проверить платёж {payment_id}: {result}")
+
+    async def run(self, interval=RECONCILE_INTERVAL):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"[payments] Ошибка сверки платежей: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,323 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from runner import run_command
+
+OPENVPN_TEMPLATES_DIR = "/etc/openvpn/client/templates"
+WIREGUARD_TEMPLATES_DIR = "/etc/wireguard/templates"
+CLIENT_DIR = "/root/antizapret/client"
+SETUP_FILE = "/root/antizapret/setup"
+WG_KEY_FILE = "/etc/wireguard/key"
+WG_IPS_FILE = "/etc/wireguard/ips"
+SERVER_CA_FILE = "/etc/openvpn/server/keys/ca.crt"
+CLIENT_KEYS_DIR = "/etc/openvpn/client/keys"
+PKI_DIR = "/etc/openvpn/easyrsa3/pki"
+FILEVPN_NAME = os.getenv("FILEVPN_NAME", "")
+
+# (протокол, вариант, транспорт) -> путь профиля относительно CLIENT_DIR, как в addOpenVPN/addWireGuard из client.sh.
+# Транспорт None — общий профиль OpenVPN (udp и tcp в одном файле) и профили WireGuard/AmneziaWG.
+PROFILE_TARGETS = {
+    ("openvpn", "antizapret", "udp"): "openvpn/antizapret-udp/antizapret-{name}-udp.ovpn",
+    ("openvpn", "antizapret", "tcp"): "openvpn/antizapret-tcp/antizapret-{name}-tcp.ovpn",
+    ("openvpn", "antizapret", None): "openvpn/antizapret/{filevpn} - {name}.ovpn",
+    ("openvpn", "vpn", "udp"): "openvpn/vpn-udp/vpn-{name}-udp.ovpn",
+    ("openvpn", "vpn", "tcp"): "openvpn/vpn-tcp/vpn-{name}-tcp.ovpn",
+    ("openvpn", "vpn", None): "openvpn/vpn/{filevpn} - Обычный VPN - {name}.ovpn",
+    ("wireguard", "antizapret", None): "wireguard/antizapret/{filevpn} -{name}.conf",
+    ("amneziawg", "antizapret", None): "amneziawg/antizapret/{filevpn} -{name}.conf",
+    ("wireguard", "vpn", None): "wireguard/vpn/{filevpn} - Обычный VPN -{name}.conf",
+    ("amneziawg", "vpn", None): "amneziawg/vpn/{filevpn} - Обычный VPN -{name}.conf",
+}
+# Протоколы профилей по типу клиента: клиент WireGuard получает и профили AmneziaWG
+CLIENT_PROTOCOLS = {"openvpn": ("openvpn",), "wireguard": ("wireguard", "amneziawg")}
+
+# Шаблон -> профиль
+OPENVPN_PROFILES = [
+    ("antizapret-udp.conf", ("openvpn", "antizapret", "udp")),
+    ("antizapret-tcp.conf", ("openvpn", "antizapret", "tcp")),
+    ("antizapret.conf", ("openvpn", "antizapret", None)),
+    ("vpn-udp.conf", ("openvpn", "vpn", "udp")),
+    ("vpn-tcp.conf", ("openvpn", "vpn", "tcp")),
+    ("vpn.conf", ("openvpn", "vpn", None)),
+]
+WIREGUARD_PROFILES = [
+    ("antizapret-client-wg.conf", "antizapret", ("wireguard", "antizapret", None)),
+    ("antizapret-client-am.conf", "antizapret", ("amneziawg", "antizapret", None)),
+    ("vpn-client-wg.conf", "vpn", ("wireguard", "vpn", None)),
+    ("vpn-client-am.conf", "vpn", ("amneziawg", "vpn", None)),
+]
+
+_PLACEHOLDER = re.compile(r"\$\{([A-Za-z_][A-Za-z_0-9]*)\}")
+
+class Template:
+    # Шаблон разбирается один раз: чётные элементы — текст, нечётные — имена переменных.
+    # Неизвестная переменная подставляется пустой строкой, как в render() из client.sh.
+
+    def __init__(self, text):
+        self._parts = _PLACEHOLDER.split(text)
+        self.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def render(self, variables):
+        parts = self._parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = variables.get(parts[i], "")
+        return "".join(parts)
+
+class TemplateSet:
+    # Шаблоны одного каталога; файл перечитывается и компилируется заново только при смене mtime
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._templates = {}
+
+    def refresh(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        fresh = {}
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            cached = self._templates.get(name)
+            if cached and cached[0] == mtime:
+                fresh[name] = cached
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    fresh[name] = (mtime, Template(f.read()))
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"[TemplateSet] Не удалось прочитать {path}: {e}")
+        self._templates = fresh
+
+    def get(self, name):
+        cached = self._templates.get(name)
+        return cached[1] if cached else None
+
+    def digest(self):
+        # Меняется при любой правке, добавлении или удалении шаблона каталога
+        h = hashlib.sha256()
+        for name in sorted(self._templates):
+            h.update(f"{name}\0{self._templates[name][1].digest}\0".encode("utf-8"))
+        return h.hexdigest()
+
+openvpn_templates = TemplateSet(OPENVPN_TEMPLATES_DIR)
+wireguard_templates = TemplateSet(WIREGUARD_TEMPLATES_DIR)
+
+def write_atomic(path, text, mode=0o644):
+    # Пишем во временный файл рядом и переименовываем: бот никогда не отправит недописанный конфиг
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def _read_shell_vars(path):
+    # KEY=VALUE из файлов, которые client.sh подключает через source
+    result = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                key = key.strip()
+                if key.startswith("export "):
+                    key = key[len("export "):].strip()
+                result[key] = value.strip().strip("'\"")
+    except OSError:
+        pass
+    return result
+
+def _read(path, from_marker=None):
+    # Как $(cat ...) / $(grep -A 999 'BEGIN CERTIFICATE' ...) в client.sh: без хвостовых переводов строки
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if from_marker:
+        start = text.find(from_marker)
+        if start < 0:
+            return ""
+        text = text[text.rfind("\n", 0, start) + 1:]
+    return text.rstrip("\n")
+
+async def get_server_ip():
+    # Тот же адрес, что выбирает setServerIP() в client.sh: первый глобальный IPv4
+    result = await run_command(["ip", "-4", "-o", "addr", "show", "scope", "global"], timeout=10)
+    for line in result["stdout"].splitlines():
+        parts = line.split()
+        if "inet" in parts:
+            return parts[parts.index("inet") + 1].split("/")[0]
+    return ""
+
+async def load_context():
+    # Общие для всех клиентов переменные: читаем один раз на пачку профилей
+    openvpn_templates.refresh()
+    wireguard_templates.refresh()
+    context = dict(_read_shell_vars(SETUP_FILE))
+    context.update(_read_shell_vars(WG_KEY_FILE))
+    context["SERVER_IP"] = await get_server_ip()
+    context["FILEVPN_NAME"] = FILEVPN_NAME
+    try:
+        context["CA_CERT"] = _read(SERVER_CA_FILE, "BEGIN CERTIFICATE")
+    except OSError:
+        context["CA_CERT"] = ""
+    try:
+        context["IPS"] = _read(WG_IPS_FILE)
+    except OSError:
+        context["IPS"] = ""
+    return context
+
+def _copy_atomic(source, target, mode):
+    with open(source, "r", encoding="utf-8") as f:
+        write_atomic(target, f.read(), mode=mode)
+
+def install_client_cert(client_name):
+    # Как addOpenVPN: клиентские сертификат и ключ лежат копией в /etc/openvpn/client/keys.
+    # Копируем атомарно: рендер профилей в это время может читать те же файлы
+    _copy_atomic(os.path.join(PKI_DIR, "issued", f"{client_name}.crt"), os.path.join(CLIENT_KEYS_DIR, f"{client_name}.crt"), 0o644)
+    key_path = os.path.join(CLIENT_KEYS_DIR, f"{client_name}.key")
+    if not os.path.exists(key_path):
+        _copy_atomic(os.path.join(PKI_DIR, "private", f"{client_name}.key"), key_path, 0o600)
+
+def _target(key, client_name, client_dir):
+    return os.path.join(client_dir, PROFILE_TARGETS[key].format(name=client_name, filevpn=FILEVPN_NAME))
+
+def client_paths(client_name, client_type, client_dir=CLIENT_DIR):
+    # Все пути, по которым могут лежать профили клиента: client_type — "openvpn" или "wireguard"
+    protocols = CLIENT_PROTOCOLS[client_type]
+    return [_target(key, client_name, client_dir) for key in PROFILE_TARGETS if key[0] in protocols]
+
+class ProfileCatalog:
+    # (клиент, протокол, вариант, транспорт) -> путь существующего профиля.
+    # Обновляется там, где профили пишутся и удаляются, поэтому выдача и очистка
+    # не обходят каталоги и не сравнивают имена файлов по подстроке.
+
+    def __init__(self, client_dir=CLIENT_DIR):
+        self.client_dir = client_dir
+        self._entries = {}
+
+    def path(self, client_name, protocol, variant, transport=None):
+        return _target((protocol, variant, transport), client_name, self.client_dir)
+
+    def refresh(self, client_names):
+        # По одному stat на возможный профиль клиента
+        for name in client_names:
+            found = {}
+            for key in PROFILE_TARGETS:
+                path = _target(key, name, self.client_dir)
+                if os.path.exists(path):
+                    found[key] = path
+            if found:
+                self._entries[name] = found
+            else:
+                self._entries.pop(name, None)
+
+    def load(self, client_names):
+        self._entries = {}
+        self.refresh(client_names)
+
+    def get(self, client_name, protocol, variant, transport=None):
+        # Файл мог появиться или пропасть в обход бота (client.sh из консоли) — сверяем один путь
+        key = (protocol, variant, transport)
+        path = self._entries.get(client_name, {}).get(key) or _target(key, client_name, self.client_dir)
+        if os.path.exists(path):
+            self._entries.setdefault(client_name, {})[key] = path
+            return path
+        self._forget(client_name, [key])
+        return None
+
+    def find(self, client_name, protocol=None, variant=None, transports=None):
+        entries = self._entries.get(client_name, {})
+        return [
+            entries[key] for key in PROFILE_TARGETS
+            if key in entries
+            and (protocol is None or key[0] == protocol)
+            and (variant is None or key[1] == variant)
+            and (transports is None or key[2] in transports)
+        ]
+
+    def remove(self, client_name, client_type):
+        # Удаляет профили клиента по точным путям, даже если каталог о них не знал
+        protocols = CLIENT_PROTOCOLS[client_type]
+        keys = [key for key in PROFILE_TARGETS if key[0] in protocols]
+        removed = []
+        for key in keys:
+            path = _target(key, client_name, self.client_dir)
+            try:
+                os.remove(path)
+                removed.append(path)
+            except FileNotFoundError:
+                pass
+        self._forget(client_name, keys)
+        return removed
+
+    def _forget(self, client_name, keys):
+        entries = self._entries.get(client_name)
+        if entries is None:
+            return
+        for key in keys:
+            entries.pop(key, None)
+        if not entries:
+            self._entries.pop(client_name, None)
+
+profile_catalog = ProfileCatalog()
+
+def openvpn_profiles(context, client_name, client_dir=CLIENT_DIR, templates=None):
+    # Все варианты профилей OpenVPN клиента в памяти: {путь: текст}
+    templates = templates or openvpn_templates
+    variables = dict(context)
+    variables["CLIENT_NAME"] = client_name
+    variables["SERVER_HOST"] = context.get("OPENVPN_HOST") or context["SERVER_IP"]
+    variables["CLIENT_CERT"] = _read(os.path.join(CLIENT_KEYS_DIR, f"{client_name}.crt"), "BEGIN CERTIFICATE")
+    variables["CLIENT_KEY"] = _read(os.path.join(CLIENT_KEYS_DIR, f"{client_name}.key"))
+    if not variables["CA_CERT"] or not variables["CLIENT_CERT"] or not variables["CLIENT_KEY"]:
+        raise ValueError(f"Can't load client keys for {client_name}")
+    profiles = {}
+    for template_name, key in OPENVPN_PROFILES:
+        template = templates.get(template_name)
+        if template:
+            profiles[_target(key, client_name, client_dir)] = template.render(variables)
+    return profiles
+
+def wireguard_profiles(context, peer, client_ips, client_dir=CLIENT_DIR, templates=None):
+    # peer — ключи клиента, client_ips — {интерфейс: адрес клиента без маски}
+    templates = templates or wireguard_templates
+    variables = dict(context)
+    variables["CLIENT_NAME"] = peer["client"]
+    variables["SERVER_HOST"] = context.get("WIREGUARD_HOST") or context["SERVER_IP"]
+    variables["CLIENT_PRIVATE_KEY"] = peer["private_key"]
+    variables["CLIENT_PUBLIC_KEY"] = peer["public_key"]
+    variables["CLIENT_PRESHARED_KEY"] = peer["preshared_key"]
+    profiles = {}
+    for template_name, iface, key in WIREGUARD_PROFILES:
+        template = templates.get(template_name)
+        if template and iface in client_ips:
+            variables["CLIENT_IP"] = client_ips[iface]
+            profiles[_target(key, peer["client"], client_dir)] = template.render(variables)
+    return profiles
+
+def write_profiles(profiles):
+    for path, text in profiles.items():
+        write_atomic(path, text)
+    return list(profiles)
+
+def render_openvpn_client(context, client_name):
+    install_client_cert(client_name)
+    paths = write_profiles(openvpn_profiles(context, client_name))
+    profile_catalog.refresh([client_name])
+    return paths
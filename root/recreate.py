@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from bulk import CLIENT_NAME_RE, BulkProgress
+from file_cache import file_id_cache
+from profiles import (
+    CLIENT_DIR, PKI_DIR, WG_KEY_FILE, client_paths, load_context, openvpn_templates, profile_catalog,
+    wireguard_templates, write_atomic,
+)
+from registry import client_registry
+from wireguard import WG_DIR, WG_INTERFACES, parse_peers
+import recreate_worker
+
+STAGING_DIR = CLIENT_DIR + ".staging"
+MANIFEST_FILE = os.path.join(CLIENT_DIR, ".manifest.json")
+RECREATE_WORKERS = int(os.getenv("RECREATE_WORKERS", str(os.cpu_count() or 2)))
+CHUNKS_PER_WORKER = 4
+PROGRESS_TITLE = "🔄 <b>Пересоздание файлов VPN</b>"
+
+def _digest(*parts):
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+def _file_digest(*paths):
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def plan(context, openvpn_clients):
+    # Задание на клиента: (ключ, протокол, имя, хэш входных данных, данные для рендера).
+    # Хэш покрывает шаблоны, общие настройки (хост, IP, CA, ключи сервера) и ключи самого клиента.
+    settings = json.dumps(context, sort_keys=True)
+    jobs, errors = [], []
+
+    openvpn_base = _digest(openvpn_templates.digest(), settings)
+    for name in openvpn_clients:
+        try:
+            digest = _file_digest(
+                os.path.join(PKI_DIR, "issued", f"{name}.crt"), os.path.join(PKI_DIR, "private", f"{name}.key")
+            )
+        except OSError as e:
+            errors.append((name, f"OpenVPN: {e}"))
+            continue
+        jobs.append((f"openvpn:{name}", "openvpn", name, _digest(openvpn_base, digest), None))
+
+    # Как в client.sh: ключи клиента берутся из блока antizapret, а если его нет — из vpn.
+    # Адреса не меняются — серверные конфиги WireGuard не трогаем и syncconf не нужен.
+    peers, ips = {}, {}
+    for iface in WG_INTERFACES:
+        try:
+            blocks = parse_peers(os.path.join(WG_DIR, f"{iface}.conf"))
+        except OSError:
+            continue
+        for peer in blocks:
+            name = peer["client"]
+            if not CLIENT_NAME_RE.match(name) or "allowed_ips" not in peer:
+                continue
+            peers.setdefault(name, peer)
+            ips.setdefault(name, {})[iface] = peer["allowed_ips"].split("/")[0]
+    wireguard_base = _digest(wireguard_templates.digest(), settings)
+    for name in sorted(peers):
+        payload = {"peer": peers[name], "ips": ips[name]}
+        digest = _digest(wireguard_base, json.dumps(payload, sort_keys=True))
+        jobs.append((f"wireguard:{name}", "wireguard", name, digest, payload))
+    return jobs, errors
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get("entries", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+def _fresh(entry, digest):
+    return bool(entry) and entry["hash"] == digest and all(
+        os.path.exists(os.path.join(CLIENT_DIR, path)) for path in entry["files"]
+    )
+
+@contextlib.contextmanager
+def _without_main_module():
+    # multiprocessing передаёт каждому процессу пула путь __main__, и тот импортировал бы bot.py
+    # как __mp_main__. Пока процессы запускаются (в submit), прячем путь: им нужен только recreate_worker.
+    main = sys.modules["__main__"]
+    path = main.__dict__.pop("__file__", None)
+    try:
+        yield
+    finally:
+        if path is not None:
+            main.__file__ = path
+
+def promote(results, entries):
+    # Каталог целиком не подменяется: файлы переносятся по одному через os.replace. Каждый отдельный
+    # профиль всегда целый (старый или новый), но во время переноса часть профилей уже новая, часть ещё старая.
+    # Файлы, которые отрисовались с ошибкой, остаются прежними, а их старая запись — с прежним хэшем,
+    # поэтому следующий запуск попробует их ещё раз.
+    replaced = []
+    for key, _, digest, files, error in results:
+        if error:
+            continue
+        for path in files:
+            target = os.path.join(CLIENT_DIR, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(STAGING_DIR, path), target)
+            replaced.append(target)
+        entries[key] = {"hash": digest, "files": files}
+    return replaced
+
+def sweep(entries, clients):
+    # Удаляем профили удалённых клиентов (то, что раньше делал find -delete в client.sh 7).
+    # clients — {протокол: имена} на момент завершения: если кого-то добавили во время пересоздания,
+    # его файлы не трогаем.
+    keep = {os.path.join(CLIENT_DIR, path) for entry in entries.values() for path in entry["files"]}
+    for protocol, names in clients.items():
+        for name in names:
+            keep.update(client_paths(name, protocol, CLIENT_DIR))
+    removed = []
+    for root, _, files in os.walk(CLIENT_DIR):
+        for file in files:
+            path = os.path.join(root, file)
+            if file.startswith(".") or path in keep:
+                continue
+            try:
+                os.remove(path)
+                removed.append(path)
+            except FileNotFoundError:
+                pass
+    return removed
+
+class RecreateJob:
+    # Инкрементальное пересоздание профилей всех клиентов (замена client.sh 7):
+    #  - перерисовываются только клиенты, у которых изменился хэш входных данных в манифесте;
+    #  - рендер раскладывается по пулу процессов в staging-каталог;
+    #  - готовые файлы переносятся в /root/antizapret/client по одному через os.replace: отдельный профиль
+    #    не бывает недописанным и не пропадает, но каталог целиком атомарно не подменяется;
+    #  - прогресс показывается админу, жёсткого таймаута нет.
+
+    def __init__(self, execute_script):
+        self.execute_script = execute_script
+        self._lock = asyncio.Lock()
+
+    def busy(self):
+        return self._lock.locked()
+
+    async def run(self, report, full=False):
+        async with self._lock:
+            if not os.path.exists(os.path.join(PKI_DIR, "ca.crt")) or not os.path.exists(WG_KEY_FILE):
+                # Серверных ключей ещё нет: их и первого клиента создаёт client.sh
+                try:
+                    await report(f"{PROGRESS_TITLE}\n\nСоздание серверных ключей...")
+                except Exception as e:
+                    print(f"[recreate] Не удалось обновить прогресс: {e}")
+                result = await self.execute_script("7", timeout=None)
+                return {"fallback": result}
+
+            context = await load_context()
+            client_registry.refresh()
+            openvpn = [n for n in client_registry.clients("openvpn") if CLIENT_NAME_RE.match(n)]
+            jobs, errors = await asyncio.to_thread(plan, context, openvpn)
+            manifest = await asyncio.to_thread(load_manifest)
+            changed = [job for job in jobs if full or not _fresh(manifest.get(job[0]), job[3])]
+            # Записи неизменённых клиентов, а для изменённых — старые (на случай ошибки рендера)
+            entries = {job[0]: manifest[job[0]] for job in jobs if job[0] in manifest}
+
+            summary = {
+                "total": len(jobs),
+                "rendered": 0,
+                "unchanged": len(jobs) - len(changed),
+                "removed": 0,
+                "failed": list(errors),
+            }
+            progress = BulkProgress(report, len(changed), PROGRESS_TITLE)
+            await progress.update("Создание профилей", 0, force=True)
+            await asyncio.to_thread(shutil.rmtree, STAGING_DIR, True)
+            try:
+                results = await self._render(context, changed, progress)
+                for _, name, _, _, error in results:
+                    if error:
+                        summary["failed"].append((name, error))
+                replaced = await asyncio.to_thread(promote, results, entries)
+                summary["rendered"] = sum(1 for r in results if not r[4])
+
+                client_registry.refresh()
+                clients = {protocol: client_registry.clients(protocol) for protocol in ("openvpn", "wireguard")}
+                removed = await asyncio.to_thread(sweep, entries, clients)
+                await asyncio.to_thread(profile_catalog.load, set().union(*clients.values()))
+                summary["removed"] = len(removed)
+                await asyncio.to_thread(
+                    write_atomic, MANIFEST_FILE, json.dumps({"entries": entries}, ensure_ascii=False, sort_keys=True)
+                )
+            finally:
+                await asyncio.to_thread(shutil.rmtree, STAGING_DIR, True)
+            await file_id_cache.invalidate_paths(replaced + removed)
+            return summary
+
+    async def _render(self, context, jobs, progress):
+        if not jobs:
+            return []
+        workers = max(1, min(RECREATE_WORKERS, len(jobs)))
+        size = max(1, -(-len(jobs) // (workers * CHUNKS_PER_WORKER)))
+        chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+        loop = asyncio.get_running_loop()
+        # Не fork: у бота есть потоки (база, to_thread), и дочерний процесс мог бы унаследовать
+        # чужую захваченную блокировку. Процессы forkserver стартуют с чистого однопоточного сервера,
+        # который заранее загружает только recreate_worker.
+        mp_context = multiprocessing.get_context("forkserver")
+        mp_context.set_forkserver_preload(["recreate_worker"])
+        pool = ProcessPoolExecutor(
+            workers,
+            mp_context=mp_context,
+            initializer=recreate_worker.init,
+            initargs=(context, (openvpn_templates, wireguard_templates)),
+        )
+        results = []
+        try:
+            with _without_main_module():
+                futures = [
+                    loop.run_in_executor(pool, recreate_worker.render_chunk, chunk, STAGING_DIR) for chunk in chunks
+                ]
+            for future in asyncio.as_completed(futures):
+                results.extend(await future)
+                await progress.update("Создание профилей", len(results))
+        finally:
+            await asyncio.to_thread(pool.shutdown, True, cancel_futures=True)
+        return results
@@ -0,0 +1,31 @@
+import os
+
+from profiles import install_client_cert, openvpn_profiles, wireguard_profiles, write_profiles
+
+# Код процессов пула пересоздания. Импорты модуля без побочных эффектов: forkserver загружает его
+# заранее, а bot.py (aiogram, Bot, синглтоны) в процессы пула не попадает.
+
+# Состояние процесса: задаётся один раз в init
+_worker = {}
+
+def init(context, templates):
+    # Контекст и уже скомпилированные шаблоны передаются явно, один раз на процесс
+    _worker["context"] = context
+    _worker["openvpn"], _worker["wireguard"] = templates
+
+def render_chunk(chunk, staging):
+    # Профили пишутся в staging, в рабочий каталог их переносит recreate.promote
+    context = _worker["context"]
+    results = []
+    for key, kind, name, digest, payload in chunk:
+        try:
+            if kind == "openvpn":
+                install_client_cert(name)
+                rendered = openvpn_profiles(context, name, staging, _worker["openvpn"])
+            else:
+                rendered = wireguard_profiles(context, payload["peer"], payload["ips"], staging, _worker["wireguard"])
+            write_profiles(rendered)
+            results.append((key, name, digest, sorted(os.path.relpath(p, staging) for p in rendered), None))
+        except Exception as e:
+            results.append((key, name, digest, None, str(e)))
+    return results
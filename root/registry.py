@@ -0,0 +1,96 @@
+import asyncio
+import os
+import re
+
+ISSUED_DIR = "/etc/openvpn/easyrsa3/pki/issued"
+WG_CONFIGS = ["/etc/wireguard/antizapret.conf", "/etc/wireguard/vpn.conf"]
+SERVER_CERT_NAME = "antizapret-server"
+WATCH_INTERVAL = 5
+
+_WG_CLIENT_RE = re.compile(r"^# Client\s*=\s*(\S+)\s*$")
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+class ClientRegistry:
+    # Список клиентов в памяти: OpenVPN — по pki/issued, WireGuard — по серверным конфигам.
+    # Обновляется по mtime (фоновый watch) и сразу после client.sh 1/2/4/5/7.
+
+    def __init__(self, issued_dir=ISSUED_DIR, wg_configs=WG_CONFIGS):
+        self.issued_dir = issued_dir
+        self.wg_configs = list(wg_configs)
+        self._names = {"openvpn": set(), "wireguard": set()}
+        self._sorted = {"openvpn": [], "wireguard": []}
+        self._stamps = {"openvpn": None, "wireguard": None}
+        self._loaded = {"openvpn": False, "wireguard": False}
+
+    def _stamp(self, vpn_type):
+        if vpn_type == "openvpn":
+            return _mtime(self.issued_dir)
+        return tuple(_mtime(p) for p in self.wg_configs)
+
+    def _load_openvpn(self):
+        try:
+            files = os.listdir(self.issued_dir)
+        except OSError:
+            return set()
+        return {
+            f[:-len(".crt")]
+            for f in files
+            if f.endswith(".crt") and f[:-len(".crt")] != SERVER_CERT_NAME
+        }
+
+    def _load_wireguard(self):
+        names = set()
+        for path in self.wg_configs:
+            try:
+                with open(path, "r") as f:
+                    for line in f:
+                        m = _WG_CLIENT_RE.match(line)
+                        if m:
+                            names.add(m.group(1))
+            except OSError:
+                continue
+        return names
+
+    def _reload(self, vpn_type):
+        stamp = self._stamp(vpn_type)
+        names = self._load_openvpn() if vpn_type == "openvpn" else self._load_wireguard()
+        self._names[vpn_type] = names
+        self._sorted[vpn_type] = sorted(names)
+        self._stamps[vpn_type] = stamp
+        self._loaded[vpn_type] = True
+
+    def _ensure(self, vpn_type):
+        if not self._loaded[vpn_type]:
+            self._reload(vpn_type)
+
+    def refresh(self):
+        for vpn_type in self._names:
+            if not self._loaded[vpn_type] or self._stamp(vpn_type) != self._stamps[vpn_type]:
+                self._reload(vpn_type)
+
+    def invalidate(self, vpn_type=None):
+        for t in ([vpn_type] if vpn_type else list(self._loaded)):
+            self._loaded[t] = False
+
+    def clients(self, vpn_type="openvpn"):
+        self._ensure(vpn_type)
+        return list(self._sorted[vpn_type])
+
+    def contains(self, vpn_type, client_name):
+        self._ensure(vpn_type)
+        return client_name in self._names[vpn_type]
+
+    async def watch(self, interval=WATCH_INTERVAL):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[ClientRegistry] Ошибка обновления списка клиентов: {e}")
+            await asyncio.sleep(interval)
+
+client_registry = ClientRegistry()
@@ -0,0 +1,109 @@
+import asyncio
+import inspect
+import os
+import signal
+
+CLIENT_SCRIPT = "/root/antizapret/client.sh"
+DEFAULT_TIMEOUT = 30
+MAX_CONCURRENT = int(os.getenv("SUBPROCESS_CONCURRENCY", "4"))
+
+_semaphore = None
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    return _semaphore
+
+def _kill(proc):
+    # client.sh порождает easyrsa/openssl/wg — убиваем всю группу процессов
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+async def _acquire(semaphore, timeout):
+    # Ожидание свободного слота входит в таймаут команды: вызывающий не висит в очереди бесконечно
+    acquire = asyncio.ensure_future(semaphore.acquire())
+    try:
+        done, _ = await asyncio.wait({acquire}, timeout=timeout)
+    except BaseException:
+        # Вызывающего отменили: слот, если он всё же достанется, сразу возвращаем
+        acquire.cancel()
+        acquire.add_done_callback(lambda t: t.cancelled() or t.exception() or semaphore.release())
+        raise
+    if done:
+        return True
+    acquire.cancel()
+    try:
+        await acquire
+    except asyncio.CancelledError:
+        return False
+    # Слот освободился одновременно с таймаутом
+    return True
+
+async def run_command(cmd, timeout=DEFAULT_TIMEOUT, on_line=None, env=None, cwd=None):
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    semaphore = _get_semaphore()
+    if not await _acquire(semaphore, timeout):
+        return {
+            "returncode": 1,
+            "stdout": "",
+            "stderr": f"Превышено время ожидания очереди ({timeout} с): {' '.join(cmd)}",
+        }
+    try:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=env,
+                cwd=cwd,
+                start_new_session=True,
+            )
+        except Exception as e:
+            return {"returncode": 1, "stdout": "", "stderr": str(e)}
+
+        stdout_lines = []
+
+        async def read_stdout():
+            async for raw in proc.stdout:
+                line = raw.decode(errors="replace")
+                stdout_lines.append(line)
+                if on_line:
+                    res = on_line(line.rstrip("\n"))
+                    if inspect.isawaitable(res):
+                        await res
+
+        remaining = None if deadline is None else max(deadline - loop.time(), 0)
+        try:
+            _, stderr, returncode = await asyncio.wait_for(
+                asyncio.gather(read_stdout(), proc.stderr.read(), proc.wait()),
+                remaining,
+            )
+        except asyncio.TimeoutError:
+            _kill(proc)
+            await proc.wait()
+            return {
+                "returncode": 1,
+                "stdout": "".join(stdout_lines),
+                "stderr": f"Превышено время выполнения ({timeout} с): {' '.join(cmd)}",
+            }
+        except BaseException:
+            _kill(proc)
+            raise
+        return {
+            "returncode": returncode,
+            "stdout": "".join(stdout_lines),
+            "stderr": stderr.decode(errors="replace"),
+        }
+    finally:
+        semaphore.release()
+
+async def run_client_script(option, *args, timeout=DEFAULT_TIMEOUT, on_line=None, env=None):
+    cmd = [CLIENT_SCRIPT, str(option), *[str(a) for a in args]]
+    return await run_command(cmd, timeout=timeout, on_line=on_line, env=env)
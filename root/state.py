@@ -0,0 +1,130 @@
+import asyncio
+
+from db import apply_user_state_ops, load_user_state
+
+FLUSH_DELAY = 1.0
+FLUSH_RETRY_DELAY = 5.0
+
+class StateStore:
+    # Состояние пользователей держим в памяти, из vpn.db оно читается один раз при старте.
+    # Изменения копятся и сбрасываются в базу отложенно (write-behind) одной транзакцией.
+
+    def __init__(self):
+        self._users = {}
+        self._approved = {}
+        self._pending = {}
+        self._emojis = {}
+        self._last_menus = {}
+
+        self._ops = []
+        self._flush_handle = None
+
+    async def load(self):
+        data = await load_user_state()
+        self._users = dict.fromkeys(data["users"])
+        self._approved = dict.fromkeys(data["approved"])
+        self._pending = data["pending"]
+        self._emojis = data["emojis"]
+        self._last_menus = data["last_menus"]
+
+    # --- Все пользователи ---
+    def add_user(self, user_id):
+        user_id = int(user_id)
+        if user_id not in self._users:
+            self._users[user_id] = None
+            self._queue("add_user", (user_id,))
+
+    def remove_user(self, user_id):
+        user_id = int(user_id)
+        if user_id in self._users:
+            del self._users[user_id]
+            self._queue("remove_user", (user_id,))
+
+    def user_ids(self):
+        return list(self._users)
+
+    # --- Одобренные ---
+    def is_approved(self, user_id):
+        return int(user_id) in self._approved
+
+    def approve(self, user_id):
+        user_id = int(user_id)
+        if user_id not in self._approved:
+            self._approved[user_id] = None
+            self._queue("approve", (user_id,))
+
+    def unapprove(self, user_id):
+        user_id = int(user_id)
+        if user_id in self._approved:
+            del self._approved[user_id]
+            self._queue("unapprove", (user_id,))
+
+    # --- Заявки ---
+    def is_pending(self, user_id):
+        return int(user_id) in self._pending
+
+    def add_pending(self, user_id, username, fullname):
+        user_id = int(user_id)
+        self._pending[user_id] = {"username": username, "fullname": fullname}
+        self._queue("add_pending", (user_id, username, fullname))
+
+    def remove_pending(self, user_id):
+        user_id = int(user_id)
+        if self._pending.pop(user_id, None) is not None:
+            self._queue("remove_pending", (user_id,))
+
+    def pending(self):
+        return dict(self._pending)
+
+    # --- Смайлы ---
+    def get_emoji(self, user_id):
+        return self._emojis.get(int(user_id), "")
+
+    def get_emojis(self, user_ids):
+        return {uid: self._emojis[int(uid)] for uid in user_ids if uid and int(uid) in self._emojis}
+
+    def set_emoji(self, user_id, emoji):
+        user_id = int(user_id)
+        if emoji:
+            self._emojis[user_id] = emoji
+            self._queue("set_emoji", (user_id, emoji))
+        elif self._emojis.pop(user_id, None) is not None:
+            self._queue("remove_emoji", (user_id,))
+
+    # --- Последние меню ---
+    def get_last_menus(self, user_id):
+        return list(self._last_menus.get(int(user_id), []))
+
+    def set_last_menus(self, user_id, ids):
+        user_id = int(user_id)
+        if self._last_menus.get(user_id, []) == list(ids):
+            return
+        self._last_menus[user_id] = list(ids)
+        self._queue("clear_last_menus", (user_id,))
+        for mid in ids:
+            self._queue("add_last_menu", (user_id, mid))
+
+    # --- Сохранение ---
+    def _queue(self, name, params):
+        self._ops.append((name, params))
+        self._schedule(FLUSH_DELAY)
+
+    def _schedule(self, delay):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(delay, lambda: loop.create_task(self.flush()))
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        ops, self._ops = self._ops, []
+        if not ops:
+            return
+        try:
+            await apply_user_state_ops(ops)
+        except Exception as e:
+            self._ops = ops + self._ops
+            print(f"[StateStore] Не удалось сохранить состояние пользователей: {e}")
+            # Повторяем сами, не дожидаясь следующего изменения
+            self._schedule(FLUSH_RETRY_DELAY)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули бота импортируются из root/ по короткому имени (from db import ...), как при запуске bot.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import db
+from payments import PaymentService, configure_yookassa
+
+USER_ID = 1001
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append((chat_id, text))
+
+def _stub_api(statuses, calls):
+    # Заглушка API ЮKassa: GET /payments/<id> отдаёт статус из statuses, неизвестный id — 404
+    async def get_payment(request):
+        payment_id = request.match_info["payment_id"]
+        calls.append(payment_id)
+        if payment_id not in statuses:
+            return web.json_response(
+                {"type": "error", "id": "err", "code": "not_found", "description": "Payment not found"}, status=404
+            )
+        return web.json_response({
+            "id": payment_id,
+            "status": statuses[payment_id],
+            "paid": statuses[payment_id] == "succeeded",
+            "amount": {"value": "100.00", "currency": "RUB"},
+            "created_at": "2026-01-01T00:00:00.000Z",
+            "test": True,
+            "refundable": False,
+            "metadata": {"user_id": str(USER_ID)},
+        })
+
+    app = web.Application()
+    app.router.add_get("/payments/{payment_id}", get_payment)
+    return app
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "vpn.db"))
+    asyncio.run(db.init_db())
+    yield
+    asyncio.run(db.close_db())
+
+async def _notify(statuses, local_payments, notifications):
+    calls = []
+    bot = FakeBot()
+    service = PaymentService(bot)
+    for payment_id in local_payments:
+        await db.create_payment(payment_id, USER_ID, 100.0, "pending", "https://example.com/pay")
+    async with TestServer(_stub_api(statuses, calls)) as api:
+        configure_yookassa("shop", "secret", api_url=str(api.make_url("")))
+        app = web.Application()
+        service.register(app, "/yookassa")
+        async with TestClient(TestServer(app)) as client:
+            codes = []
+            for payment_id in notifications:
+                response = await client.post(
+                    "/yookassa", json={"event": "payment.succeeded", "object": {"id": payment_id}}
+                )
+                codes.append(response.status)
+    return codes, await db.get_balance(USER_ID), bot.messages, calls
+
+def test_duplicate_notification_credits_once(database):
+    codes, balance, messages, _ = asyncio.run(_notify({"p1": "succeeded"}, ["p1"], ["p1", "p1"]))
+    assert codes == [200, 200]
+    assert balance == 100.0
+    assert len(messages) == 1
+
+def test_unconfirmed_payment_is_not_credited(database):
+    codes, balance, messages, _ = asyncio.run(_notify({"p2": "pending"}, ["p2"], ["p2"]))
+    assert codes == [200]
+    assert balance == 0
+    assert messages == []
+
+def test_unknown_payment_is_acknowledged(database):
+    codes, balance, _, calls = asyncio.run(_notify({"p3": "succeeded"}, [], ["p3"]))
+    assert codes == [200]
+    assert balance == 0
+    # Свою базу проверяем до API: чужой платёж не зачисляется и не запрашивается
+    assert calls == []
+
+def test_payment_missing_in_yookassa_is_acknowledged(database):
+    codes, balance, _, calls = asyncio.run(_notify({}, ["p4"], ["p4"]))
+    assert codes == [200]
+    assert balance == 0
+    assert calls == ["p4"]
@@ -0,0 +1,45 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, create_app
+
+SECRET = "test-secret"
+UPDATE = {
+    "update_id": 42,
+    "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "/start"},
+}
+
+class FakeDispatcher:
+    # Вместо aiogram.Dispatcher: запоминает, какие обновления до него дошли
+    def __init__(self):
+        self.updates = []
+        self.received = asyncio.Event()
+
+    async def feed_update(self, bot, update):
+        self.updates.append(update)
+        self.received.set()
+
+async def _post(headers):
+    dp = FakeDispatcher()
+    app = create_app(dp, bot=object(), secret=SECRET, path="/telegram", workers=1)
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post("/telegram", json=UPDATE, headers=headers)
+        if response.status == 200:
+            await asyncio.wait_for(dp.received.wait(), 5)
+        return response.status, dp.updates
+
+def test_wrong_secret_is_rejected():
+    status, updates = asyncio.run(_post({SECRET_HEADER: "wrong"}))
+    assert status == 401
+    assert updates == []
+
+def test_missing_secret_is_rejected():
+    status, updates = asyncio.run(_post({}))
+    assert status == 401
+    assert updates == []
+
+def test_correct_secret_dispatches_update():
+    status, updates = asyncio.run(_post({SECRET_HEADER: SECRET}))
+    assert status == 200
+    assert [u.update_id for u in updates] == [42]
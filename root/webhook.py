@@ -0,0 +1,106 @@
+import asyncio
+import hmac
+import os
+import signal
+
+from aiohttp import web
+from aiogram import types
+
+# Режим работы: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class UpdateQueue:
+    # Обновления от Telegram обрабатывают WEBHOOK_WORKERS воркеров.
+    # Очередь ограничена: если воркеры не успевают, запрос ждёт места, и Telegram сам притормаживает.
+
+    def __init__(self, dp, bot, workers=WEBHOOK_WORKERS):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=workers * 4)
+        self._tasks = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[webhook] Не обработано обновлений при остановке: {self.queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def put(self, update):
+        await self.queue.put(update)
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                print(f"[webhook] Ошибка обработки update_id={update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+# Типизированный ключ приложения: строковый ключ aiohttp помечает NotAppKeyWarning
+UPDATES_KEY = web.AppKey("updates", UpdateQueue)
+
+def create_app(dp, bot, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH, workers=WEBHOOK_WORKERS):
+    # Отдельная фабрика, чтобы приложение можно было поднять в тесте и слать ему обновления напрямую.
+    # На этом же приложении висят и другие HTTP-обработчики (уведомления о платежах).
+    updates = UpdateQueue(dp, bot, workers)
+
+    async def handle_update(request):
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+            update = types.Update.model_validate(data, context={"bot": bot})
+        except Exception as e:
+            print(f"[webhook] Некорректное обновление: {e}")
+            return web.Response(status=400)
+        await updates.put(update)
+        return web.Response()
+
+    async def on_startup(app):
+        app[UPDATES_KEY].start()
+
+    async def on_cleanup(app):
+        await app[UPDATES_KEY].stop()
+
+    app = web.Application()
+    app[UPDATES_KEY] = updates
+    app.router.add_post(path, handle_update)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+async def serve(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    print(f"[webhook] Слушаем http://{host}:{port}")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
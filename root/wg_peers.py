@@ -0,0 +1,304 @@
+import asyncio
+import base64
+import ipaddress
+import os
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+from file_cache import file_id_cache
+from profiles import WG_KEY_FILE, load_context, profile_catalog, wireguard_profiles, write_atomic, write_profiles
+from registry import client_registry
+from wireguard import WG_DIR, WG_INTERFACES, sync_interfaces
+
+PEER_KEYS = ("private_key", "public_key", "preshared_key")
+
+class PeerError(Exception):
+    pass
+
+def _b64(raw):
+    return base64.b64encode(raw).decode()
+
+def generate_private_key():
+    return _b64(X25519PrivateKey.generate().private_bytes_raw())
+
+def public_key(private_key):
+    # То же, что `wg pubkey`
+    return _b64(X25519PrivateKey.from_private_bytes(base64.b64decode(private_key)).public_key().public_bytes_raw())
+
+def generate_preshared_key():
+    return _b64(os.urandom(32))
+
+def generate_keys():
+    key = X25519PrivateKey.generate()
+    return {
+        "private_key": _b64(key.private_bytes_raw()),
+        "public_key": _b64(key.public_key().public_bytes_raw()),
+        "preshared_key": generate_preshared_key(),
+    }
+
+class ServerConfig:
+    # Серверный конфиг интерфейса в памяти: всё до первого клиента хранится как есть,
+    # клиенты — блоками в формате client.sh ("# Client =", "# PrivateKey =", [Peer] ... AllowedIPs).
+    # Занятые адреса подсети — битовая маска от адреса сети, поэтому подсеть может быть любой, а не только /24.
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.header = []
+        self.footer = []
+        self.peers = {}
+        self.network = None
+        self.dirty = False
+        self._used = 0
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return
+        header, footer, peers, current = [], [], {}, None
+        with open(self.path, "r", encoding="utf-8") as f:
+            for raw in f:
+                line = raw.rstrip("\n")
+                stripped = line.strip()
+                if stripped.startswith("# Client ="):
+                    name = stripped.split("=", 1)[1].strip()
+                    current = peers[name] = {"client": name, "extra": []}
+                elif current is not None:
+                    if stripped.startswith("# PrivateKey ="):
+                        current["private_key"] = stripped.split("=", 1)[1].strip()
+                    elif stripped.startswith("PublicKey ="):
+                        current["public_key"] = stripped.split("=", 1)[1].strip()
+                    elif stripped.startswith("PresharedKey ="):
+                        current["preshared_key"] = stripped.split("=", 1)[1].strip()
+                    elif stripped.startswith("AllowedIPs ="):
+                        current["allowed_ips"] = stripped.split("=", 1)[1].strip()
+                        current = None
+                    elif stripped and stripped != "[Peer]":
+                        current["extra"].append(line)
+                elif not peers:
+                    header.append(line)
+                elif stripped:
+                    # Пиры, добавленные вручную без "# Client =", сохраняем в конце файла
+                    footer.append(line)
+        while header and not header[-1].strip():
+            header.pop()
+        self.header, self.footer, self.peers = header, footer, peers
+        self.network, server_ip = self._parse_address(header)
+        self._used = 0
+        if self.network:
+            self._mark(self.network.network_address)
+            self._mark(server_ip)
+            if self.network.prefixlen < 31:
+                self._mark(self.network.broadcast_address)
+            # Адреса пиров без "# Client =" тоже заняты
+            manual = [
+                {"allowed_ips": line.split("=", 1)[1]} for line in header + footer
+                if line.strip().startswith("AllowedIPs =")
+            ]
+            for peer in list(peers.values()) + manual:
+                for ip in self._peer_ips(peer):
+                    self._mark(ip)
+        self.mtime = mtime
+        self.dirty = False
+
+    @staticmethod
+    def _parse_address(header):
+        for line in header:
+            key, _, value = line.partition("=")
+            if key.strip() != "Address":
+                continue
+            for part in value.split(","):
+                try:
+                    interface = ipaddress.ip_interface(part.strip())
+                except ValueError:
+                    continue
+                if interface.version == 4:
+                    return interface.network, interface.ip
+        return None, None
+
+    @staticmethod
+    def _peer_ips(peer):
+        ips = []
+        for part in peer.get("allowed_ips", "").split(","):
+            try:
+                ips.append(ipaddress.ip_interface(part.strip()).ip)
+            except ValueError:
+                continue
+        return ips
+
+    def _offset(self, ip):
+        if ip is None or ip.version != 4 or ip not in self.network:
+            return None
+        return int(ip) - int(self.network.network_address)
+
+    def _mark(self, ip):
+        offset = self._offset(ip)
+        if offset is not None:
+            self._used |= 1 << offset
+
+    def _release(self, ip):
+        offset = self._offset(ip)
+        if offset is not None:
+            self._used &= ~(1 << offset)
+
+    def allocate(self):
+        if self.network is None:
+            raise PeerError(f"В {self.path} не найден IPv4 Address интерфейса")
+        # Младший нулевой бит маски — первый свободный адрес
+        offset = (~self._used & (self._used + 1)).bit_length() - 1
+        if offset >= self.network.num_addresses:
+            raise PeerError(f"В подсети {self.network} закончились свободные адреса")
+        self._used |= 1 << offset
+        return self.network.network_address + offset
+
+    def client_ip(self, name):
+        peer = self.peers.get(name)
+        ips = self._peer_ips(peer) if peer else []
+        return ips[0] if ips else None
+
+    def set_peer(self, name, keys, ip):
+        peer = self.peers.get(name)
+        # Адрес не менялся — оставляем AllowedIPs как есть (там могут быть и IPv6-адреса)
+        allowed_ips = peer["allowed_ips"] if peer and self.client_ip(name) == ip else f"{ip}/32"
+        if peer and all(peer.get(k) == keys[k] for k in PEER_KEYS) and peer.get("allowed_ips") == allowed_ips:
+            return
+        extra = peer["extra"] if peer else []
+        self.peers[name] = {"client": name, **keys, "allowed_ips": allowed_ips, "extra": extra}
+        self.dirty = True
+
+    def remove_peer(self, name):
+        peer = self.peers.pop(name, None)
+        if peer is None:
+            return False
+        for ip in self._peer_ips(peer):
+            self._release(ip)
+        self.dirty = True
+        return True
+
+    def render(self):
+        lines = self.header + [""]
+        for peer in self.peers.values():
+            lines += [
+                f"# Client = {peer['client']}",
+                f"# PrivateKey = {peer.get('private_key', '')}",
+                "[Peer]",
+                f"PublicKey = {peer.get('public_key', '')}",
+                f"PresharedKey = {peer.get('preshared_key', '')}",
+                *peer["extra"],
+                f"AllowedIPs = {peer.get('allowed_ips', '')}",
+                "",
+            ]
+        if self.footer:
+            lines += self.footer + [""]
+        return "\n".join(lines)
+
+    def save(self):
+        if not self.dirty:
+            return False
+        write_atomic(self.path, self.render(), mode=0o600)
+        self.mtime = os.stat(self.path).st_mtime_ns
+        self.dirty = False
+        return True
+
+class PeerManager:
+    # Добавление и удаление клиентов WireGuard/AmneziaWG без client.sh: ключи генерируются в процессе,
+    # свободные адреса берутся из битовой маски, оба серверных конфига пишутся атомарно,
+    # а wg syncconf выполняется один раз на пачку клиентов.
+
+    def __init__(self, wg_dir=WG_DIR, interfaces=WG_INTERFACES):
+        self.configs = {iface: ServerConfig(os.path.join(wg_dir, f"{iface}.conf")) for iface in interfaces}
+        self._lock = asyncio.Lock()
+
+    def ready(self):
+        # Ключи сервера и конфиги интерфейсов создаёт client.sh (initWireGuard)
+        return os.path.exists(WG_KEY_FILE) and all(os.path.exists(c.path) for c in self.configs.values())
+
+    async def add(self, names):
+        async with self._lock:
+            context = await load_context()
+            summary = await asyncio.to_thread(self._add, context, names)
+            await self._apply(summary, summary["added"])
+        return summary
+
+    async def delete(self, names):
+        async with self._lock:
+            summary = await asyncio.to_thread(self._delete, names)
+            await self._apply(summary, summary["deleted"])
+        return summary
+
+    def _load(self):
+        for config in self.configs.values():
+            config.load()
+
+    def _add(self, context, names):
+        # Существующему клиенту оставляем ключи и адреса (как client.sh 4) и просто перерисовываем профили
+        self._load()
+        summary = {"added": [], "failed": [], "synced": []}
+        peers = {}
+        for name in names:
+            existing = next((c.peers[name] for c in self.configs.values() if name in c.peers), None)
+            if existing and all(existing.get(k) for k in PEER_KEYS):
+                keys = {k: existing[k] for k in PEER_KEYS}
+            else:
+                keys = generate_keys()
+            ips, allocated = {}, []
+            try:
+                for iface, config in self.configs.items():
+                    ip = config.client_ip(name)
+                    if ip is None:
+                        ip = config.allocate()
+                        allocated.append(iface)
+                    ips[iface] = ip
+            except PeerError as e:
+                for iface in allocated:
+                    self.configs[iface]._release(ips[iface])
+                summary["failed"].append((name, str(e)))
+                continue
+            for iface, config in self.configs.items():
+                config.set_peer(name, keys, ips[iface])
+            peers[name] = ({"client": name, **keys}, {iface: str(ip) for iface, ip in ips.items()})
+        summary["synced"] = self._save()
+        # Профили пишем после серверных конфигов: у клиента не должно оказаться конфига с незаписанным пиром
+        for name, (peer, ips) in peers.items():
+            try:
+                write_profiles(wireguard_profiles(context, peer, ips))
+                profile_catalog.refresh([name])
+                summary["added"].append(name)
+            except Exception as e:
+                summary["failed"].append((name, str(e)))
+        return summary
+
+    def _delete(self, names):
+        self._load()
+        summary = {"deleted": [], "failed": [], "synced": []}
+        for name in names:
+            removed = [config.remove_peer(name) for config in self.configs.values()]
+            if not any(removed):
+                summary["failed"].append((name, "не найден"))
+                continue
+            profile_catalog.remove(name, "wireguard")
+            summary["deleted"].append(name)
+        summary["synced"] = self._save()
+        return summary
+
+    def _save(self):
+        saved = []
+        for iface, config in self.configs.items():
+            try:
+                if config.save():
+                    saved.append(iface)
+            except OSError:
+                # Модель в памяти разошлась с файлом: перечитаем при следующем вызове
+                config.mtime = None
+                raise
+        return saved
+
+    async def _apply(self, summary, names):
+        if summary["synced"]:
+            client_registry.invalidate("wireguard")
+            for iface, error in await sync_interfaces(summary["synced"]):
+                summary["failed"].append((f"wg {iface}", error))
+        for name in names:
+            await file_id_cache.invalidate(name)
+
+wg_peers = PeerManager()
@@ -0,0 +1,106 @@
+import os
+import time
+
+from runner import run_command
+
+WG_DIR = "/etc/wireguard"
+WG_INTERFACES = ["antizapret", "vpn"]
+ONLINE_HANDSHAKE_WINDOW = 180
+
+def parse_peers(path):
+    # Блоки клиентов в серверном конфиге, которые пишет client.sh:
+    # "# Client = имя", "# PrivateKey = ...", затем [Peer] с PublicKey/PresharedKey/AllowedIPs
+    peers = []
+    current = None
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("# Client ="):
+                current = {"client": line.split("=", 1)[1].strip()}
+                peers.append(current)
+            elif current is None:
+                continue
+            elif line.startswith("# PrivateKey ="):
+                current["private_key"] = line.split("=", 1)[1].strip()
+            elif line.startswith("PublicKey ="):
+                current["public_key"] = line.split("=", 1)[1].strip()
+            elif line.startswith("PresharedKey ="):
+                current["preshared_key"] = line.split("=", 1)[1].strip()
+            elif line.startswith("AllowedIPs ="):
+                current["allowed_ips"] = line.split("=", 1)[1].strip()
+                current = None
+    return peers
+
+class PeerIndex:
+    # PublicKey -> (клиент, интерфейс) по серверным конфигам /etc/wireguard/<интерфейс>.conf.
+    # Файл перечитывается только если изменился его mtime.
+
+    def __init__(self, wg_dir=WG_DIR, interfaces=WG_INTERFACES):
+        self.wg_dir = wg_dir
+        self.interfaces = list(interfaces)
+        self._files = {}
+
+    def _path(self, iface):
+        return os.path.join(self.wg_dir, f"{iface}.conf")
+
+    def refresh(self):
+        for iface in self.interfaces:
+            path = self._path(iface)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self._files.pop(iface, None)
+                continue
+            cached = self._files.get(iface)
+            if cached and cached[0] == mtime:
+                continue
+            try:
+                peers = parse_peers(path)
+            except OSError as e:
+                print(f"[PeerIndex] Не удалось прочитать {path}: {e}")
+                continue
+            self._files[iface] = (mtime, {p["public_key"]: p["client"] for p in peers if p.get("public_key")})
+
+    def lookup(self, iface, public_key):
+        self.refresh()
+        cached = self._files.get(iface)
+        return cached[1].get(public_key) if cached else None
+
+peer_index = PeerIndex()
+
+async def sync_interfaces(interfaces=WG_INTERFACES):
+    # Применяет серверные конфиги к поднятым интерфейсам без разрыва сессий; возвращает [(интерфейс, ошибка)]
+    errors = []
+    for iface in interfaces:
+        result = await run_command([
+            "bash", "-c",
+            f"if systemctl is-active --quiet wg-quick@{iface}; then "
+            f"wg syncconf {iface} <(wg-quick strip {iface} 2>/dev/null); fi",
+        ])
+        if result["returncode"] != 0:
+            errors.append((iface, result["stderr"].strip()))
+    return errors
+
+async def get_latest_handshakes():
+    result = await run_command(["wg", "show", "all", "latest-handshakes"], timeout=10)
+    handshakes = []
+    if result["returncode"] != 0:
+        print(f"[ERROR] wg show: {result['stderr'].strip()}")
+        return handshakes
+    for line in result["stdout"].splitlines():
+        parts = line.split()
+        if len(parts) == 3 and parts[2].isdigit():
+            handshakes.append((parts[0], parts[1], int(parts[2])))
+    return handshakes
+
+async def get_online_peers(window=ONLINE_HANDSHAKE_WINDOW):
+    peers = {}
+    now = time.time()
+    peer_index.refresh()
+    for iface, public_key, timestamp in await get_latest_handshakes():
+        if not timestamp or now - timestamp > window:
+            continue
+        client_name = peer_index.lookup(iface, public_key)
+        if client_name:
+            peers[client_name] = f"WG {iface}"
+    return peers